@@ -1,2 +1,3 @@
 from .trajtool import TrajTool
-from .calculation import getDistByCoord, getMileageByCoord
\ No newline at end of file
+from .calculation import getDistByCoord, getDistByCoordArray, getMileageByCoord
+from .grade import DEMSampler, TiledRaster, NpyTileStore
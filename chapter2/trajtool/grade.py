@@ -13,9 +13,12 @@ ELEVATION AND GRADE
 """
 
 
+import os
+import json
 import numpy as np
 import pandas as pd
 import warnings
+from collections import OrderedDict
 
 from osgeo import osr, gdal
 from .smoothing import expSmooth
@@ -30,14 +33,16 @@ def calGrade(
         newCol='grade[D]',
         fromDEM=False,
         dem=None,
+        segCol=None,
 ):
     """
     Match elevation to traj points and calculate the grade.
     distCol: column name of dist interval, meter.
     eleCol: column name of elevation, if fromDEM is True, then set eleCol to None.
     fromDEM: if True, extract elevation and grade from DEM.
-    dem: if fromDEM is True, input the DEM file.
+    dem: if fromDEM is True, input the DEM file or a DEMSampler, pass a DEMSampler to reuse it across calls.
     newCol: name of the new grade column.
+    segCol: column name of tripID, elevations are filled and smoothed per trip. If None, as one trip.
     """
     traj = traj.copy()
     
@@ -45,17 +50,19 @@ def calGrade(
         warnings.filterwarnings('ignore')
 
         # get elevation
-        eleMap = dem2ele(dem)
-        traj.loc[:, 'ele[m]'] = traj.apply(lambda x: eleMatch(x, dem, eleMap), axis=1)
-        traj.loc[:, 'ele[m]'] = expSmooth(traj['ele[m]'].to_list(), alpha=0.7)
+        sampler = dem if isinstance(dem, DEMSampler) else DEMSampler(dem)
+        ele = sampler.sample(traj[lonCol].to_numpy(), traj[latCol].to_numpy())
     
     else:  # elevation from altitude column
-        traj.loc[:, 'ele[m]'] = expSmooth(traj[eleCol].to_list(), alpha=0.7)
+        ele = traj[eleCol].to_numpy()
+
+    # points out of the DEM take the nearest valid elevation of the trip, NaN would run through the smoothing
+    seg = traj[segCol].to_numpy() if segCol else None
+    traj.loc[:, 'ele[m]'] = expSmooth(_fillNearest(ele, seg), alpha=0.7, seg=seg)
     
     # calculate road grade
-    a, b = traj['ele[m]'].diff(-1), (traj[distCol])
-    traj.loc[:, newCol] = 0
-    traj.loc[:, newCol] = np.divide(a, b, where=b!=0)  # avoid distance=0
+    a, b = traj['ele[m]'].diff(-1).to_numpy(), traj[distCol].to_numpy()
+    traj.loc[:, newCol] = np.divide(a, b, out=np.zeros(len(b)), where=b!=0)  # avoid distance=0
     traj.loc[:, newCol] = traj[newCol].apply(np.arctan)  # theta=arctan(grade)
     traj[newCol] = traj[newCol].astype('float32')
 
@@ -63,8 +70,231 @@ def calGrade(
 
     return traj
 
+def _fillNearest(values, seg=None):
+    """
+    Fill NaN values with the nearest valid value of the same segment, e.g., elevations out of the DEM.
+    seg: segment labels, contiguous segments (trips) are filled separately. If None, fill as one segment.
+    return: filled array, segments without any valid value are left NaN.
+    """
+    x = np.asarray(values, dtype='float64').copy()
+    n = len(x)
+    if n == 0:
+        return x
+    run = np.zeros(n, dtype='int64') if seg is None else np.cumsum(np.r_[True, np.asarray(seg)[1:] != np.asarray(seg)[:-1]])
+    pos = np.arange(n)
+    valid = ~np.isnan(x)
+
+    # previous and next valid positions, out of reach if in another segment
+    prev = np.maximum.accumulate(np.where(valid, pos, -1))
+    next_ = np.minimum.accumulate(np.where(valid, pos, n)[::-1])[::-1]
+    prevOk = (prev >= 0) & (run[np.maximum(prev, 0)] == run)
+    nextOk = (next_ < n) & (run[np.minimum(next_, n - 1)] == run)
+    dPrev = np.where(prevOk, pos - prev, n)
+    dNext = np.where(nextOk, next_ - pos, n)
+
+    fill = ~valid & (prevOk | nextOk)
+    src = np.where(dPrev <= dNext, prev, next_)
+    x[fill] = x[src[fill]]
+    return x
+
 # -------------------------------------------------------
 
+class DEMSampler():
+    """
+    Sample elevations of points from a DEM in bulk, reusable across trips and calls.
+    """
+    def __init__(self, dem, bilinear=False, tileSize=512, maxTiles=64):
+        """
+        dem: DEM dataset opened by gdal, path of a DEM file, or path of a .npy tile store built by NpyTileStore.build.
+        bilinear: True for bilinear interpolation between pixel centers, nearest pixel otherwise.
+        tileSize, maxTiles: tiles read from a DEM dataset and cached, see TiledRaster.
+        """
+        if isinstance(dem, str) and dem.endswith('.npy'):
+            self.raster = NpyTileStore(dem)
+            projection, geoTransform = self.raster.projection, self.raster.geoTransform
+        else:
+            dem = gdal.Open(dem) if isinstance(dem, str) else dem
+            self.raster = TiledRaster(dem.GetRasterBand(1), tileSize, maxTiles)
+            projection, geoTransform = dem.GetProjection(), dem.GetGeoTransform()
+        self.dem = dem
+        self.bilinear = bilinear
+        self.nodata = self.raster.nodata
+
+        # projected and geographic reference system
+        psr = osr.SpatialReference()
+        psr.ImportFromWkt(projection)
+        gsr = psr.CloneGeogCS()
+
+        # coordinate transformer and inverse geotransform, built once
+        self.ct = osr.CoordinateTransformation(gsr, psr)
+        x0, dx, dxy, y0, dyx, dy = geoTransform
+        self.origin = np.array([x0, y0])
+        self.inverse = np.linalg.inv(np.array([[dx, dxy], [dyx, dy]]))
+
+    def transform(self, lon, lat):
+        """
+        Transfer geo longitude, latitude to fractional row, col in rasters.
+        lon, lat: arrays.
+        """
+        points = np.column_stack([np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')])
+        if len(points) == 0:
+            return np.array([]), np.array([])
+        xy = np.asarray(self.ct.TransformPoints(points))[:, :2]
+        col, row = self.inverse @ (xy - self.origin).T
+        return row, col
+
+    def sample(self, lon, lat):
+        """
+        Elevations of points, NaN out of the raster or at nodata pixels.
+        lon, lat: arrays.
+        """
+        row, col = self.transform(lon, lat)
+        nRow, nCol = self.raster.shape
+        if not self.bilinear:
+            return self._gather(np.floor(row), np.floor(col))
+
+        # bilinear interpolation between the centers of the 4 surrounding pixels
+        row, col = row - 0.5, col - 0.5
+        r0 = np.clip(np.floor(row), 0, max(nRow - 2, 0))
+        c0 = np.clip(np.floor(col), 0, max(nCol - 2, 0))
+        wr = np.clip(row - r0, 0, 1)
+        wc = np.clip(col - c0, 0, 1)
+        r1, c1 = np.minimum(r0 + 1, nRow - 1), np.minimum(c0 + 1, nCol - 1)
+        ele = (
+            self._gather(r0, c0) * (1 - wr) * (1 - wc) + self._gather(r0, c1) * (1 - wr) * wc
+            + self._gather(r1, c0) * wr * (1 - wc) + self._gather(r1, c1) * wr * wc
+        )
+        ele[(row < -0.5) | (row >= nRow - 0.5) | (col < -0.5) | (col >= nCol - 0.5)] = np.nan
+        return ele
+
+    def _gather(self, row, col):
+        """
+        Pixel values at integer row, col as float, NaN out of the raster or at nodata pixels.
+        """
+        nRow, nCol = self.raster.shape
+        inside = (row >= 0) & (row < nRow) & (col >= 0) & (col < nCol)
+        ele = np.full(len(row), np.nan)
+        ele[inside] = self.raster.gather(row[inside].astype('int64'), col[inside].astype('int64'))
+        if self.nodata is not None:
+            ele[ele == self.nodata] = np.nan
+        return ele
+
+
+class TiledRaster():
+    """
+    Read a raster band window by window, decoded tiles are cached in least-recently-used order.
+    """
+    def __init__(self, band, tileSize=512, maxTiles=64):
+        """
+        band: raster band of a gdal dataset.
+        tileSize: size of square tiles [pixel].
+        maxTiles: maximum number of decoded tiles in memory.
+        """
+        self.band = band
+        self.shape = (band.YSize, band.XSize)
+        self.nodata = band.GetNoDataValue()
+        self.tileSize = tileSize
+        self.maxTiles = maxTiles
+        self.tiles = OrderedDict()
+
+    def getTile(self, tileRow, tileCol):
+        """
+        Decoded pixels of a tile, read from the band on a cache miss.
+        """
+        key = (tileRow, tileCol)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        xoff, yoff = tileCol * self.tileSize, tileRow * self.tileSize
+        tile = self.band.ReadAsArray(
+            xoff, yoff,
+            min(self.tileSize, self.shape[1] - xoff), min(self.tileSize, self.shape[0] - yoff)
+        )
+        self.tiles[key] = tile
+        if len(self.tiles) > self.maxTiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def gather(self, row, col):
+        """
+        Pixel values at integer row, col within the raster, only the tiles covering the points are read.
+        """
+        if len(row) == 0:
+            return np.array([])
+        ts = self.tileSize
+        tileRow, tileCol = row // ts, col // ts
+        code = tileRow * (self.shape[1] // ts + 1) + tileCol
+        order = np.argsort(code, kind='stable')
+        _, starts = np.unique(code[order], return_index=True)
+        values = None
+        for idx in np.split(order, starts[1:]):
+            tile = self.getTile(tileRow[idx[0]], tileCol[idx[0]])
+            if values is None:
+                values = np.empty(len(row), dtype=tile.dtype)
+            values[idx] = tile[row[idx] - tileRow[idx[0]] * ts, col[idx] - tileCol[idx[0]] * ts]
+        return values
+
+
+class NpyTileStore():
+    """
+    Raster converted once into tiles of a .npy file, memory-mapped so that processes share the same pages.
+    """
+    def __init__(self, path):
+        """
+        path: path of the .npy file built by NpyTileStore.build.
+        """
+        with open(_metaPath(path)) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.tileSize = meta['tileSize']
+        self.nodata = meta['nodata']
+        self.projection = meta['projection']
+        self.geoTransform = tuple(meta['geoTransform'])
+        self.tiles = np.load(path, mmap_mode='r')  # (tile rows, tile cols, tileSize, tileSize)
+
+    @classmethod
+    def build(cls, dem, path, tileSize=512):
+        """
+        Convert a DEM dataset opened by gdal into a tile store, reading one row of tiles at a time.
+        """
+        band = dem.GetRasterBand(1)
+        nRow, nCol = band.YSize, band.XSize
+        nTileRow, nTileCol = -(-nRow // tileSize), -(-nCol // tileSize)
+        nodata = band.GetNoDataValue()
+
+        for tileRow in range(nTileRow):
+            rows = band.ReadAsArray(0, tileRow * tileSize, nCol, min(tileSize, nRow - tileRow * tileSize))
+            if tileRow == 0:
+                tiles = np.lib.format.open_memmap(path, mode='w+', dtype=rows.dtype, shape=(nTileRow, nTileCol, tileSize, tileSize))
+            padded = np.full((tileSize, nTileCol * tileSize), nodata if nodata is not None else 0, dtype=rows.dtype)
+            padded[:rows.shape[0], :nCol] = rows
+            tiles[tileRow] = padded.reshape(tileSize, nTileCol, tileSize).swapaxes(0, 1)
+        tiles.flush()
+        del tiles
+
+        # metadata is written last, a store without it is incomplete
+        with open(_metaPath(path), 'w') as f:
+            json.dump({
+                'shape': [nRow, nCol], 'tileSize': tileSize, 'nodata': nodata,
+                'projection': dem.GetProjection(), 'geoTransform': list(dem.GetGeoTransform()),
+            }, f)
+        return cls(path)
+
+    def gather(self, row, col):
+        """
+        Pixel values at integer row, col within the raster.
+        """
+        ts = self.tileSize
+        return self.tiles[row // ts, col // ts, row % ts, col % ts]
+
+
+def _metaPath(path):
+    """
+    Path of the metadata of a tile store.
+    """
+    return os.path.splitext(path)[0] + '.json'
+
+
 def dem2ele(dem):
     """
     Obtain elevation from DEM.
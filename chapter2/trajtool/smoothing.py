@@ -13,160 +13,302 @@ This module includes three smoothing methods for trajectory and indices:
 
 
 import numpy as np
-from pykalman import KalmanFilter
-from tqdm import tqdm
+import pandas as pd
+from scipy.signal import lfilter, ss2tf
 
 
-def KalmanSmooth_1D(indices:list, process_var=0.01, measure_var=0.01):
+def KalmanSmooth_1D(indices:list, process_var=0.01, measure_var=0.01, seg=None, tol=1e-12):
     """
     Smooth the indices using Kalman Filter 1D.
     process_var: process variance
     measure_var: measure variance
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
+    tol: relative tolerance for the gain to reach the steady state.
+    The gain does not depend on the data: it is the same for every segment and converges to the closed-form
+    steady-state gain, after which the filter is exponential smoothing.
     """
-    n = len(indices)
-    size = (n,)
+    z = np.asarray(indices, dtype='float64')
+    n = len(z)
+    if n == 0:
+        return z.copy()
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
 
     # parameters
     Q = process_var  # process variance
     R = measure_var  # measure variance
-    
-    # initialize arrays
-    xhat_ = np.zeros(size)  # a priori estimate of x
-    xhat = np.zeros(size)  # a posteriori estimate of x
-    P_ = np.zeros(size)  # a priori error estimate
-    P = np.zeros(size)  # a posteriori error estimate
-    K = np.zeros(size)  # gain factor
 
-    xhat[0] = indices[0]
-    P[0] = 1
+    # steady-state a priori error estimate and gain
+    P_ = (Q + np.sqrt(Q * Q + 4 * Q * R)) / 2
+    K_ = P_ / (P_ + R)
 
-    for k in range(1, n):
-        # time update
-        xhat_[k] = xhat[k-1]
-        P_[k] = P[k-1] + Q
+    xhat = z.copy()  # a posteriori estimate of x, the first point of each segment is kept
+    P = 1  # a posteriori error estimate
 
-        # measurement update
-        K[k] = P_[k] / (P_[k] + R)
-        xhat[k] = xhat_[k] + K[k] * (indices[k] - xhat_[k])
-        P[k] = (1 - K[k]) * P_[k]
+    # transient gains, one step for all segments at a time
+    m = 1
+    while m < lengths.max():
+        K = (P + Q) / (P + Q + R)
+        if abs(K - K_) <= tol * K_:
+            break
+        P = (1 - K) * (P + Q)
+        k = starts[lengths > m] + m
+        xhat[k] = xhat[k-1] + K * (z[k] - xhat[k-1])
+        m += 1
+
+    # steady state from position m-1 of each segment on
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    tail = np.flatnonzero((rel >= m - 1) & np.repeat(lengths > m, lengths))
+    if len(tail):
+        tailStarts = np.flatnonzero(rel[tail] == m - 1)
+        xhat[tail] = _expFilter(z[tail], 1 - K_, tailStarts, xhat[tail[tailStarts]])
 
     return xhat
 
-def KalmanSmooth_2D(observations, timestamps, process_var=0.01, measure_var=0.00002):
+def KalmanSmooth_2D(observations, timestamps, process_var=0.01, measure_var=0.00002, seg=None, rts=False):
     """
-    Smooth the indices using Kalman Filter 1D.
-    observations:
-    timestamps:
-    process_var: process variance
-    measure_var: measure variance
+    Smooth the trajectory using a constant-velocity Kalman filter with state (x, y, vx, vy).
+    observations: (n x 2) array of (x, y) or (lon, lat).
+    timestamps: time of observations [s], the transition of each step uses its own dt.
+    process_var: process std, a number or a list for (x, y, vx, vy).
+    measure_var: measure std, a number or a list for (x, y).
+    seg: segment labels of the observations, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
+    rts: True to apply the Rauch-Tung-Striebel backward pass, i.e., smoothing with future observations.
 
-    return: smoothed_states
+    return: smoothed_states, (n x 4) ndarray of (x, y, vx, vy).
     """
-    transition_matrix = np.array([[1, 0, 1, 0],
-                                  [0, 1, 0, 1],
-                                  [0, 0, 1, 0],
-                                  [0, 0, 0, 1]])
-    observation_matrix = np.array([[1, 0, 0, 0],
-                                   [0, 1, 0, 0]])
-    if isinstance(measure_var, list):
-        observation_covariance = np.diag(measure_var)**2
-    else:
-        observation_covariance = np.eye(2) * measure_var**2
-    if isinstance(process_var, list):
-        transition_covariance = np.diag(process_var)**2
-    else:
-        transition_covariance = np.eye(4) * process_var**2
-
-    # initial
-    initial_state_mean = [observations[0, 0], observations[0, 1], 0, 0]
-    initial_state_covariance = np.eye(4) * 1
-    kf = KalmanFilter(
-        transition_matrices=transition_matrix,
-        observation_matrices=observation_matrix,
-        initial_state_mean=initial_state_mean,
-        initial_state_covariance=initial_state_covariance,
-        observation_covariance=observation_covariance,
-        transition_covariance=transition_covariance
-    )
-
-    # smooth
-    smoothed_states = np.zeros((len(observations), 4))
-    smoothed_states[0, :] = initial_state_mean
-    current_state = initial_state_mean
-    current_covariance = initial_state_covariance
-    
-    for i in range(1, len(observations)):
-        dt = timestamps.iloc[i] - timestamps.iloc[i - 1]
-        kf.transition_matrices = np.array([[1, 0, dt, 0],
-                                           [0, 1, 0, dt],
-                                           [0, 0, 1, 0],
-                                           [0, 0, 0, 1]])
-        current_state, current_covariance = kf.filter_update(
-            current_state, current_covariance, observations[i]
-        )
-        smoothed_states[i, :] = current_state 
+    z = np.asarray(observations, dtype='float64').reshape(-1, 2)
+    t = np.asarray(timestamps, dtype='float64')
+    n = len(z)
+    states = np.zeros((n, 4))
+    if n == 0:
+        return states
+
+    # with diagonal covariances, (x, vx) and (y, vy) are two independent filters: the arrays have a column for each
+    q = np.broadcast_to(np.asarray(process_var, dtype='float64')**2, (4,))
+    Qp, Qv = q[:2], q[2:]
+    R = np.broadcast_to(np.asarray(measure_var, dtype='float64')**2, (2,))
+
+    # segments from the longest, the active ones at step m are the first nActive[m]
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
+    rank = np.empty(len(starts), dtype='int64')
+    rank[np.argsort(-lengths, kind='stable')] = np.arange(len(starts))
+    nActive = np.searchsorted(-np.sort(lengths)[::-1], -np.arange(lengths.max() + 1), side='left')  # segments longer than m
+
+    # position-major layout: observations at step m of the active segments are the slice step[m]:step[m]+nActive[m]
+    step = np.r_[0, np.cumsum(nActive)]
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    layout = step[rel] + np.repeat(rank, lengths)
+    zL = np.empty((n, 2))
+    tL = np.empty(n)
+    zL[layout], tL[layout] = z, t
+
+    # filtered states and covariances (Ppp, Ppv, Pvv) of every observation
+    pos, vel = zL.copy(), np.zeros((n, 2))
+    Ppp, Ppv, Pvv = np.ones((n, 2)), np.zeros((n, 2)), np.ones((n, 2))
+
+    for m in range(1, len(nActive) - 1):
+        k = slice(step[m], step[m] + nActive[m])
+        k_ = slice(step[m-1], step[m-1] + nActive[m])
+        dt = (tL[k] - tL[k_])[:, np.newaxis]
+
+        # time update
+        pos_ = pos[k_] + dt * vel[k_]
+        Ppv_ = Ppv[k_] + dt * Pvv[k_]
+        Ppp_ = Ppp[k_] + dt * (Ppv[k_] + Ppv_) + Qp
+        Pvv_ = Pvv[k_] + Qv
+
+        # measurement update
+        Kp = Ppp_ / (Ppp_ + R)
+        Kv = Ppv_ / (Ppp_ + R)
+        innovation = zL[k] - pos_
+        pos[k] = pos_ + Kp * innovation
+        vel[k] = vel[k_] + Kv * innovation
+        Ppp[k] = (1 - Kp) * Ppp_
+        Ppv[k] = (1 - Kp) * Ppv_
+        Pvv[k] = Pvv_ - Kv * Ppv_
+
+    if rts:
+        for m in range(len(nActive) - 3, -1, -1):
+            k = slice(step[m], step[m] + nActive[m+1])
+            k1 = slice(step[m+1], step[m+1] + nActive[m+1])
+            dt = (tL[k1] - tL[k])[:, np.newaxis]
+
+            # predicted covariance of the next step
+            Ppv_ = Ppv[k] + dt * Pvv[k]
+            Ppp_ = Ppp[k] + dt * (Ppv[k] + Ppv_) + Qp
+            Pvv_ = Pvv[k] + Qv
+            det = Ppp_ * Pvv_ - Ppv_**2
+
+            # smoother gain G = P A' inv(P_), applied to the difference from the predicted state
+            a, b = Ppp[k] + dt * Ppv[k], Ppv[k]
+            c, d = Ppv_, Pvv[k]
+            dp = pos[k1] - pos[k] - dt * vel[k]
+            dv = vel[k1] - vel[k]
+            pos[k] += ((a * Pvv_ - b * Ppv_) * dp + (b * Ppp_ - a * Ppv_) * dv) / det
+            vel[k] += ((c * Pvv_ - d * Ppv_) * dp + (d * Ppp_ - c * Ppv_) * dv) / det
+
+    states[:, :2] = pos[layout]
+    states[:, 2:] = vel[layout]
     
-    return smoothed_states
+    return states
 
-def expSmooth(indices:list, alpha=0.3):
+def expSmooth(indices:list, alpha=0.3, seg=None):
     """
     Smooth the indices using exponential smoothing.
     alpha: smoothing parameter
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
     """
-    result = [indices[0]]
-    n = len(indices)
-    index = list(range(1, n))
-    for i in set(index):
-        result.append(alpha * result[i-1] + (1 - alpha) * indices[i])
-    
-    return result
+    x = np.asarray(indices, dtype='float64')
+    if len(x) == 0:
+        return x.copy()
+    starts = _segStarts(len(x), seg)
+    return _expFilter(x, alpha, starts, x[starts])
 
-def doubleExpSmooth(indices:list, alpha=0.3, beta=0.1):
+def doubleExpSmooth(indices:list, alpha=0.3, beta=0.1, seg=None):
     """
     Smooth the indices using double exponential smoothing.
     alpha: level smoothing parameter
     beta: trend smoothing parameter
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
     """
-    # initialize the result
-    result = [indices[0]]
-    n = len(indices)
-    index = list(range(1, n))
-    for i in set(index):
-        if i == 1:
-            level, trend = indices[0], indices[1] - indices[0]
-            value = indices[0]
-        else:
-            value = indices[i]
-        level_, level = level, alpha * value + (1 - alpha) * (level + trend)
-        trend = beta * (level - level_) + (1 - beta) * trend
-        result.append(level + trend)
+    x = np.asarray(indices, dtype='float64')
+    result = x.copy()  # the first point of each segment is kept
+    n = len(x)
+    if n == 0:
+        return result
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
+
+    # inputs from the second point of each segment, the first input is the first point
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    idx = np.flatnonzero(rel >= 1)
+    if len(idx) == 0:
+        return result
+    value = x[idx]
+    valueStarts = np.flatnonzero(rel[idx] == 1)
+    first = starts[lengths >= 2]
+    value[valueStarts] = x[first]
+
+    # initial level and trend
+    state = np.column_stack([x[first], x[first + 1] - x[first]])
+    result[idx] = _holtFilter(value, alpha, beta, valueStarts, state)
     
     return result
 
-def moving_average(indices: list, window_size=3):
+def _segStarts(n, seg=None):
+    """
+    Start positions of contiguous segments.
+    seg: segment labels, if None, one segment.
+    """
+    if seg is None:
+        return np.array([0])
+    seg = np.asarray(seg)
+    return np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+
+def _segOrder(seg):
+    """
+    Positions of rows grouped by segment in order of appearance, rows without a segment are left out.
+    seg: segment labels, e.g., tripID.
+    return: positions and segment codes of them.
+    """
+    codes, _ = pd.factorize(seg)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    return order, codes[order]
+
+def _expFilter(x, alpha, starts, init):
+    """
+    y[i] = alpha * y[i-1] + (1 - alpha) * x[i] with y = init at segment starts, one lfilter pass for all segments.
+    The state carried over a segment start decays as alpha ** (m + 1) at position m and is subtracted.
+    """
+    u = (1 - alpha) * x
+    u[starts] = init
+    if len(starts) > 1 and not np.isfinite(u).all():  # NaN would leak into later segments
+        return np.concatenate([lfilter([1.0], [1.0, -alpha], part) for part in np.split(u, starts[1:])])
+
+    y = lfilter([1.0], [1.0, -alpha], u)
+    if len(starts) > 1:
+        lengths = np.diff(np.r_[starts, len(x)])
+        carry = np.r_[0.0, y[starts[1:] - 1]]
+        m = np.arange(len(x)) - np.repeat(starts, lengths)
+        y -= np.repeat(carry, lengths) * alpha ** (m + 1)
+    return y
+
+def _holtFilter(value, alpha, beta, starts, state):
+    """
+    Level + trend of Holt's linear method, restarting from the (level, trend) state at segment starts.
+    The level and trend are linear filters of the inputs, the response to the difference between the
+    initial state and the state carried over a segment start is added.
+    """
+    if len(starts) > 1 and not np.isfinite(value).all():  # NaN would leak into later segments
+        return np.concatenate([
+            _holtFilter(part, alpha, beta, np.array([0]), state[k:k+1])
+            for k, part in enumerate(np.split(value, starts[1:]))
+        ])
+
+    # state transition s[k] = A s[k-1] + B value[k]
+    A = np.array([[1 - alpha, 1 - alpha], [-alpha * beta, 1 - alpha * beta]])
+    B = np.array([alpha, alpha * beta])
+    level, trend = [lfilter(*_transferFunc(A, B, row), value) for row in range(2)]
+
+    # response of level + trend to the state difference d at position m: [1, 1] A^(m+1) d
+    lengths = np.diff(np.r_[starts, len(value)])
+    carry = np.zeros_like(state)
+    carry[1:] = np.column_stack([level, trend])[starts[1:] - 1]
+    m = np.arange(len(value)) - np.repeat(starts, lengths)
+    response = _stateResponse(A, lengths.max())[m]
+    return level + trend + np.sum(np.repeat(state - carry, lengths, axis=0) * response, axis=1)
+
+def _transferFunc(A, B, row):
+    """
+    Transfer function of a state component of s[k] = A s[k-1] + B u[k].
+    """
+    num, den = ss2tf(A, B[:, np.newaxis], A[row:row+1], B[row:row+1, np.newaxis])
+    return num[0], den
+
+def _stateResponse(A, n):
+    """
+    [1, 1] A^(m+1) e_j for m in range(n), (n x 2) ndarray, by the characteristic recurrence of A.
+    """
+    first, second = np.ones(2) @ A, np.ones(2) @ A @ A
+    trace, det = np.trace(A), np.linalg.det(A)
+    impulse = np.zeros(n)
+    impulse[0] = 1
+    return np.column_stack([
+        lfilter([first[j], second[j] - trace * first[j]], [1, -trace, det], impulse)
+        for j in range(2)
+    ])
+
+def moving_average(indices: list, window_size=3, seg=None):
     """
     Smooth the indices using centered moving average.
     window_size: size of the moving window (must be an odd number)
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
     """
     if window_size % 2 == 0:
         raise ValueError("Window size must be an odd number.")
 
+    x = np.asarray(indices, dtype='float64')
+    n = len(x)
     half_window = window_size // 2
-    result = []
-
-    for i in range(len(indices)):
-        if i < half_window or i > len(indices) - half_window - 1:
-            # Not enough elements to fill the window at the beginning or end
-            result.append(indices[i])
-        else:
-            # Calculate the centered moving average
-            window = indices[i - half_window:i + half_window + 1]
-            result.append(sum(window) / window_size)
+    result = x.copy()
+    if n == 0:
+        return result
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
+
+    # centers with a full window in the segment, the rest is kept as it is
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    center = np.flatnonzero((rel >= half_window) & (rel < np.repeat(lengths, lengths) - half_window))
+    if len(center):
+        window = np.lib.stride_tricks.sliding_window_view(x, window_size)
+        result[center] = window[center - half_window].sum(axis=1) / window_size
     
     return result
 
 
-
 SMOOTH_DICT = {
     'exp': expSmooth,
     'dexp': doubleExpSmooth,
@@ -190,28 +332,30 @@ def smooth1D(
     smoothFunc: smoothing method.
         `exp`: exponentail smoothing
         `dexp`: double exponential smoothing
-        `kal`: Kalman filter smoothing 
+        `kal1D`: Kalman filter smoothing 
+        `moving`: centered moving average
     **params: smoothing parameter for each method.
         `exp`:[alpha]
         `dexp`: [alpha, beta]
         `kal1D`: [process_var, measure_var]
+        `moving`: [window_size]
     """
     smooth_func = SMOOTH_DICT[smoothFunc]
 
     traj = traj.copy()
 
     if segCol:
-        for id in tqdm(set(traj[segCol].unique()), desc="Smoothing"):  
-            # select trip from traj.df
-            trip = traj[traj[segCol] == id].copy()
-
-            for col in smoothCol:
-                traj.loc[trip.index, col] = smooth_func(trip[col].to_list(), **params)
+        # all trips in one call, rows of a trip are made contiguous
+        order, seg = _segOrder(traj[segCol])
+        for col in smoothCol:
+            values = traj[col].to_numpy(dtype='float64')
+            values[order] = smooth_func(values[order], seg=seg, **params)
+            traj[col] = values
     
         return traj
     
     else:
-        traj.loc[:, newCol] = smooth_func(traj[smoothCol].to_list(), **params)
+        traj.loc[:, newCol] = smooth_func(traj[smoothCol].to_numpy(dtype='float64'), **params)
         
         return traj
 
@@ -232,22 +376,21 @@ def smooth2D(
     smoothFunc: smoothing method.
         `kal2D`: Kalman filter smoothing 
     **params: smoothing parameter for each method.
-        `kal2D`: [process_var, measure_var]
+        `kal2D`: [process_var, measure_var, rts]
     """
     smooth_func = SMOOTH_DICT[smoothFunc]
 
     traj = traj.copy()
 
     if segCol:
-        for id in tqdm(set(traj[segCol].unique()), desc="Smoothing"):  
-            # select trip from traj.df
-            trip = traj[traj[segCol] == id].copy()
-
-            observations = trip[[lonCol, latCol]].values
-            timestamps = trip[timeCol]
-            new = smooth_func(observations, timestamps, **params)
-            traj.loc[trip.index, newLonCol] = new[:, 0]
-            traj.loc[trip.index, newLatCol] = new[:, 1]
+        # all trips in one call, rows of a trip are made contiguous
+        order, seg = _segOrder(traj[segCol])
+        observations = traj[[lonCol, latCol]].to_numpy(dtype='float64')[order]
+        timestamps = traj[timeCol].to_numpy(dtype='float64')[order]
+        new = traj.reindex(columns=[newLonCol, newLatCol]).to_numpy(dtype='float64')  # rows without a trip are kept
+        new[order] = smooth_func(observations, timestamps, seg=seg, **params)[:, :2]
+        traj[newLonCol] = new[:, 0]
+        traj[newLatCol] = new[:, 1]
     
         return traj
     
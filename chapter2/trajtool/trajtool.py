@@ -14,7 +14,7 @@ from .densification import densify
 from .plot import plot_traj, plot_heat, plot_series
 from .calculation import getMileageByCoord
 from .calculation import calDistInterval, calTimeInterval
-from .calculation import calSpeed, calAcc, calVSP
+from .calculation import calSpeed, calAcc, calVSP, calKinematics
 from.grade import calGrade
 from .smoothing import smooth1D, smooth2D
 from .segmentation import segment_time_intv
@@ -56,6 +56,7 @@ class TrajTool():
             timeCol:str,
             segCol=None,
             sortBy=None,
+            nWorkers=1,
             **kwargs
     ):
         """
@@ -66,8 +67,9 @@ class TrajTool():
         timeCol: column name of time.
         segCol: column name of segments (trip ID or car ID), if None, densify the traj as a whole trip.
         sortBy: reference cols for sorting trajectory point, list.
+        nWorkers: number of worker processes for densifying trips in parallel, None for all CPUs.
         """
-        return densify(traj, lonCol, latCol, timeCol, segCol, sortBy, **kwargs)
+        return densify(traj, lonCol, latCol, timeCol, segCol, sortBy, nWorkers=nWorkers, **kwargs)
     
     def cal_mileage(
             self,
@@ -84,11 +86,7 @@ class TrajTool():
         segCol: column name of segments (trip ID or car ID), if None, calculate mileage for the traj as a whole trip.
         """
         if segCol:
-            mi = {
-                id:getMileageByCoord(traj[traj[segCol]]==id, lonCol, latCol)
-                for id in traj[segCol].unique().to_list()
-            }
-            return mi
+            return getMileageByCoord(traj, lonCol, latCol, segCol)
         else:
             return {0: getMileageByCoord(traj, lonCol, latCol)}
 
@@ -130,16 +128,18 @@ class TrajTool():
             newCol='grade[D]',
             fromDEM=False,
             dem=None,
+            segCol=None,
     ):
         """
         Match elevation to traj points and calculate the grade.
         distIntCol: column name of dist interval, meter.
         eleCol: column name of elevation, if fromDEM is True, then set eleCol to None.
         fromDEM: if True, extract elevation and grade from DEM.
-        dem: if fromDEM is True, input the DEM file.
+        dem: if fromDEM is True, input the DEM file or a DEMSampler.
         newCol: name of the new grade column.
+        segCol: column name of tripID, elevations are filled and smoothed per trip.
         """
-        return calGrade(traj, lonCol, latCol, distIntCol, eleCol, newCol, fromDEM, dem)
+        return calGrade(traj, lonCol, latCol, distIntCol, eleCol, newCol, fromDEM, dem, segCol)
 
 # TODO: calculate single params
 
@@ -226,12 +226,18 @@ class TrajTool():
         newSpeedCol: column name of the newly generated speed
         newAccCol: column name of the newly generated acceleration
         newVSPCol: column name of the newly generated VSP
-        weight: weight of the vehicle [kg]
+        weight: weight of the vehicle [t]
         """
         traj = traj.copy()
-        traj = calSpeed(traj, timeIntCol, distIntCol, newSpeedCol)
-        traj = calAcc(traj, timeIntCol, newSpeedCol, newAccCol)
-        traj = calVSP(traj, weight, newSpeedCol, newAccCol, gradeCol, newVSPCol)
+        speed, acc, VSP = calKinematics(
+            traj[timeIntCol].to_numpy(),
+            traj[distIntCol].to_numpy(),
+            traj[gradeCol].to_numpy() if gradeCol else None,
+            weight=weight
+        )
+        traj[newSpeedCol] = speed
+        traj[newAccCol] = acc
+        traj[newVSPCol] = VSP
 
         return traj
 
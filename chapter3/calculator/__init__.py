@@ -1,5 +1,5 @@
-from .braking import coastDownDetect
-from .opmode import OpModeDetect, OpModeAgg
-from .er import calER, fitCurve
-from .calculation import calDistInterval, calTimeInterval, calSpeed, calAcc, calVSP
+from .braking import coastDownDetect, registerCoastDownCurve, COAST_DOWN_CURVES
+from .opmode import OpModeDetect, OpModeAgg, getOpModeID, getOpModeAggArrays
+from .er import calER, calERMatrix, fitCurve, getERCurves, setERCurve, resetERCurves
+from .calculation import calDistInterval, calTimeInterval, calSpeed, calAcc, calVSP, calKinematics
 from .calculator import ERCalculator
\ No newline at end of file
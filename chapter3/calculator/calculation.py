@@ -160,42 +160,61 @@ def calVSP(
     VSPColName: column name of the newly generated VSP
     """
     # VSP / kW/t
+    grade = traj[gradeCol].to_numpy() if gradeCol else None
+    traj[VSPColName] = _VSP(traj[speedCol].to_numpy(), traj[accCol].to_numpy(), grade, weight)
+    traj[VSPColName] = traj[VSPColName].astype('float32')
+
+    return traj
+
+
+def _VSP(speed, acc, grade=None, weight=1.497):
+    """
+    VSP kernel on whole arrays.
+    speed: speed in km/h
+    acc: acceleration in m/s2
+    grade: road grade, if None, calculate VSP with 0 grade
+    weight: weight of the vehicle in mass/ton
+    """
     A, B, C = 0.156461, 0.0020002, 0.000493
     g = 9.8  # m/s^2
-    
-    # traj.loc[:, 'v'] = traj[speedCol] / 3.6
-    # traj.loc[:, 'v2'] = traj['v'].apply(lambda x: x**2)
-    # traj.loc[:, 'v3'] = traj['v'] * traj['v2']
-    # traj.loc[:, 'av'] = traj['v'] * traj[accCol]
-    
-    # # VSP with 0 grade
-    # traj.loc[:, 'VSP0'] = traj.apply(lambda row: A/weight*row['v'] + B/weight*row['v2'] + C/weight*row['v3'] + row['av'], axis=1)
-    # traj.drop(['v2', 'v3', 'av'], axis=1, inplace=True)
-    
-    # VSP with 0 grade
-    traj.loc[:, 'VSP0'] = traj.apply(
-        lambda x: A / weight * (x[speedCol]/3.6)
-                + B / weight * ((x[speedCol]/3.6)**2)
-                + C / weight * ((x[speedCol]/3.6)**3)
-                + (x[speedCol]/3.6) * x[accCol],
-        axis=1
-    )
-
-    # # VSP with grade
-    # traj.loc[:, 'sin'] = traj[gradeCol].apply(np.sin)  # sin(theta)
-    # traj.loc[:, 'sin'] = traj['sin'] * traj['v'] * g   # g*sin(theta)*v
-    # traj.loc[:, VSPColName] = traj['VSP0'] + traj['sin']
-    
-    if gradeCol:
-        # VSP with grade
-        traj.loc[:, VSPColName] = traj.apply(
-            lambda x: x['VSP0'] + np.sin(x[gradeCol]) * (x[speedCol]/3.6) * g,
-            axis=1
-        )
-        traj.drop(['VSP0'], axis=1, inplace=True)
-    else:
-        traj.rename(columns={'VSP0': VSPColName}, inplace=True)
-    
-    traj[VSPColName] = traj[VSPColName].astype('float32')
 
-    return traj
\ No newline at end of file
+    v = speed / 3.6
+    VSP = v * ((A + (B + C * v) * v) / weight + acc)  # VSP with 0 grade
+    if grade is not None:
+        VSP += np.sin(grade) * v * g  # g*sin(theta)*v
+    return VSP
+
+
+def calKinematics(
+        interval,
+        dist,
+        grade=None,
+        weight=1.497,  # weight of LDV, mass/ton
+):
+    """
+    Calculate [forward] speed, acceleration and VSP in one pass.
+    interval: time interval [s], array-like
+    dist: distance interval [km], array-like
+    grade: road grade, array-like, if None, calculate VSP with 0 grade
+    weight: weight of the vehicle in mass/ton
+    return: speed [km/h], acc [m/s2], VSP [kW/t], float32 ndarrays
+    """
+    interval = np.ascontiguousarray(interval, dtype='float32')
+    dist = np.ascontiguousarray(dist, dtype='float32')
+
+    # speed [forward]
+    speed = dist / interval
+    speed *= 3600
+
+    # acceleration [forward]
+    acc = np.full_like(speed, np.nan)
+    np.subtract(speed[1:], speed[:-1], out=acc[:-1])
+    acc[:-1] /= interval[:-1]
+    acc /= 3.6
+
+    # VSP
+    if grade is not None:
+        grade = np.ascontiguousarray(grade, dtype='float32')
+    VSP = _VSP(speed, acc, grade, weight)
+
+    return speed, acc, VSP
\ No newline at end of file
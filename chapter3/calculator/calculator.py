@@ -13,7 +13,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from .braking import coastDownDetect
 from .opmode import OpModeDetect, OpModeAgg, getDecelBinProp
-from .er import calER, fitCurve
+from .er import calER, fitCurve, setERCurve
 from .calculation import calTimeInterval, calDistInterval, calSpeed, calAcc, calVSP
 
 
@@ -33,6 +33,8 @@ class ERCalculator():
             speedCol="speed[km/h]",
             accCol="acc[m/s2]",
             brakeColName="braking",
+            vehCol=None,
+            curves=None,
     ):
         """
         Determine whether braking event is happening according to braking detect models.
@@ -40,8 +42,10 @@ class ERCalculator():
         speedCol: column name of speed.
         accCol: column name of acceleration.
         brakeColName: name of the newly derived column
+        vehCol: column name of vehicle class or weight (kg) to choose per-vehicle curves.
+        curves: registry of coast down curves {vehicle class or weight: (A, B, C)}, default COAST_DOWN_CURVES.
         """
-        return coastDownDetect(traj, speedCol, accCol, brakeColName)
+        return coastDownDetect(traj, speedCol, accCol, brakeColName, vehCol, curves)
     
 
     def OpModeDetect(
@@ -51,7 +55,9 @@ class ERCalculator():
             speedCol='speed[km/h]',
             accCol='acc[m/s2]',
             VSPCol='VSP[kW/t]',
-            OpModeColName="OpModeID"
+            OpModeColName="OpModeID",
+            segCol=None,
+            prevTraj=None,
     ):
         """
         Detect Operating Mode for each traj point.
@@ -60,8 +66,10 @@ class ERCalculator():
         speedCol: column name of speed.
         accCol: column name of acc.
         VSPCol: column name of VSP.
+        segCol: column name of trip ID, the t-1/t-2 lags are not carried across trips.
+        prevTraj: the previous chunk, for chunked input.
         """
-        return OpModeDetect(traj, gradeCol, speedCol, accCol, VSPCol, OpModeColName)
+        return OpModeDetect(traj, gradeCol, speedCol, accCol, VSPCol, OpModeColName, segCol, prevTraj)
     
 
     def calOpModeERs(
@@ -96,7 +104,9 @@ class ERCalculator():
                 r_f_ratio, drum_disc_ratio
             )
         results = OpModesInfo.copy()
-        results['ER[g/hr/veh]'] = results.apply(lambda x: sum(calERFunc(-decelBins[:-1]) * x[decelPropCol] * x[brakeFracCol]), axis=1)
+        ER = calERFunc(-decelBins[:-1])  # evaluate the ER curve once
+        decelProp = _stackProp(results[decelPropCol], len(ER))
+        results['ER[g/hr/veh]'] = decelProp @ ER * results[brakeFracCol].to_numpy(dtype='float64')
         results.fillna(0, inplace=True)
         return results
 
@@ -134,8 +144,11 @@ class ERCalculator():
                 r_f_ratio, drum_disc_ratio
             )
         results = OpModesInfo.copy()
-        overallDecelBinProp = sum(results[decelPropCol] * results[brakeCountCol]) / sum(results[brakeCountCol])
-        results['ER_MOVES[g/hr/veh]'] = results.apply(lambda x: sum(calERFunc(-decelBins[:-1]) * overallDecelBinProp * x[brakeFracCol]), axis=1)
+        ER = calERFunc(-decelBins[:-1])  # evaluate the ER curve once
+        decelProp = _stackProp(results[decelPropCol], len(ER))
+        brakeCount = results[brakeCountCol].to_numpy(dtype='float64')
+        overallDecelBinProp = brakeCount @ decelProp / brakeCount.sum()
+        results['ER_MOVES[g/hr/veh]'] = (overallDecelBinProp @ ER) * results[brakeFracCol].to_numpy(dtype='float64')
         results.fillna(0, inplace=True)
         return results
 
@@ -229,10 +242,18 @@ class ERCalculator():
             plt.legend()
             plt.show()
 
-            # update params
+            # update params, the ER curve registry is refreshed for later calER calls
+            setERCurve(material, params)
             if material == 'LM':
                 self.LM_POW_PARAM = params
             elif material == 'NAO':
                 self.NAO_POW_PARAM = params
             elif material == 'SM':
-                self.SM_POW_PARAM = params
\ No newline at end of file
+                self.SM_POW_PARAM = params
+
+
+def _stackProp(props:pd.Series, n):
+    """
+    Stack the per-OpMode deceleration bin proportions into a (OpModes, bins) matrix.
+    """
+    return np.vstack([np.broadcast_to(np.asarray(p, dtype='float64'), (n,)) for p in props])
\ No newline at end of file
@@ -8,16 +8,61 @@
 '''
 
 
+import os
 import numpy as np
 import pandas as pd
 from scipy.optimize import curve_fit
 from sklearn.metrics import r2_score
 
 
-# ER data path
-PATH_LM_POW_PARAM = "calculator/emission-data/LM_PM10_pow_param.npy"
-PATH_NAO_POW_PARAM = "calculator/emission-data/NAO_PM10_pow_param.npy"
-PATH_SM_POW_PARAM = "calculator/emission-data/SM_PM10_pow_param.npy"
+# ER data path, relative to the package
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emission-data")
+PATH_LM_POW_PARAM = os.path.join(DATA_DIR, "LM_PM10_pow_param.npy")
+PATH_NAO_POW_PARAM = os.path.join(DATA_DIR, "NAO_PM10_pow_param.npy")
+PATH_SM_POW_PARAM = os.path.join(DATA_DIR, "SM_PM10_pow_param.npy")
+
+PATH_POW_PARAM = {
+    'LM': PATH_LM_POW_PARAM,
+    'NAO': PATH_NAO_POW_PARAM,
+    'SM': PATH_SM_POW_PARAM,
+}
+
+# order of the mix parameters in a params matrix, see calERMatrix
+ER_PARAM_NAMES = [
+    'prop_NAO_f', 'prop_LM_f', 'prop_SM_f',
+    'prop_NAO_r', 'prop_LM_r', 'prop_SM_r',
+    'prop_drum_f', 'prop_drum_r',
+    'r_f_ratio', 'drum_disc_ratio'
+]
+
+# process-wide registry of ER-decel curve params, loaded once
+_ER_CURVES = {}
+
+
+def getERCurves():
+    """
+    Get params of ER-decel curves {material: [a, b]}, loaded from disk on the first call.
+    """
+    if not _ER_CURVES:
+        for material, path in PATH_POW_PARAM.items():
+            _ER_CURVES[material] = np.load(path)
+    return _ER_CURVES
+
+
+def setERCurve(material, params):
+    """
+    Update params of the ER-decel curve of a material in the registry.
+    material: LM, NAO or SM
+    params: [a, b] of the power function
+    """
+    getERCurves()[material] = np.asarray(params, dtype='float64')
+
+
+def resetERCurves():
+    """
+    Invalidate the registry, params are reloaded from disk on the next call.
+    """
+    _ER_CURVES.clear()
 
 
 def _pow(x, a, b):
@@ -53,20 +98,18 @@ def calER(
     prop_drum_r: share of drum brake for rear brake
     r_f_ratio: brake force on front axle vs rear axle
     drum_disc_ratio: ratio of drum emissions to disc emissions 
+    - all params broadcast with decel, e.g., params of shape (m, 1) and decel of shape (k,) give (m, k).
     """
-    # load params of ER-decel curves
-    LM_POW_PARAM = np.load(PATH_LM_POW_PARAM)
-    NAO_POW_PARAM = np.load(PATH_NAO_POW_PARAM)
-    SM_POW_PARAM = np.load(PATH_SM_POW_PARAM)
+    # params of ER-decel curves
+    curves = getERCurves()
+    ER_NAO = _pow(decel, *curves['NAO'])
+    ER_LM = _pow(decel, *curves['LM'])
+    ER_SM = _pow(decel, *curves['SM'])
 
     # mix for disc brake
-    ER_f_disc = (_pow(decel, *NAO_POW_PARAM) * prop_NAO_f) \
-                + (_pow(decel, *LM_POW_PARAM) * prop_LM_f) \
-                + (_pow(decel, *SM_POW_PARAM) * prop_SM_f)
-    ER_r_disc = (_pow(decel, *NAO_POW_PARAM) * prop_NAO_r) \
-                + (_pow(decel, *LM_POW_PARAM) * prop_LM_r) \
-                + (_pow(decel, *SM_POW_PARAM) * prop_SM_r)
-    ER_r_disc *= r_f_ratio
+    ER_f_disc = ER_NAO * prop_NAO_f + ER_LM * prop_LM_f + ER_SM * prop_SM_f
+    ER_r_disc = ER_NAO * prop_NAO_r + ER_LM * prop_LM_r + ER_SM * prop_SM_r
+    ER_r_disc = ER_r_disc * r_f_ratio
         
     # adjust for axles
     ER_f_drum = ER_f_disc * drum_disc_ratio
@@ -82,6 +125,18 @@ def calER(
     return ER  
 
 
+def calERMatrix(decel, params):
+    """
+    Calculate emission rates for a batch of parameter sets.
+    decel: deceleration values, ndarray of shape (k,).
+    params: params matrix of shape (m, 10), columns ordered as ER_PARAM_NAMES.
+    return: ER matrix of shape (m, k).
+    """
+    decel = np.asarray(decel, dtype='float64').reshape(1, -1)
+    params = np.atleast_2d(np.asarray(params, dtype='float64'))
+    return calER(decel, *(params[:, [i]] for i in range(len(ER_PARAM_NAMES))))
+
+
 def fitCurve(
         decel,
         er,
@@ -12,13 +12,26 @@ import pandas as pd
 import numpy as np
 
 
+# MOVES OpMode bins
+SPEED_EDGES = np.array([1.609, 40.234, 80.467])  # km/h, i.e., 1, 25, 50 mph
+VSP_EDGES = np.array([0, 3, 6, 9, 12, 18, 24, 30])  # kW/t
+OPMODE_LUT = np.array([
+    [1, 1, 1, 1, 1, 1, 1, 1, 1],  # idling
+    [11, 12, 13, 14, 15, 16, 16, 16, 16],  # 1-25 mph
+    [21, 22, 23, 24, 25, 27, 28, 29, 30],  # 25-50 mph
+    [33, 33, 33, 35, 35, 37, 38, 39, 40],  # 50+ mph
+], dtype='int8')
+
+
 def OpModeDetect(
         traj:pd.DataFrame,
         gradeCol='grade[D]',
         speedCol='speed[km/h]',
         accCol='acc[m/s2]',
         VSPCol='VSP[kW/t]',
-        OpModeColName="OpModeID"
+        OpModeColName="OpModeID",
+        segCol=None,
+        prevTraj=None,
 ):
     """
     Detect Operating Mode for each traj point.
@@ -27,44 +40,84 @@ def OpModeDetect(
     speedCol: column name of speed.
     accCol: column name of acc.
     VSPCol: column name of VSP.
+    segCol: column name of trip ID, the t-1/t-2 lags are not carried across trips.
+    prevTraj: the previous chunk (only its last two points are used), for chunked input.
+    return: traj with an Int8 OpMode column, <NA> for points that cannot be assigned.
     """
     traj = traj.copy()
-    traj[OpModeColName] = None
-    
+
+    seg = traj[segCol].to_numpy() if segCol else None
+    accGradePrev, segPrev = None, None
+    if prevTraj is not None:
+        prevTraj = prevTraj.iloc[-2:]
+        accGradePrev = _accGrade(prevTraj[accCol].to_numpy(), prevTraj[gradeCol].to_numpy())
+        segPrev = prevTraj[segCol].to_numpy() if segCol else None
+
+    OpMode = getOpModeID(
+        _accGrade(traj[accCol].to_numpy(), traj[gradeCol].to_numpy()),
+        traj[speedCol].to_numpy(),
+        traj[VSPCol].to_numpy(),
+        seg, accGradePrev, segPrev
+    )
+    traj[OpModeColName] = pd.arrays.IntegerArray(OpMode, OpMode < 0)
+
+    return traj
+
+
+def _accGrade(acc, grade):
+    """
+    Acceleration corrected by road grade.
+    """
     g = 9.8
-    traj['acc_grade'] = traj[accCol] + g * np.sin(np.arctan(traj[gradeCol]))
-    traj['acc_grade_t-1'] = traj['acc_grade'].shift(1)
-    traj['acc_grade_t-2'] = traj['acc_grade'].shift(2)
+    return np.asarray(acc, dtype='float64') + g * np.sin(np.arctan(np.asarray(grade, dtype='float64')))
+
+
+def getOpModeID(
+        accGrade,
+        speed,
+        VSP,
+        seg=None,
+        accGradePrev=None,
+        segPrev=None,
+):
+    """
+    Assign OpMode IDs with a single binning pass over the arrays.
+    accGrade: acceleration corrected by road grade [m/s2].
+    speed: speed [km/h].
+    VSP: VSP [kW/t].
+    seg: trip ID of each point, the t-1/t-2 lags are not carried across trips.
+    accGradePrev, segPrev: accGrade and trip ID of the last points of the previous chunk.
+    return: int8 ndarray, -1 for points that cannot be assigned.
+    """
+    accGrade = np.asarray(accGrade, dtype='float64')
+    speed = np.asarray(speed, dtype='float64')
+    VSP = np.asarray(VSP, dtype='float64')
+    n = len(accGrade)
+
+    # t-1 and t-2 lags, carried over from the previous chunk if given
+    head = np.full(2, np.nan)
+    if accGradePrev is not None:
+        head = np.concatenate([head, np.asarray(accGradePrev, dtype='float64')])[-2:]
+    ext = np.concatenate([head, accGrade])
+    lag1, lag2 = ext[1:-1].copy(), ext[:-2].copy()
+
+    if seg is not None and n:
+        seg = np.asarray(seg)
+        segHead = np.full(2, seg[0], dtype=seg.dtype)
+        if segPrev is not None:
+            segHead = np.concatenate([segHead, np.asarray(segPrev, dtype=seg.dtype)])[-2:]
+        change = np.concatenate([segHead, seg])
+        change = change[1:] != change[:-1]
+        lag1[change[1:]] = np.nan
+        lag2[change[1:] | change[:-1]] = np.nan
 
-    traj.loc[(traj['acc_grade']<=-0.894) | ((traj['acc_grade']<-0.447) & (traj['acc_grade_t-1']<-0.447) & (traj['acc_grade_t-2']<-0.447)), OpModeColName] = 0
+    # speed-VSP bins
+    OpMode = OPMODE_LUT[np.digitize(speed, SPEED_EDGES), np.digitize(VSP, VSP_EDGES)]
+    binned = (accGrade > -0.894) & ~np.isnan(speed) & ((speed < SPEED_EDGES[0]) | ~np.isnan(VSP))
+
+    # braking (MOVES OpMode 0) takes precedence over the speed-VSP bins:
+    # accGrade <= -2 mph/s, or < -1 mph/s at t, t-1 and t-2
+    braking = (accGrade <= -0.894) | ((accGrade < -0.447) & (lag1 < -0.447) & (lag2 < -0.447))
     
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]<1.609), OpModeColName] = 1
-
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]<0), OpModeColName] = 11
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]>=0) & (traj[VSPCol]<3), OpModeColName] = 12
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]>=3) & (traj[VSPCol]<6), OpModeColName] = 13
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]>=6) & (traj[VSPCol]<9), OpModeColName] = 14
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]>=9) & (traj[VSPCol]<12), OpModeColName] = 15
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=1.609) & (traj[speedCol]<40.234) & (traj[VSPCol]>=12), OpModeColName] = 16
-
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]<0), OpModeColName] = 21
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=0) & (traj[VSPCol]<3), OpModeColName] = 22
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=3) & (traj[VSPCol]<6), OpModeColName] = 23
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=6) & (traj[VSPCol]<9), OpModeColName] = 24
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=9) & (traj[VSPCol]<12), OpModeColName] = 25
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=12) & (traj[VSPCol]<18), OpModeColName] = 27
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=18) & (traj[VSPCol]<24), OpModeColName] = 28
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=24) & (traj[VSPCol]<30), OpModeColName] = 29
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=40.234) & (traj[speedCol]<80.467) & (traj[VSPCol]>=30), OpModeColName] = 30
-
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]<6), OpModeColName] = 33
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]>=6) & (traj[VSPCol]<12), OpModeColName] = 35
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]>=12) & (traj[VSPCol]<18), OpModeColName] = 37
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]>=18) & (traj[VSPCol]<24), OpModeColName] = 38
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]>=24) & (traj[VSPCol]<30), OpModeColName] = 39
-    traj.loc[(traj['acc_grade']>-0.894) & (traj[speedCol]>=80.467) & (traj[VSPCol]>=30), OpModeColName] = 40
-
-
-    traj.drop(['acc_grade', 'acc_grade_t-1', 'acc_grade_t-2'], inplace=True, axis=1)
+    return np.where(braking, 0, np.where(binned, OpMode, -1)).astype('int8')
 
-    return traj
@@ -18,29 +18,109 @@ A = -0.0001454 / (1.609344 ** 2) / 3.6 * 1.609344
 B = 0.0000622 / 1.609344 / 3.6 * 1.609344
 C = -0.1758 / 3.6 * 1.609344
 
+
+def coastDownParam(a, b, c):
+    """
+    Convert coast-down curve coefficients from mph-mph/s to km/h-m/s2.
+    a, b, c: coefficients of y = a * x2 + b * x + c (mph)
+    return: (A, B, C)
+    """
+    return (
+        a / (1.609344 ** 2) / 3.6 * 1.609344,
+        b / 1.609344 / 3.6 * 1.609344,
+        c / 3.6 * 1.609344
+    )
+
+
+# registry of coast down curves, keyed by vehicle class (str) or vehicle weight (kg)
+COAST_DOWN_CURVES = {
+    'LDV': (A, B, C),
+    1497: (A, B, C),
+}
+
+
+def registerCoastDownCurve(key, a, b, c, mph=True):
+    """
+    Register a coast down curve for a vehicle class or weight.
+    key: vehicle class (str) or vehicle weight (kg).
+    a, b, c: coefficients of the quadratic coast-down curve.
+    mph: True if the coefficients are given in mph-mph/s (MOVES), else km/h-m/s2.
+    """
+    COAST_DOWN_CURVES[key] = coastDownParam(a, b, c) if mph else (a, b, c)
+
+
+def getCoastDownParams(keys, curves=None):
+    """
+    Look up coast down coefficients for each traj point.
+    keys: vehicle class or vehicle weight (kg) of each point, array-like.
+    - vehicle weights are matched to the closest registered weight.
+    curves: registry of coast down curves, default COAST_DOWN_CURVES.
+    return: A, B, C ndarrays
+    """
+    curves = COAST_DOWN_CURVES if curves is None else curves
+    keys = pd.Series(keys)
+
+    if pd.api.types.is_numeric_dtype(keys):  # by vehicle weight
+        wKeys = sorted(k for k in curves if not isinstance(k, str))
+        if not wKeys:
+            raise KeyError("No coast down curve is registered by vehicle weight.")
+        weights = np.array(wKeys, dtype='float64')
+        table = np.array([curves[k] for k in wKeys] + [(np.nan, np.nan, np.nan)])
+
+        # closest registered weight
+        w = keys.to_numpy(dtype='float64')
+        if len(weights) > 1:
+            idx = np.clip(np.searchsorted(weights, w), 1, len(weights) - 1)
+            idx -= (w - weights[idx-1]) <= (weights[idx] - w)
+        else:
+            idx = np.zeros(len(w), dtype='int64')
+        idx[np.isnan(w)] = -1  # unknown weight maps to the NaN row
+        coeffs = table[idx]
+    
+    else:  # by vehicle class
+        codes, uniques = pd.factorize(keys)
+        missing = [k for k in uniques if k not in curves]
+        if missing:
+            raise KeyError("No coast down curve is registered for %s." % missing)
+        table = np.array([curves[k] for k in uniques] + [(np.nan, np.nan, np.nan)])
+        coeffs = table[codes]  # code -1 (missing key) maps to the NaN row
+
+    return coeffs[:, 0], coeffs[:, 1], coeffs[:, 2]
+
+
 def PEREDetect(
         traj:pd.DataFrame,
         speedCol="speed[km/h]",
         accCol="acc[m/s2]",
-        brakeColName="braking"
+        brakeColName="braking",
+        vehCol=None,
+        curves=None,
 ):
     """
     Determine whether braking event is happening according to PERE curve (MOVES).
     traj: trajectory DataFrame.
     speedCol: column name of speed.
     accCol: column name of acceleration.
+    vehCol: column name of vehicle class or weight (kg) to choose per-vehicle curves, if None, use the LDV curve.
+    curves: registry of coast down curves, default COAST_DOWN_CURVES.
     """
     traj = traj.copy()
-    traj.loc[:, brakeColName] = traj.apply(lambda x: True if x[accCol] < coastDownDec(x[speedCol]) else False, axis=1)
+
+    v = traj[speedCol].to_numpy(dtype='float64')
+    if vehCol:
+        dec = coastDownDec(v, *getCoastDownParams(traj[vehCol], curves))
+    else:
+        dec = coastDownDec(v)
+    traj[brakeColName] = traj[accCol].to_numpy(dtype='float64') < dec  # NaN is not braking
 
     return traj
 
-def coastDownDec(v):
+def coastDownDec(v, A=A, B=B, C=C):
     """
     Coasting deceleration value calculation according to the coast-down curve of 1497kg vehicles.
-    v: speed, km/h
+    v: speed, km/h, number or ndarray
+    A, B, C: coefficients of the coast-down curve (km/h-m/s2), number or ndarray.
     return: dec, m/s^2
     """
     dec = A * v**2 + B * v + C
     return np.float32(dec)
-
@@ -124,7 +124,7 @@ class ERCalculator():
             ER_r_disc = (self._pow(decel, *self.NAO_POW_PARAM) * prop_NAO_r) \
                       + (self._pow(decel, *self.LM_POW_PARAM) * prop_LM_r) \
                       + (self._pow(decel, *self.SM_POW_PARAM) * prop_SM_r)
-            ER_r_disc *= r_f_ratio
+            ER_r_disc = ER_r_disc * r_f_ratio  # not in-place, params may broadcast with decel
             
             # adjust for axles
             ER_f_drum = ER_f_disc * drum_disc_ratio
@@ -145,6 +145,59 @@ class ERCalculator():
             return ER if pollutant == 'PM10' else ER * PM25_10_RATIO
     
 
+    def sweep(
+            self, param_grid, opmode_info:pd.DataFrame, decel,
+            brakeFracCol='brakeFrac', decelPropCol='brakeDecelBinFrac',
+            quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), pollutant='PM10',
+    ):
+        """
+        Evaluate OpMode ERs over a grid of vehicle parameters in one batch.
+        param_grid: parameters of calER ('mix'), either
+            - dict {param name: values}, evaluated on the full Cartesian product, or
+            - DataFrame with one parameter set per row, e.g., Monte Carlo samples of prop_NAO_f, etc.
+        opmode_info: information for OpModes (one row per OpMode), should include:
+            - braking fraction: ratio of braking events in each OpMode
+            - deceleration distribution over the decel bins, e.g., [0.35, 0.25, 0.15,...]
+        decel: deceleration of each bin (positive), ndarray.
+        quantiles: quantiles in the summary.
+        return:
+            params: parameter sets, DataFrame (params x names)
+            ERs: ER [g/hr/veh] of each OpMode under each parameter set, DataFrame (params x OpModes)
+            summary: distribution of ERs for each OpMode, DataFrame (OpModes x stats)
+        """
+        # parameter sets
+        if isinstance(param_grid, pd.DataFrame):
+            params = param_grid.reset_index(drop=True)
+        else:
+            names = list(param_grid.keys())
+            grids = np.meshgrid(*[np.asarray(param_grid[n], dtype='float64') for n in names], indexing='ij')
+            params = pd.DataFrame({n: g.ravel() for n, g in zip(names, grids)})
+
+        # ER curves under each parameter set, (params x decel bins)
+        decel = np.asarray(decel, dtype='float64')
+        ER = self.calER(
+            decel[np.newaxis, :], 'mix', pollutant,
+            **{n: params[n].to_numpy(dtype='float64')[:, np.newaxis] for n in params.columns}
+        )
+        ER = np.broadcast_to(ER, (max(len(params), 1), len(decel)))
+
+        # braking time share in each decel bin, (OpModes x decel bins)
+        weight = np.vstack([
+            np.broadcast_to(np.asarray(p, dtype='float64'), decel.shape) for p in opmode_info[decelPropCol]
+        ]) * opmode_info[brakeFracCol].to_numpy(dtype='float64')[:, np.newaxis]
+        weight = np.nan_to_num(weight)
+
+        # contract the params x OpModes x decel bins tensor over the decel bins
+        ERs = pd.DataFrame(ER @ weight.T, columns=opmode_info.index)
+
+        summary = ERs.quantile(list(quantiles)).T
+        summary.columns = ['q%g' % (q * 100) for q in quantiles]
+        summary.insert(0, 'min', ERs.min())
+        summary.insert(0, 'mean', ERs.mean())
+        summary['max'] = ERs.max()
+
+        return params, ERs, summary
+
     def plotERCurve(
             self, material, pollutant='PM10',
             dpi=100, CHN=False
@@ -1,2 +1,5 @@
 from .matching import Matcher
-from .pytrackEngine import pytrackMatch
\ No newline at end of file
+from .pytrackEngine import pytrackMatch
+from .hmmEngine import hmmMatch
+from .network import NetworkStore, CandidateIndex, RouteCache
+from .online import OnlineMatcher
@@ -0,0 +1,189 @@
+'''
+@File    :   hmmEngine.py
+@Time    :   2023/10/16 21:08:13
+@Author  :   Qiuzi Chen
+@Version :   1.0
+@Contact :   qiuzi.chen@outlook.com
+@Desc    :   A map-matching engine of HMM with array-based Viterbi decoding.
+'''
+
+
+import numpy as np
+import networkx as nx
+
+from mapmatch.network import CandidateIndex, EdgeAttributes
+from pytrack.graph import distance
+
+
+SIGMA = 4.07  # std of GPS noise [m]
+BETA = 3  # scale of the route/great-circle distance difference [m]
+
+
+def hmmMatch(
+        lon,
+        lat,
+        road_graph=None,
+        node_gdf=None,
+        edge_gdf=None,
+        enlarge_dist=300,
+        interp_dist=30,
+        radius=30,
+        sigma=SIGMA,
+        beta=BETA,
+        maxDetour=1000,
+        road_info=False,
+        candidate_index=None,
+        edge_attr=None,
+):
+    """
+    Perform HMM map-matching with candidates in padded arrays (points x K).
+    lon, lat: longitude and latitude, either list or ndarray.
+    road_graph: [NetworkX.MultiDiGraph]
+    node_gdf: GeoDataFrame of nodes
+    edge_gdf: road network information, DataFrame or GeoDataFrame.
+    enlarge_dist: distance for bounding box enlarging, used if candidate_index is None.
+    interp_dist: interpolate dist between two adjacent nodes, used if candidate_index is None.
+    radius: radius of the candidate search circle.
+    sigma: std of GPS noise for emission probabilities [m].
+    beta: scale for transition probabilities [m].
+    maxDetour: route distance longer than the great-circle distance by maxDetour [m] is taken as unreachable.
+    road_info: True if road information (road_type, bridge, tunnel) is needed.
+    candidate_index: CandidateIndex of the whole road network, if None, it is built from the trip's subgraph.
+    edge_attr: EdgeAttributes of the network for road information, built from edge_gdf if None.
+    return: info [dict], edge_osmid, lon and lat of matched points, NaN for points without candidates.
+    """
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.asarray(lat, dtype='float64')
+    n = len(lon)
+
+    if candidate_index is None:
+        north, south, west, east = distance.enlarge_bbox(np.max(lat), np.min(lat), np.min(lon), np.max(lon), enlarge_dist)
+        G = road_graph.subgraph(node_gdf.clip(mask=[west, south, east, north])['osmid'].to_list())
+        candidate_index = CandidateIndex.fromGraph(G, interp_dist)
+
+    # candidates in padded arrays, -1 for padding
+    cand, dist = getCandidateArrays(candidate_index, np.column_stack([lat, lon]), radius)
+    observed = np.flatnonzero(cand[:, 0] >= 0)
+
+    # viterbi over points with candidates
+    best = viterbi(candidate_index, cand[observed], dist[observed], lon[observed], lat[observed], sigma, beta, maxDetour)
+
+    info = {
+        'edge_osmid': [np.nan] * n,
+        'lon': np.full(n, np.nan),
+        'lat': np.full(n, np.nan),
+    }
+    matched = cand[observed, best]
+    for i, c in zip(observed, matched):
+        info['edge_osmid'][i] = candidate_index.edge_osmid[c]
+    info['lat'][observed], info['lon'][observed] = np.rad2deg(np.asarray(candidate_index.xy)[matched]).T
+
+    if road_info and (edge_attr is not None or edge_gdf is not None):
+        if edge_attr is None:
+            edge_attr = EdgeAttributes(edge_gdf)
+        info.update(edge_attr.lookup(info['edge_osmid']))
+
+    return info
+
+
+def getCandidateArrays(candidate_index, points, radius=30):
+    """
+    Search candidates and pad them into arrays.
+    points: (lat, lon) of GPS points [degree], ndarray.
+    return: candidate indices and distances [m], (points x K) ndarray, -1 and inf for padding.
+    """
+    pointIdx, candIdx, dists = candidate_index.query(points, radius=radius, closest=True)
+    count = np.bincount(pointIdx, minlength=len(points))
+    K = max(int(count.max(initial=0)), 1)
+    slot = np.arange(len(pointIdx)) - np.repeat(np.cumsum(count) - count, count)
+
+    cand = np.full((len(points), K), -1, dtype='int64')
+    dist = np.full((len(points), K), np.inf)
+    cand[pointIdx, slot] = candIdx
+    dist[pointIdx, slot] = dists
+    return cand, dist
+
+
+def viterbi(candidate_index, cand, dist, lon, lat, sigma=SIGMA, beta=BETA, maxDetour=1000):
+    """
+    Viterbi decoding with emission and transition log-probabilities in bulk.
+    cand, dist: candidates and distances of points, (points x K) ndarray.
+    lon, lat: coordinates of points.
+    return: slot of the matched candidate of each point, ndarray.
+        The chain restarts at points that no candidate of the previous point can reach.
+    """
+    n, K = cand.shape
+    if n == 0:
+        return np.array([], dtype='int64')
+
+    logEmission = -np.log(np.sqrt(2 * np.pi) * sigma) - 0.5 * (dist / sigma) ** 2
+    gcDist = _haversine(lon[:-1], lat[:-1], lon[1:], lat[1:])
+
+    score = logEmission[0]
+    backPointer = np.zeros((n, K), dtype='int64')
+    segmentScore = {}  # final scores of chain segments, by the last point before a restart
+
+    for t in range(1, n):
+        routeDist = getRouteDist(candidate_index, cand[t-1], cand[t], gcDist[t-1] + maxDetour)
+        logTransition = -np.log(beta) - np.abs(routeDist - gcDist[t-1]) / beta
+        total = score[:, np.newaxis] + logTransition
+        backPointer[t] = np.argmax(total, axis=0)
+        newScore = total[backPointer[t], np.arange(K)] + logEmission[t]
+
+        if np.isfinite(newScore).any():
+            score = newScore
+        else:  # broken chain
+            segmentScore[t-1] = score
+            score = logEmission[t]
+
+    # backtrack
+    best = np.zeros(n, dtype='int64')
+    best[-1] = np.argmax(score)
+    for t in range(n - 1, 0, -1):
+        if t - 1 in segmentScore:
+            best[t-1] = np.argmax(segmentScore[t-1])
+        else:
+            best[t-1] = backPointer[t, best[t]]
+    return best
+
+
+def getRouteDist(candidate_index, source, target, cutoff):
+    """
+    Route distances between candidates, computed with bounded Dijkstra and cached in the LRU cache of the index.
+    source, target: candidate indices, -1 for padding.
+    cutoff: maximum route distance to search [m].
+    return: (source x target) ndarray, inf for unreachable pairs or padding.
+    """
+    G = candidate_index.graph
+    cache = candidate_index.routes
+    routeDist = np.full((len(source), len(target)), np.inf)
+
+    targetNode = [candidate_index.node[j] if j >= 0 else None for j in target]
+    for i, s in enumerate(source):
+        if s < 0:
+            continue
+        u = candidate_index.node[s]
+
+        # cached values are distances, or -cutoff if not reached within that cutoff
+        cached = [cache.get((u, v), cutoff=cutoff) if v is not None else None for v in targetNode]
+        if any(v is not None and c is None for v, c in zip(targetNode, cached)):
+            lengths = nx.single_source_dijkstra_path_length(G, u, cutoff=cutoff, weight='length')
+            cached = [lengths.get(v, -cutoff) if v is not None else None for v in targetNode]
+            for v, c in zip(targetNode, cached):
+                if v is not None:
+                    cache.put((u, v), c)
+
+        for j, c in enumerate(cached):
+            if c is not None and 0 <= c <= cutoff:
+                routeDist[i, j] = c
+
+    return routeDist
+
+
+def _haversine(lon1, lat1, lon2, lat2):
+    """
+    Great-circle distance [m].
+    """
+    lon1, lat1, lon2, lat2 = map(np.deg2rad, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * distance.EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
@@ -9,15 +9,28 @@
 
 
 import pandas as pd
-import geopandas as gpd
 from tqdm import tqdm
+from multiprocessing import Pool
 from mapmatch.pytrackEngine import pytrackMatch
-from pytrack.graph import graph, distance, utils
+from mapmatch.hmmEngine import hmmMatch
+from mapmatch.online import OnlineMatcher
+from mapmatch.network import NetworkStore, CandidateIndex, RouteCache, EdgeAttributes
+from pytrack.graph import distance
 
 
 ENGINE_DICT = {
-    'pytrack': pytrackMatch
+    'pytrack': pytrackMatch,
+    'hmm': hmmMatch,
 }
+# engines that cache route distances on the candidate index
+ROUTE_ENGINES = ['hmm']
+ERROR_COLUMNS = ['tripID', 'pointNum', 'errorType', 'errorMsg']
+ROAD_INFO_COLUMNS = ['road_type', 'bridge', 'tunnel']
+# columns of traj and the keys of engine results they are filled from
+INFO_COLUMNS = {'osmid': 'edge_osmid', 'mapLon': 'lon', 'mapLat': 'lat', **{col: col for col in ROAD_INFO_COLUMNS}}
+
+# road network of a worker process, shared once by _initWorker
+_WORKER = {}
 
 
 class Matcher():
@@ -26,13 +39,28 @@ class Matcher():
     """
     def __init__(
             self,
-            engine='pytrack'
+            engine='pytrack',
+            cacheDir=None,
+            osmFile=None,
+            routeCacheSize=10**6,
+            persistRoutes=True,
     ):
         """
         road_graph: [NetworkX.MultiDiGraph]
         engine: mapmatching engine.
+        cacheDir: directory to cache road networks, e.g., ~/.cache/mapmatch, if None, networks are extracted for each call.
+        osmFile: local OSM extract, if given, networks are built offline from it with the drivable roads of CUSTOM_FILTER.
+        routeCacheSize: maximum number of route distances kept in the LRU cache of a network.
+        persistRoutes: True to save cached route distances in cacheDir for later runs.
         """
+        self.store = NetworkStore(cacheDir, osmFile) if cacheDir else None
+        self.osmFile = osmFile
+        self.routeCacheSize = routeCacheSize
+        self.persistRoutes = persistRoutes
+        self.routes = None  # RouteCache of the last network, see RouteCache.stats()
+        self.engine = engine
         self.matchEngine = ENGINE_DICT[engine]
+        self.errors = pd.DataFrame(columns=ERROR_COLUMNS)
     
     def match(
             self,
@@ -41,6 +69,8 @@ class Matcher():
             latCol='lat',
             tripIDCol='tripID',
             dropCoord=True,
+            nWorkers=1,
+            chunkSize=16,
             **kwargs
     ):
         """
@@ -50,6 +80,9 @@ class Matcher():
         latCol: column name of latitude
         tripIDCol: column name of tripID to perform map matching for each trip seperately. If None, perform interpolation for the whole traj.df.
         dropCoord: True if no need for keeping mapping coordinates.
+        nWorkers: number of worker processes for matching trips in parallel, 1 for sequential matching.
+        chunkSize: number of trips sent to a worker at a time.
+        Trips that fail are left unmatched and recorded in `self.errors`.
         """
         traj = traj.copy()
         if dropCoord:
@@ -64,42 +97,56 @@ class Matcher():
         north, south, west, east = traj[latCol].max(), traj[latCol].min(), traj[lonCol].min(), traj[lonCol].max()
         north, south, west, east = distance.enlarge_bbox(north, south, west, east, 500)
 
-        # custom filter
-        custom_filter = ('["highway"]["area"!~"yes"]["access"!~"private"]'
-                 '["highway"!~"abandoned|bridleway|bus_guideway|construction|corridor|cycleway|'
-                 'elevator|escalator|footway|path|pedestrian|planned|platform|proposed|raceway|steps|track"]'
-                 '["service"!~"emergency_access|private"]')
+        if self.store:
+            key, road_graph, node_gdf, edge_gdf = self.store.getNetwork(north, south, west, east)
+        else:
+            road_graph, node_gdf, edge_gdf = NetworkStore(None, self.osmFile, snap=None).extract(north, south, west, east)
+        network = dict(road_graph=road_graph, node_gdf=node_gdf, edge_gdf=edge_gdf)
+        if kwargs.get('road_info'):
+            network['edge_attr'] = EdgeAttributes(edge_gdf)
 
-        road_graph = graph.graph_from_bbox(north, south, west, east, simplify=True, custom_filter=custom_filter)
-        node_gdf, edge_gdf = utils.graph_to_gdfs(road_graph)
-        node_gdf = gpd.GeoDataFrame(node_gdf, geometry="geometry")
-        edge_gdf = gpd.GeoDataFrame(edge_gdf, geometry="geometry")
+        # candidate index of the whole network, built once and shared by trips
+        if self.store:
+            network['candidate_index'] = self.store.getCandidateIndex(key, road_graph, kwargs.get('interp_dist', 30), self.routeCacheSize)
+        else:
+            network['candidate_index'] = CandidateIndex.fromGraph(road_graph, kwargs.get('interp_dist', 30))
+            network['candidate_index'].routes = RouteCache(self.routeCacheSize)
+        self.routes = network['candidate_index'].routes
 
         # perform map-matching for each trip seperately
         if tripIDCol:  
-            
-            for id in tqdm(traj[tripIDCol].unique(), desc="Map-matching"):  
-                # select trip from traj.df
-                trip = traj[traj[tripIDCol] == id].copy()
-
-                try:
-                    info_dict = self.matchEngine(
-                        lon=trip[lonCol],
-                        lat=trip[latCol],
-                        road_graph=road_graph,
-                        edge_gdf=edge_gdf,
-                        node_gdf=node_gdf,
-                        **kwargs
-                    )
-                    
-                    # update df
-                    traj.loc[trip.index, 'osmid'] = info_dict['edge_osmid']
-
-                    if not dropCoord:
-                        traj.loc[trip.index, 'mapLon'] = info_dict['lon']
-                        traj.loc[trip.index, 'mapLat'] = info_dict['lat']
-                except:
-                    pass
+            trips = [
+                (id, traj.index[pos], traj[lonCol].to_numpy()[pos], traj[latCol].to_numpy()[pos])
+                for id, pos in traj.groupby(tripIDCol, sort=False).indices.items()
+            ]
+            errors = []
+            matched = {col: [] for col in INFO_COLUMNS}
+
+            for id, index, info_dict, error in tqdm(
+                self._matchTrips(trips, network, nWorkers, chunkSize, kwargs),
+                total=len(trips), desc="Map-matching"
+            ):
+                if error is not None:
+                    errors.append(error)
+                    continue
+
+                for col, key in INFO_COLUMNS.items():
+                    if info_dict.get(key) is not None:
+                        matched[col].append(pd.Series(info_dict[key], index=index, dtype=object if col == 'osmid' else None))
+
+            # update df once for all trips, road info keeps its categorical/boolean dtype
+            for col, values in matched.items():
+                if not values or (dropCoord and col in ('mapLon', 'mapLat')):
+                    continue
+                values = pd.concat(values)
+                if col in ROAD_INFO_COLUMNS:
+                    traj[col] = values.reindex(traj.index)
+                else:
+                    traj.loc[values.index, col] = values
+
+            self.errors = pd.DataFrame(errors, columns=ERROR_COLUMNS)
+            if errors:
+                print(f"{len(errors)} of {len(trips)} trips failed in map-matching, see Matcher.errors.")
         
         # perform map-matching for the whole traj.df
         else:  
@@ -107,17 +154,95 @@ class Matcher():
             info_dict = self.matchEngine(
                 lon=traj[lonCol],
                 lat=traj[latCol],
-                road_graph=road_graph,
-                edge_gdf=edge_gdf,
-                node_gdf=node_gdf,
+                **network,
                 **kwargs
             )
             
             # update df
             traj.loc[:, 'osmid'] = info_dict['edge_osmid']
+            for col in ROAD_INFO_COLUMNS:
+                if col in info_dict:
+                    traj[col] = info_dict[col]
 
             if not dropCoord:
                 traj.loc[:, 'mapLon'] = info_dict['lon']
                 traj.loc[:, 'mapLat'] = info_dict['lat']
+
+        # route distances are only collected in this process, not in the workers
+        if self.store and self.persistRoutes and self.engine in ROUTE_ENGINES and self.routes.dirty:
+            self.store.saveRoutes(key, network['candidate_index'], kwargs.get('interp_dist', 30))
         
-        return traj
\ No newline at end of file
+        return traj
+
+    def online(self, north, south, west, east, interp_dist=30, **kwargs):
+        """
+        Create an online matcher of streaming GPS points within the bounding box, see OnlineMatcher.push/flush.
+        north, south, west, east: bounding box of the road network [degree].
+        interp_dist: interpolate dist between two adjacent nodes.
+        kwargs: parameters of OnlineMatcher, e.g., radius, maxWindow.
+        """
+        if self.store:
+            key, road_graph, _, _ = self.store.getNetwork(north, south, west, east)
+            index = self.store.getCandidateIndex(key, road_graph, interp_dist, self.routeCacheSize)
+        else:
+            road_graph, _, _ = NetworkStore(None, self.osmFile, snap=None).extract(north, south, west, east)
+            index = CandidateIndex.fromGraph(road_graph, interp_dist)
+            index.routes = RouteCache(self.routeCacheSize)
+        self.routes = index.routes
+        return OnlineMatcher(index, **kwargs)
+
+    def _matchTrips(self, trips, network, nWorkers, chunkSize, kwargs):
+        """
+        Match trips sequentially or in a process pool, results are yielded in the order of trips.
+        trips: list of (tripID, index, lon, lat).
+        network: road network passed to the engine, i.e., road_graph, node_gdf, edge_gdf (and candidate_index).
+        return: generator of (tripID, index, info_dict, error).
+        """
+        if nWorkers == 1:
+            for id, index, lon, lat in trips:
+                yield (id, index) + _matchTrip(self.matchEngine, id, lon, lat, network, kwargs)
+            return
+
+        # the road network is sent to each worker once, not with every task
+        chunks = [trips[i:i+chunkSize] for i in range(0, len(trips), chunkSize)]
+        with Pool(nWorkers, initializer=_initWorker, initargs=(self.engine, network)) as pool:
+            for chunk, results in zip(chunks, pool.imap(_matchChunk, [([(id, lon, lat) for id, _, lon, lat in chunk], kwargs) for chunk in chunks])):
+                for (id, index, _, _), result in zip(chunk, results):
+                    yield (id, index) + result
+
+
+def _initWorker(engine, network):
+    """
+    Keep the engine and road network in a worker process.
+    """
+    _WORKER.update(engine=ENGINE_DICT[engine], network=network)
+
+
+def _matchChunk(args):
+    """
+    Match a batch of trips in a worker process.
+    args: list of (tripID, lon, lat), and kwargs of the engine.
+    return: list of (info_dict, error).
+    """
+    trips, kwargs = args
+    return [
+        _matchTrip(_WORKER['engine'], id, lon, lat, _WORKER['network'], kwargs)
+        for id, lon, lat in trips
+    ]
+
+
+def _matchTrip(engine, id, lon, lat, network, kwargs):
+    """
+    Match a trip, failures are returned as an error record instead of raised.
+    return: (info_dict, error)
+    """
+    try:
+        info_dict = engine(
+            lon=lon,
+            lat=lat,
+            **network,
+            **kwargs
+        )
+        return info_dict, None
+    except Exception as e:
+        return None, dict(zip(ERROR_COLUMNS, [id, len(lon), type(e).__name__, str(e)]))
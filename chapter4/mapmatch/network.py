@@ -0,0 +1,493 @@
+'''
+@File    :   network.py
+@Time    :   2023/10/14 10:21:47
+@Author  :   Qiuzi Chen 
+@Version :   1.0
+@Contact :   qiuzi.chen@outlook.com
+@Desc    :   A store that caches road networks and their candidate points on disk.
+'''
+
+
+import os
+import re
+import inspect
+import json
+import pickle
+import hashlib
+import numpy as np
+from collections import OrderedDict
+import pandas as pd
+import geopandas as gpd
+
+from sklearn.neighbors import BallTree
+from sklearn.metrics.pairwise import haversine_distances
+from pytrack.graph import graph, distance, utils
+
+
+# version of the cache layout, part of the key so that older entries are not read
+CACHE_VERSION = 2
+
+# custom filter of drivable roads
+CUSTOM_FILTER = ('["highway"]["area"!~"yes"]["access"!~"private"]'
+                 '["highway"!~"abandoned|bridleway|bus_guideway|construction|corridor|cycleway|'
+                 'elevator|escalator|footway|path|pedestrian|planned|platform|proposed|raceway|steps|track"]'
+                 '["service"!~"emergency_access|private"]')
+
+# clause of an overpass filter, e.g., ["highway"], ["area"!~"yes"]
+FILTER_CLAUSE = re.compile(r'\["([^"]+)"(?:(!?[~=])"([^"]*)")?\]')
+
+# unsimplified graph of the last parsed OSM extract, see `graphFromFile`
+_OSM_GRAPH = {}
+
+
+class NetworkStore():
+    """
+    Road networks keyed by bbox and filter, cached on disk:
+        <cacheDir>/<key>/
+            meta.json: bbox, filter and source of the network
+            graph.pkl: simplified road graph, node/edge tables are rebuilt from it
+            candidates-<interp_dist>/: CandidateIndex, i.e., interpolated graph (points.pkl) and the BallTree of 
+                candidate points, whose arrays (ball-<i>.npy, including the points) are memory-mapped
+    """
+    def __init__(
+            self,
+            cacheDir,
+            osmFile=None,
+            custom_filter=CUSTOM_FILTER,
+            snap=0.01,
+    ):
+        """
+        cacheDir: directory of the cache, e.g., ~/.cache/mapmatch, None if networks are only extracted, see `extract`.
+        osmFile: local OSM extract (.osm/.xml), if given, networks are built offline from it (requires osmnx).
+        custom_filter: overpass filter of drivable roads, for downloading networks and for the ways of osmFile.
+        snap: grid size [degree] the bbox is enlarged to, so that nearby trajectories share a network.
+        """
+        self.cacheDir = os.path.expanduser(cacheDir) if cacheDir else None
+        self.osmFile = osmFile
+        self.custom_filter = custom_filter
+        self.snap = snap
+
+    def getKey(self, north, south, west, east):
+        """
+        Snap the bbox outwards and hash it with the filter and source.
+        return: key, (north, south, west, east) after snapping
+        """
+        if self.snap:
+            north, east = np.ceil(np.round(np.array([north, east]) / self.snap, 6)) * self.snap
+            south, west = np.floor(np.round(np.array([south, west]) / self.snap, 6)) * self.snap
+        bbox = tuple(round(float(v), 6) for v in (north, south, west, east))
+        source = os.path.abspath(self.osmFile) if self.osmFile else "overpass"
+        key = hashlib.sha1(json.dumps([bbox, self.custom_filter, source, CACHE_VERSION]).encode()).hexdigest()[:16]
+        return key, bbox
+
+    def getNetwork(self, north, south, west, east):
+        """
+        Load the road network covering the bbox, extract and cache it if missing.
+        return: key, road_graph, node_gdf, edge_gdf
+        """
+        key, bbox = self.getKey(north, south, west, east)
+        path = os.path.join(self.cacheDir, key)
+
+        if os.path.exists(os.path.join(path, "meta.json")):
+            road_graph = _load(os.path.join(path, "graph.pkl"))
+            return (key, road_graph) + _graphToGdfs(road_graph)
+
+        road_graph, node_gdf, edge_gdf = self.extract(*bbox)
+
+        os.makedirs(path, exist_ok=True)
+        _dump(road_graph, os.path.join(path, "graph.pkl"))
+        with open(os.path.join(path, "meta.json"), "w") as f:  # written last, marks a complete entry
+            json.dump({"bbox": bbox, "custom_filter": self.custom_filter, "osmFile": self.osmFile}, f)
+
+        return key, road_graph, node_gdf, edge_gdf
+
+    def extract(self, north, south, west, east):
+        """
+        Extract the road network within the bbox, from osmFile if given, else from OSM (overpass), without caching.
+        return: road_graph, node_gdf, edge_gdf
+        """
+        if self.osmFile:
+            road_graph = graphFromFile(self.osmFile, north, south, west, east, self.custom_filter)
+        else:
+            road_graph = graph.graph_from_bbox(north, south, west, east, simplify=True, custom_filter=self.custom_filter)
+        return (road_graph,) + _graphToGdfs(road_graph)
+
+    def getCandidateIndex(self, key, road_graph, interp_dist=30, routeCacheSize=10**6):
+        """
+        Load the candidate index of a cached network, build and cache it if missing.
+        key: key of the network, see `getNetwork`.
+        road_graph: road graph of the network.
+        interp_dist: interpolate dist between two adjacent nodes.
+        routeCacheSize: maximum number of cached route distances, saved ones are loaded, see `saveRoutes`.
+        return: CandidateIndex, its points and BallTree are memory-mapped when loaded from the cache.
+        """
+        path = os.path.join(self.cacheDir, key, f"candidates-{interp_dist:g}")
+
+        if os.path.exists(os.path.join(path, "ball.pkl")):
+            points = _load(os.path.join(path, "points.pkl"))
+            points["ball"] = _loadBall(path)
+            points["xy"] = np.asarray(points["ball"].data)  # the tree's own copy of the points
+            index = CandidateIndex(**points)
+            index.routes = RouteCache(routeCacheSize)
+            if os.path.exists(os.path.join(path, "routes.pkl")):
+                index.routes.update(_load(os.path.join(path, "routes.pkl")))
+                index.routes.dirty = False
+            return index
+
+        points = interpolateNetwork(road_graph, interp_dist)
+        os.makedirs(path, exist_ok=True)
+        _dump({k: v for k, v in points.items() if k not in ("xy", "ball")}, os.path.join(path, "points.pkl"))
+        _dumpBall(points["ball"], path)
+
+        index = CandidateIndex(**points)
+        index.routes = RouteCache(routeCacheSize)
+        return index
+
+    def saveRoutes(self, key, index, interp_dist=30):
+        """
+        Save the route distances cached on a candidate index, they are loaded by `getCandidateIndex` in later runs.
+        """
+        path = os.path.join(self.cacheDir, key, f"candidates-{interp_dist:g}")
+        os.makedirs(path, exist_ok=True)
+        _dump(list(index.routes.items()), os.path.join(path, "routes.tmp"))
+        os.replace(os.path.join(path, "routes.tmp"), os.path.join(path, "routes.pkl"))
+        index.routes.dirty = False
+
+
+class CandidateIndex():
+    """
+    Candidate points of an interpolated road network, indexed once and queried for each trip.
+    """
+    def __init__(self, graph, node, edge_osmid, xy, ball=None):
+        """
+        graph: interpolated graph
+        node: node (u) of each candidate point, ndarray
+        edge_osmid: osmid of the edge of each candidate point, ndarray
+        xy: (lat, lon) of each candidate point [radian], ndarray
+        ball: haversine BallTree over xy, built if None.
+        """
+        self.graph = graph
+        self.node = node
+        self.edge_osmid = edge_osmid
+        self.xy = xy
+        self.ball = ball if ball is not None else BallTree(xy, metric='haversine')
+        self.routes = RouteCache()  # route distances between candidates, see hmmEngine.getRouteDist
+
+        # integer code of edges, osmid of simplified edges can be a list
+        self.edgeCode, _ = pd.factorize(pd.Series(_edgeKey(edge_osmid), dtype=object))
+
+    @classmethod
+    def fromGraph(cls, road_graph, interp_dist=30):
+        """
+        Build the index over a road graph.
+        """
+        return cls(**interpolateNetwork(road_graph, interp_dist))
+
+    def query(self, points, radius=30, closest=True):
+        """
+        Search candidates of GPS points.
+        points: (lat, lon) of GPS points [degree], ndarray.
+        radius: radius of the candidate search circle [m].
+        closest: if True, only the closest point of each edge is kept for each GPS point.
+        return: flat arrays, ordered by GPS point:
+            - pointIdx: index of the GPS point
+            - candIdx: index of the candidate point in the network
+            - dist: distance between them [m]
+        """
+        points = np.deg2rad(np.asarray(points, dtype='float64').reshape(-1, 2))
+        idxs, dists = self.ball.query_radius(points, radius / distance.EARTH_RADIUS_M, return_distance=True)
+
+        pointIdx = np.repeat(np.arange(len(idxs)), [len(idx) for idx in idxs])
+        candIdx = np.concatenate(idxs).astype('int64') if len(idxs) else np.array([], dtype='int64')
+        dist = np.concatenate(dists) * distance.EARTH_RADIUS_M if len(dists) else np.array([])
+
+        if closest:
+            edge = self.edgeCode[candIdx]
+            order = np.lexsort((dist, edge, pointIdx))
+            pointIdx, candIdx, dist, edge = pointIdx[order], candIdx[order], dist[order], edge[order]
+            first = np.r_[True, (pointIdx[1:] != pointIdx[:-1]) | (edge[1:] != edge[:-1])][:len(pointIdx)]
+            pointIdx, candIdx, dist = pointIdx[first], candIdx[first], dist[first]
+
+        return pointIdx, candIdx, dist
+
+    def subgraph(self, north, south, west, east):
+        """
+        Interpolated graph of the candidate points within the bbox [degree], e.g., to bound route searches to a trip.
+        """
+        # points within the circle around the bbox, then within the bbox
+        center = np.deg2rad([[(north + south) / 2, (west + east) / 2]])
+        corners = np.deg2rad([[north, west], [north, east], [south, west], [south, east]])
+        idx = self.ball.query_radius(center, haversine_distances(center, corners).max())[0]
+        lat, lon = np.rad2deg(np.asarray(self.xy)[idx]).T
+        inside = (south <= lat) & (lat <= north) & (west <= lon) & (lon <= east)
+        return self.graph.subgraph(pd.unique(self.node[idx[inside]]))
+
+
+class RouteCache():
+    """
+    Route distances between candidates, keyed by (from, to) and evicted in least-recently-used order.
+    A value of -cutoff records that no route was found within that cutoff.
+    """
+    def __init__(self, maxSize=10**6):
+        """
+        maxSize: maximum number of entries.
+        """
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False  # True if entries were added since loading or saving
+
+    def get(self, key, default=None, cutoff=None):
+        """
+        Get a cached value and mark it as recently used.
+        cutoff: cutoff of the route search [m], an entry not found within a smaller cutoff is a miss.
+        """
+        value = self.entries.get(key)
+        if value is None or (cutoff is not None and value < 0 and -value < cutoff):
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a value, the least recently used entry is evicted if the cache is full.
+        """
+        self.dirty = True
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, items):
+        """
+        Cache (key, value) pairs in order, e.g., loaded from disk.
+        """
+        for key, value in items:
+            self.put(key, value)
+
+    def items(self):
+        return self.entries.items()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Counters for sizing the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxSize': self.maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': self.hits / lookups if lookups else np.nan,
+        }
+
+
+class EdgeAttributes():
+    """
+    Road attributes of edges indexed by osmid, built once per network for bulk lookups.
+    """
+    def __init__(self, edge_gdf, osmidCol='osmid'):
+        """
+        edge_gdf: road network information, DataFrame or GeoDataFrame.
+        osmidCol: column name of edge osmid.
+        """
+        index = pd.Index(_edgeKey(edge_gdf[osmidCol]), dtype=object, tupleize_cols=False)
+        first = ~index.duplicated(keep='first')
+        self.index = index[first]
+
+        def column(col):
+            return edge_gdf[col].to_numpy()[first] if col in edge_gdf.columns else np.full(first.sum(), np.nan)
+
+        # multiple values of simplified edges are joined as in OSM, e.g., "primary;secondary"
+        self.road_type = pd.Categorical([
+            ';'.join(map(str, v)) if isinstance(v, list) else v for v in column('highway')
+        ])
+        self.bridge = pd.array([_isTagged(v) for v in column('bridge')], dtype='boolean')
+        self.tunnel = pd.array([_isTagged(v) for v in column('tunnel')], dtype='boolean')
+
+    def lookup(self, edge_osmid):
+        """
+        Look up attributes of edges.
+        edge_osmid: osmid of edges, NaN for unmatched points.
+        return: dict of road_type (Categorical), bridge and tunnel (nullable boolean), NA for unknown edges.
+        """
+        pos = self.index.get_indexer(pd.Index(_edgeKey(edge_osmid), dtype=object, tupleize_cols=False))
+        return {
+            'road_type': self.road_type.take(pos, allow_fill=True),
+            'bridge': self.bridge.take(pos, allow_fill=True),
+            'tunnel': self.tunnel.take(pos, allow_fill=True),
+        }
+
+
+def _edgeKey(osmid):
+    """
+    Hashable osmid, the osmid of simplified edges can be a list.
+    """
+    return [tuple(v) if isinstance(v, list) else v for v in osmid]
+
+
+def _isTagged(value):
+    """
+    True if an OSM tag like bridge/tunnel is set, e.g., "yes" or "viaduct", but not "no".
+    """
+    if isinstance(value, list):
+        return any(_isTagged(v) for v in value)
+    return (isinstance(value, str) and value != 'no') or value is True
+
+
+def interpolateNetwork(road_graph, interp_dist=30):
+    """
+    Interpolate the road graph and index its points for candidate search.
+    road_graph: [NetworkX.MultiDiGraph]
+    interp_dist: interpolate dist between two adjacent nodes.
+    return: dict of graph, node, edge_osmid, xy and ball, see `CandidateIndex`.
+    """
+    G = road_graph.copy()
+    _ = utils.graph_to_gdfs(G, nodes=False)
+    G = distance.interpolate_graph(G, dist=interp_dist)
+
+    geoms = utils.graph_to_gdfs(G, nodes=False).set_index(["u", "v"])[["osmid", "geometry"]]
+
+    uv_xy = [[u, osmid, xy] for uv, geom, osmid in
+             zip(geoms.index, geoms.geometry.values, geoms.osmid.values)
+             for u, xy in zip(uv, geom.coords[:])]
+
+    node, edge_osmid, xy = zip(*uv_xy)
+    xy = np.deg2rad(np.array(xy, dtype='float64')[:, ::-1])  # (lat, lon)
+
+    node_arr = np.empty(len(node), dtype=object)
+    node_arr[:] = node
+    edge_arr = np.empty(len(edge_osmid), dtype=object)
+    edge_arr[:] = edge_osmid
+
+    return {
+        "graph": G,
+        "node": node_arr,
+        "edge_osmid": edge_arr,
+        "xy": xy,
+        "ball": BallTree(xy, metric='haversine'),
+    }
+
+
+def graphFromFile(osmFile, north, south, west, east, custom_filter=None):
+    """
+    Build a simplified road graph within the bbox from a local OSM extract, no network access is needed.
+    osmFile: OSM XML extract, parsed once and reused for other bboxes until the file changes.
+    custom_filter: overpass filter of ways, e.g., CUSTOM_FILTER, matched with the tags of edges. If None, all ways are kept.
+    """
+    import osmnx as ox
+
+    key = (os.path.abspath(osmFile), os.path.getmtime(osmFile))
+    if _OSM_GRAPH.get("key") != key:
+        _OSM_GRAPH.clear()
+        _OSM_GRAPH.update(key=key, graph=ox.graph_from_xml(osmFile, simplify=False))
+    G = _OSM_GRAPH["graph"]
+
+    nodes = [
+        n for n, data in G.nodes(data=True)
+        if (south <= data['y'] <= north) and (west <= data['x'] <= east)
+    ]
+    G = G.subgraph(nodes)
+    if custom_filter:
+        clauses = parseFilter(custom_filter)
+        G = G.edge_subgraph([(u, v, k) for u, v, k, data in G.edges(keys=True, data=True) if matchFilter(data, clauses)])
+    return _simplifyByWay(ox, G.copy())
+
+
+def _simplifyByWay(ox, G):
+    """
+    Simplify a graph with way boundaries kept as endpoints, so that each edge keeps the osmid and tags of one way.
+    """
+    params = inspect.signature(ox.simplify_graph).parameters
+    if 'edge_attrs_differ' in params:  # osmnx >= 2.0
+        return ox.simplify_graph(G, edge_attrs_differ=['osmid'])
+    elif 'endpoint_attrs' in params:  # osmnx 1.9
+        return ox.simplify_graph(G, endpoint_attrs=['osmid'])
+    else:  # non-strict mode of older osmnx, edges of different osmid end at the node
+        return ox.simplify_graph(G, strict=False)
+
+
+def parseFilter(custom_filter):
+    """
+    Split an overpass filter into clauses.
+    return: list of (key, op, value), op is one of '', '=', '!=', '~', '!~', and value of '~'/'!~' is a compiled regex.
+    """
+    return [
+        (key, op, re.compile(value) if op.endswith('~') else value)
+        for key, op, value in FILTER_CLAUSE.findall(custom_filter)
+    ]
+
+
+def matchFilter(tags, clauses):
+    """
+    True if the tags of a way pass all clauses, a missing tag passes the negated ones as in overpass.
+    tags: dict of tags, e.g., edge data of an unsimplified graph.
+    clauses: see `parseFilter`.
+    """
+    for key, op, value in clauses:
+        tag = tags.get(key)
+        if tag is None:
+            hit = False
+        elif op.endswith('~'):
+            hit = value.search(str(tag)) is not None
+        elif op.endswith('='):
+            hit = str(tag) == value
+        else:
+            hit = True
+        if hit == op.startswith('!'):
+            return False
+    return True
+
+
+def _graphToGdfs(road_graph):
+    """
+    Node and edge tables of a road graph.
+    return: node_gdf, edge_gdf
+    """
+    node_gdf, edge_gdf = utils.graph_to_gdfs(road_graph)
+    node_gdf = gpd.GeoDataFrame(node_gdf, geometry="geometry")
+    edge_gdf = gpd.GeoDataFrame(edge_gdf, geometry="geometry")
+    return node_gdf, edge_gdf
+
+
+def _dumpBall(ball, path):
+    """
+    Save a BallTree with its arrays in .npy files, so that they are memory-mapped by `_loadBall` instead of unpickled.
+    """
+    state = list(ball.__getstate__())
+    arrays = [i for i, v in enumerate(state) if isinstance(v, np.ndarray)]
+    for i in arrays:
+        np.save(os.path.join(path, f"ball-{i}.npy"), state[i])
+        state[i] = None
+    _dump((arrays, state), os.path.join(path, "ball.pkl"))  # written last, marks a complete entry
+
+
+def _loadBall(path):
+    """
+    Load a BallTree saved by `_dumpBall`, its arrays are read-only memory maps.
+    """
+    arrays, state = _load(os.path.join(path, "ball.pkl"))
+    for i in arrays:
+        state[i] = np.load(os.path.join(path, f"ball-{i}.npy"), mmap_mode="r")
+    ball = BallTree.__new__(BallTree)
+    ball.__setstate__(tuple(state))
+    return ball
+
+
+def _dump(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
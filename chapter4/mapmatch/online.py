@@ -0,0 +1,169 @@
+'''
+@File    :   online.py
+@Time    :   2023/10/18 15:42:09
+@Author  :   Qiuzi Chen
+@Version :   1.0
+@Contact :   qiuzi.chen@outlook.com
+@Desc    :   Online map-matching of streaming GPS points with a sliding Viterbi window per vehicle.
+'''
+
+
+import numpy as np
+
+from mapmatch.hmmEngine import getCandidateArrays, getRouteDist, _haversine, SIGMA, BETA
+
+
+class OnlineMatcher():
+    """
+    Match GPS points as they arrive. Points are emitted once all surviving Viterbi paths agree on them.
+    """
+    def __init__(
+            self,
+            candidate_index,
+            radius=30,
+            sigma=SIGMA,
+            beta=BETA,
+            maxDetour=1000,
+            maxWindow=60,
+            maxGap=60,
+    ):
+        """
+        candidate_index: CandidateIndex of the road network.
+        radius: radius of the candidate search circle [m].
+        sigma, beta: parameters of emission and transition probabilities, see hmmEngine.hmmMatch.
+        maxDetour: route distance longer than the great-circle distance by maxDetour [m] is taken as unreachable.
+        maxWindow: maximum number of pending points per vehicle, the oldest point is emitted with the current best path beyond it.
+        maxGap: a time gap longer than maxGap [s] ends the path of a vehicle.
+        """
+        self.index = candidate_index
+        self.radius = radius
+        self.sigma = sigma
+        self.beta = beta
+        self.maxDetour = maxDetour
+        self.maxWindow = maxWindow
+        self.maxGap = maxGap
+        self.vehicles = {}  # vehID -> {'window': pending points, 'score': log-probabilities of the latest candidates}
+
+    def push(self, vehID, t, lon, lat):
+        """
+        Add a GPS point of a vehicle, points of a vehicle are pushed in time order.
+        return: list of finalized matches, see `_emit`.
+        """
+        cand, dist = getCandidateArrays(self.index, np.array([[lat, lon]]), self.radius)
+        cand, dist = cand[0][cand[0] >= 0], dist[0][cand[0] >= 0]
+        point = {'t': t, 'lon': lon, 'lat': lat, 'cand': cand, 'bp': None}
+
+        state = self.vehicles.setdefault(vehID, {'window': [], 'score': None, 'last': None})
+        emitted = []
+
+        # points without candidates are kept in order but do not enter the path
+        if len(cand) == 0:
+            state['window'].append(point)
+            if state['score'] is None:
+                return self._emit(vehID, state, len(state['window']))
+            return self._bound(vehID, state)
+
+        logEmission = -np.log(np.sqrt(2 * np.pi) * self.sigma) - 0.5 * (dist / self.sigma) ** 2
+        last = state['last']
+        score = None
+        if state['score'] is not None and t - last['t'] <= self.maxGap:
+            gcDist = _haversine(last['lon'], last['lat'], lon, lat)
+            routeDist = getRouteDist(self.index, last['cand'], cand, gcDist + self.maxDetour)
+            total = state['score'][:, np.newaxis] - np.log(self.beta) - np.abs(routeDist - gcDist) / self.beta
+            point['bp'] = np.argmax(total, axis=0)
+            score = total[point['bp'], np.arange(len(cand))] + logEmission
+            if not np.isfinite(score).any():
+                point['bp'], score = None, None
+
+        # a new path starts, the pending points of the previous one are final
+        if score is None:
+            emitted += self.flush(vehID)
+            state = self.vehicles.setdefault(vehID, {'window': [], 'score': None, 'last': None})
+            score = logEmission
+
+        state['window'].append(point)
+        state['score'] = score
+        state['last'] = point
+
+        # emit points all surviving paths agree on
+        ancestors = self._ancestors(state)
+        alive = np.isfinite(score)
+        converged = [i for i, anc in ancestors.items() if len(np.unique(anc[alive])) == 1]
+        if converged:
+            emitted += self._emit(vehID, state, max(converged) + 1, ancestors, np.flatnonzero(alive)[0])
+
+        return emitted + self._bound(vehID, state)
+
+    def flush(self, vehID=None):
+        """
+        Emit all pending points with the current best path and drop the vehicle state.
+        vehID: vehicle to flush, if None, flush all vehicles.
+        return: list of finalized matches, see `_emit`.
+        """
+        emitted = []
+        for id in ([vehID] if vehID is not None else list(self.vehicles)):
+            state = self.vehicles.pop(id, None)
+            if state is None or not state['window']:
+                continue
+            if state['score'] is None:
+                emitted += self._emit(id, state, len(state['window']))
+            else:
+                emitted += self._emit(id, state, len(state['window']), self._ancestors(state), int(np.argmax(state['score'])))
+        return emitted
+
+    def _bound(self, vehID, state):
+        """
+        Emit the oldest points with the current best path until the window fits in maxWindow.
+        """
+        emitted = []
+        while len(state['window']) > self.maxWindow:
+            ancestors = self._ancestors(state)
+            if not ancestors:
+                emitted += self._emit(vehID, state, 1)
+                continue
+            best = int(np.argmax(state['score']))
+            first = min(ancestors)
+            state['score'][ancestors[first] != ancestors[first][best]] = -np.inf  # keep paths consistent with the emitted match
+            emitted += self._emit(vehID, state, first + 1, ancestors, best)
+        return emitted
+
+    def _ancestors(self, state):
+        """
+        Trace the latest candidates back through the window.
+        return: {window position: candidate slot at the position for each latest candidate}, for points with candidates.
+        """
+        window = state['window']
+        slot = np.arange(len(state['score']))
+        ancestors = {}
+        for i in range(len(window) - 1, -1, -1):
+            if len(window[i]['cand']) == 0:
+                continue
+            ancestors[i] = slot
+            if window[i]['bp'] is None:
+                break
+            slot = window[i]['bp'][slot]
+        return ancestors
+
+    def _emit(self, vehID, state, n, ancestors=None, latest=None):
+        """
+        Emit the first n points of the window, matched with the path ending at the latest candidate slot.
+        return: list of dict (vehID, t, lon, lat, edge_osmid, mapLon, mapLat).
+        """
+        window = state['window']
+        emitted = []
+        for i, point in enumerate(window[:n]):
+            record = {'vehID': vehID, 't': point['t'], 'lon': point['lon'], 'lat': point['lat'],
+                      'edge_osmid': np.nan, 'mapLon': np.nan, 'mapLat': np.nan}
+            if ancestors is not None and i in ancestors:
+                c = point['cand'][ancestors[i][latest]]
+                record['edge_osmid'] = self.index.edge_osmid[c]
+                record['mapLat'], record['mapLon'] = np.rad2deg(np.asarray(self.index.xy[c]))
+            emitted.append(record)
+
+        # the first remaining point starts the path
+        del window[:n]
+        for point in window:
+            if len(point['cand']):
+                point['bp'] = None
+                break
+        return emitted
@@ -13,8 +13,8 @@ import copy
 import numpy as np
 import pandas as pd
 
-from sklearn.neighbors import BallTree
 from filecontrol import blockprint
+from mapmatch.network import CandidateIndex, EdgeAttributes
 
 from pytrack.graph import graph, distance, utils
 from pytrack.matching import mpmatching_utils, mpmatching
@@ -28,6 +28,7 @@ def mapMatch(
         enlarge_dist=300,
         interp_dist=30,
         radius=30,
+        candidate_index=None,
 ):
     """
     Perfrom map-matching.
@@ -37,6 +38,8 @@ def mapMatch(
     enlarge_dist: distance for bounding box enlarging, default = 100 meters.
     interp_dist: interpolate dist between two adjacent nodes. The smaller the interp_dist, the greater the precision and the longer the computational time.
     radius: radius of the candidate search circle.
+    candidate_index: CandidateIndex of the whole road network, if given, candidates are searched in it instead of the trip's subgraph,
+        and routes in its graph within the enlarged bounding box.
     return: results [dict]
     """
     points = [(lat_, lon_) for lat_, lon_ in zip(lat, lon)]
@@ -48,6 +51,14 @@ def mapMatch(
     # Enlarge bounding box
     north, south, west, east = distance.enlarge_bbox(north, south, west, east, enlarge_dist)
 
+    if candidate_index is not None:
+        # candidates from the shared index, the viterbi search is bounded to the trip as for a subgraph
+        _, candidates, no_cands = get_candidates(None, points, closest=True, radius=radius, index=candidate_index)
+        G_interp = candidate_index.subgraph(north, south, west, east)
+        trellis = mpmatching_utils.create_trellis(candidates)
+        path_prob, predecessor = mpmatching.viterbi_search(G_interp, trellis, "start", "target")
+        return elab_candidate_results(candidates, predecessor, no_cands)
+
     # Generate G
     # if road_graph & node_gdf:
     # if road graph is given, generate subgraph from the enlarged bounding box
@@ -80,66 +91,31 @@ def infoGrasp(
         results:dict,
         edge_gdf=None,
         road_info=False,
+        edge_attr=None,
 ):
     """
     Grasp information from map-matching results.
     results: map-matching results, [dict].
     edge_gdf: road network information, DataFrame or GeoDataFrame.
     road_info: True if road information is needed.
+    edge_attr: EdgeAttributes of the network, built from edge_gdf if None.
     """
     # if no roadnet files are given, don't extract road info
-    if edge_gdf is None:
+    if edge_gdf is None and edge_attr is None:
         road_info = False
 
+    # points without candidates are appended at the end of results, restore the point order
+    info = {
+        'edge_osmid': [
+            result['edge_osmid'][np.argwhere(result['candidate_type'] == True)[0][0]] if result['candidates'] else np.nan
+            for result in (results[key] for key in sorted(results))
+        ],
+    }
+
     if road_info:
-        info = {
-            'edge_osmid': [],
-            'road_type': [],
-            'bridge': [],
-            'tunnel': [],
-        }
-    else:
-        info = {
-            'edge_osmid': [],
-        }
-
-    for result in results.values():
-
-        if result['candidates']:  # has candidates
-
-            # get candidate id
-            id = np.argwhere(result['candidate_type'] == True)[0][0]
-
-            # edge osmid
-            edge_osmid = result['edge_osmid'][id]  # edge_osmid
-            info['edge_osmid'].append(edge_osmid)
-
-            # # matched coordinates
-            # info['lat'].append(result['candidates'][id][0])
-            # info['lon'].append(result['candidates'][id][1])
-
-            if road_info:
-                road = edge_gdf[edge_gdf['osmid'] == edge_osmid]
-                if road.shape[0] == 0:
-                    road_type, bridge, tunnel = np.nan, np.nan, np.nan 
-                else:
-                    road = road.iloc[0]
-                    road_type, bridge, tunnel = road['highway'], road['bridge'], road['tunnel'],
-                
-                info['road_type'].append(road_type)
-                info['bridge'].append(bridge)
-                info['bridge'].append(tunnel)
-
-        else:  # no candidates
-
-            info['edge_osmid'].append(np.nan)
-            # info['lat'].append(result['observation'][0])
-            # info['lon'].append(result['observation'][1])
-
-            if road_info:
-                info['road_type'].append(np.nan)
-                info['bridge'].append(np.nan)
-                info['bridge'].append(np.nan)
+        if edge_attr is None:
+            edge_attr = EdgeAttributes(edge_gdf)
+        info.update(edge_attr.lookup(info['edge_osmid']))
 
     return info
 
@@ -154,6 +130,8 @@ def pytrackMatch(
         interp_dist=30,
         radius=30,
         road_info=False,
+        candidate_index=None,
+        edge_attr=None,
 ):
     """
     Perform map-matching and generate info.
@@ -165,6 +143,8 @@ def pytrackMatch(
     interp_dist: interpolate dist between two adjacent nodes. The smaller the interp_dist, the greater the precision and the longer the computational time.
     radius: radius of the candidate search circle.
     road_info: True if road information is needed.
+    candidate_index: CandidateIndex of the whole road network, built once and shared by trips.
+    edge_attr: EdgeAttributes of the network for road information, built once and shared by trips.
     return: results [dict]
     """
 
@@ -175,14 +155,16 @@ def pytrackMatch(
         node_gdf,
         enlarge_dist,
         interp_dist,
-        radius
+        radius,
+        candidate_index
     )
 
     # generate matched info
     info_dict = infoGrasp(
         results,
         edge_gdf,
-        road_info
+        road_info,
+        edge_attr
     )
 
     return info_dict
@@ -193,7 +175,7 @@ Modified PyTrack
 """
 
 
-def get_candidates(G, points, interp_dist=30, closest=True, radius=30):
+def get_candidates(G, points, interp_dist=30, closest=True, radius=30, index=None):
     """ 
     [Modified function from PyTrack to avoid ``no candidates error``]
     Extract candidate points for Hidden-Markov Model map-matching approach.
@@ -211,6 +193,8 @@ def get_candidates(G, points, interp_dist=30, closest=True, radius=30):
         If true, only the closest point is considered for each edge.
     radius: float, optional, default: 10
         Radius of the search circle.
+    index: CandidateIndex, optional, default: None
+        Prebuilt index of the interpolated network, if None, it is built from G.
     Returns
     -------
     G: networkx.MultiDiGraph
@@ -220,58 +204,20 @@ def get_candidates(G, points, interp_dist=30, closest=True, radius=30):
     no_cands_dict: dict
         Points that have no candidates.
     """
+    if index is None:
+        index = CandidateIndex.fromGraph(G, interp_dist)
 
-    G = G.copy()
-
-    # if interp_dist:
-    #     if G.graph["geometry"]:
-    #         G = distance.interpolate_graph(G, dist=interp_dist)
-    #     else:
-    #         _ = utils.graph_to_gdfs(G, nodes=False)
-    #         G = distance.interpolate_graph(G, dist=interp_dist)
-
-    _ = utils.graph_to_gdfs(G, nodes=False)
-    G = distance.interpolate_graph(G, dist=interp_dist)
-
-    geoms = utils.graph_to_gdfs(G, nodes=False).set_index(["u", "v"])[["osmid", "geometry"]]
-
-    uv_xy = [[u, osmid, np.deg2rad(xy)] for uv, geom, osmid in
-             zip(geoms.index, geoms.geometry.values, geoms.osmid.values)
-             for u, xy in zip(uv, geom.coords[:])]
-
-    index, osmid, xy = zip(*uv_xy)
-
-    nodes = pd.DataFrame(xy, index=osmid, columns=["x", "y"])[["y", "x"]]
-
-    ball = BallTree(nodes, metric='haversine')
-
-    idxs, dists = ball.query_radius(np.deg2rad(points), radius / distance.EARTH_RADIUS_M, return_distance=True)
-    dists = dists * distance.EARTH_RADIUS_M  # radians to meters
-
-    if closest:
-        results = dict()
-        for i, (point, idx, dist) in enumerate(zip(points, idxs, dists)):
-            df = pd.DataFrame({"osmid": list(np.array(index)[idx]),
-                               "edge_osmid": list(nodes.index[idx]),
-                               "coords": tuple(map(tuple, np.rad2deg(nodes.values[idx]))),
-                               "dist": dist})
-
-            df = df.loc[df.groupby('edge_osmid')['dist'].idxmin()].reset_index(drop=True)
-
-            results[i] = {"observation": point,
-                          "osmid": list(df["osmid"]),
-                          "edge_osmid": list(df["edge_osmid"]),
-                          "candidates": list(df["coords"]),
-                          "candidate_type": np.full(len(df["coords"]), False),
-                          "dists": list(df["dist"])}
+    pointIdx, candIdx, dists = index.query(points, radius=radius, closest=closest)
 
-    else:
-        results = {i: {"observation": point,
-                       "osmid": list(np.array(index)[idx]),
-                       "edge_osmid": list(nodes.index[idx]),
-                       "candidates": list(map(tuple, np.rad2deg(nodes.values[idx]))),
-                       "candidate_type": np.full(len(nodes.index[idx]), False),
-                       "dists": list(dist)} for i, (point, idx, dist) in enumerate(zip(points, idxs, dists))}
+    # split the flat candidates by point for the trellis
+    bounds = np.searchsorted(pointIdx, np.arange(len(points) + 1))
+    coords = np.rad2deg(index.xy[candIdx])
+    results = {i: {"observation": point,
+                   "osmid": list(index.node[candIdx[s:e]]),
+                   "edge_osmid": list(index.edge_osmid[candIdx[s:e]]),
+                   "candidates": list(map(tuple, coords[s:e])),
+                   "candidate_type": np.full(e - s, False),
+                   "dists": list(dists[s:e])} for i, (point, s, e) in enumerate(zip(points, bounds[:-1], bounds[1:]))}
 
     no_cands = [node_id for node_id, cand in results.items() if not cand["candidates"]]
     no_cands_dict = {point: results[point] for point in no_cands}
@@ -280,7 +226,7 @@ def get_candidates(G, points, interp_dist=30, closest=True, radius=30):
         for cand in no_cands:
             del results[cand]
         # print(f"A total of {len(no_cands)} points has no candidates: {*no_cands,}")
-    return G, results, no_cands_dict
+    return index.graph, results, no_cands_dict
 
 def elab_candidate_results(results, predecessor, no_cands_dict):
     """ 
@@ -14,7 +14,7 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from osgeo import gdal
-from preprocessing.geo import grade2traj
+from preprocessing.geo import grade2traj, DEMSampler
 
 
 def getDistByCoord(long1,lat1,long2,lat2):
@@ -36,20 +36,69 @@ def getDistByCoord(long1,lat1,long2,lat2):
         return s
     
 
-def getMileageByCoord(traj, lonCol='lon', latCol='lat'):
+def getDistByCoordArray(long1, lat1, long2, lat2):
+    """
+    Get distances (km) between two arrays of points (vectorized haversine).
+    use the same method in google map (WSG-84)
+    long1, lat1, long2, lat2: coordinates, array-like of the same length
+    return: float32 ndarray, NaN where any coordinate is missing
+    """
+    return _haversine(long1, lat1, long2, lat2).astype('float32')
+
+
+def _haversine(long1, lat1, long2, lat2):
+    """
+    Haversine kernel on whole coordinate arrays, float64 km.
+    """
+    long1, lat1, long2, lat2 = (np.asarray(x, dtype='float64') for x in (long1, lat1, long2, lat2))
+    earthRadius = 6378.137
+    radLat1 = np.radians(lat1)
+    radLat2 = np.radians(lat2)
+    a = np.radians(lat1 - lat2)
+    b = np.radians(long1 - long2)
+    h = np.sin(a/2)**2 + np.cos(radLat1) * np.cos(radLat2) * np.sin(b/2)**2
+    s = 2 * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+    return s * earthRadius
+
+
+def _segBoundary(traj:pd.DataFrame, segCol:str):
+    """
+    Mask of adjacent pairs (i, i+1) that belong to different segments, length n-1.
+    """
+    seg = traj[segCol].to_numpy()
+    return seg[1:] != seg[:-1]
+
+
+def getMileageByCoord(traj, lonCol='lon', latCol='lat', segCol=None):
     """
     Get traj mileage using coordination.
     lonCol: column name of longitude
     latCol: column name of latitude
+    segCol: column name of segments (trip ID or car ID), if given, return {segID: mileage}.
     """
-    m = 0
-    for i in range(traj.shape[0]-1):
-        long1 = traj[lonCol].iloc[i]
-        lat1 = traj[latCol].iloc[i]
-        long2 = traj[lonCol].iloc[i+1]
-        lat2 = traj[latCol].iloc[i+1]
-        m += getDistByCoord(long1, lat1, long2, lat2)  # km
-    return m
+    if segCol:
+        if traj.shape[0] == 0:
+            return {}
+        # group points of the same segment together, keep the point order inside segments
+        order = np.argsort(traj[segCol].to_numpy(), kind='stable')
+        traj = traj[[segCol, lonCol, latCol]].iloc[order]
+    
+    lon = traj[lonCol].to_numpy(dtype='float64')
+    lat = traj[latCol].to_numpy(dtype='float64')
+    
+    dist = np.zeros(len(lon))
+    dist[:-1] = _haversine(lon[:-1], lat[:-1], lon[1:], lat[1:])  # km
+
+    if not segCol:
+        return dist.sum()
+    
+    # per-segment reduction in a single pass
+    boundary = _segBoundary(traj, segCol)
+    dist[:-1][boundary] = 0
+    starts = np.concatenate([[0], np.flatnonzero(boundary) + 1])
+    ids = traj[segCol].to_numpy()[starts].tolist()
+    mileage = np.add.reduceat(dist, starts).tolist()
+    return dict(zip(ids, mileage))
 
 
 def calDistInterval(
@@ -57,7 +106,8 @@ def calDistInterval(
         lonCol='lon',
         latCol='lat',
         distColName='dist[km]',
-        calDirect='forward'
+        calDirect='forward',
+        segCol=None
 ):
     """
     Calculate adjacent distance between O-D coordinates in a row.
@@ -67,18 +117,23 @@ def calDistInterval(
     calDirect: calculate method
     'forward' means to calculate the distance with the later point,
     'backward' means to calculate the distance with the earlier point
+    segCol: column name of segments (trip ID or car ID), distance across segments is set to NaN.
     """
+    lon = traj[lonCol].to_numpy(dtype='float64')
+    lat = traj[latCol].to_numpy(dtype='float64')
+    dist = np.full(len(lon), np.nan, dtype='float32')
+
+    # distance between two point / km
     if calDirect == 'forward':
-        traj['lon_'] = traj[lonCol].shift(-1)
-        traj['lat_'] = traj[latCol].shift(-1)
+        dist[:-1] = getDistByCoordArray(lon[:-1], lat[:-1], lon[1:], lat[1:])
+        if segCol:
+            dist[:-1][_segBoundary(traj, segCol)] = np.nan
     else:
-        traj['lon_'] = traj[lonCol].shift(1)
-        traj['lat_'] = traj[latCol].shift(1)    
-    # distance between two point / km  
-    traj.loc[:, distColName] = traj.apply(lambda row: getDistByCoord(row[lonCol], row[latCol], row['lon_'], row['lat_']), axis=1)
-    traj.drop(['lon_', 'lat_'], axis=1, inplace=True)
+        dist[1:] = getDistByCoordArray(lon[1:], lat[1:], lon[:-1], lat[:-1])
+        if segCol:
+            dist[1:][_segBoundary(traj, segCol)] = np.nan
    
-    traj[distColName] = traj[distColName].astype('float32')
+    traj[distColName] = dist
 
     return traj
 
@@ -164,45 +219,64 @@ def calVSP(
     VSPColName: column name of the newly generated VSP
     """
     # VSP / kW/t
+    grade = traj[gradeCol].to_numpy() if gradeCol else None
+    traj[VSPColName] = _VSP(traj[speedCol].to_numpy(), traj[accCol].to_numpy(), grade, weight)
+    traj[VSPColName] = traj[VSPColName].astype('float32')
+
+    return traj
+
+
+def _VSP(speed, acc, grade=None, weight=1.497):
+    """
+    VSP kernel on whole arrays.
+    speed: speed in km/h
+    acc: acceleration in m/s2
+    grade: road grade, if None, calculate VSP with 0 grade
+    weight: weight of the vehicle in mass/ton
+    """
     A, B, C = 0.156461, 0.0020002, 0.000493
     g = 9.8  # m/s^2
-    
-    # traj.loc[:, 'v'] = traj[speedCol] / 3.6
-    # traj.loc[:, 'v2'] = traj['v'].apply(lambda x: x**2)
-    # traj.loc[:, 'v3'] = traj['v'] * traj['v2']
-    # traj.loc[:, 'av'] = traj['v'] * traj[accCol]
-    
-    # # VSP with 0 grade
-    # traj.loc[:, 'VSP0'] = traj.apply(lambda row: A/weight*row['v'] + B/weight*row['v2'] + C/weight*row['v3'] + row['av'], axis=1)
-    # traj.drop(['v2', 'v3', 'av'], axis=1, inplace=True)
-    
-    # VSP with 0 grade
-    traj.loc[:, 'VSP0'] = traj.apply(
-        lambda x: A / weight * (x[speedCol]/3.6)
-                + B / weight * ((x[speedCol]/3.6)**2)
-                + C / weight * ((x[speedCol]/3.6)**3)
-                + (x[speedCol]/3.6) * x[accCol],
-        axis=1
-    )
 
-    # # VSP with grade
-    # traj.loc[:, 'sin'] = traj[gradeCol].apply(np.sin)  # sin(theta)
-    # traj.loc[:, 'sin'] = traj['sin'] * traj['v'] * g   # g*sin(theta)*v
-    # traj.loc[:, VSPColName] = traj['VSP0'] + traj['sin']
-    
-    if gradeCol:
-        # VSP with grade
-        traj.loc[:, VSPColName] = traj.apply(
-            lambda x: x['VSP0'] + np.sin(x[gradeCol]) * (x[speedCol]/3.6) * g,
-            axis=1
-        )
-        traj.drop(['VSP0'], axis=1, inplace=True)
-    else:
-        traj.rename(columns={'VSP0': VSPColName}, inplace=True)
-    
-    traj[VSPColName] = traj[VSPColName].astype('float32')
+    v = speed / 3.6
+    VSP = v * ((A + (B + C * v) * v) / weight + acc)  # VSP with 0 grade
+    if grade is not None:
+        VSP += np.sin(grade) * v * g  # g*sin(theta)*v
+    return VSP
 
-    return traj
+
+def calKinematics(
+        interval,
+        dist,
+        grade=None,
+        weight=1.497,  # weight of LDV, mass/ton
+):
+    """
+    Calculate [forward] speed, acceleration and VSP in one pass.
+    interval: time interval [s], array-like
+    dist: distance interval [km], array-like
+    grade: road grade, array-like, if None, calculate VSP with 0 grade
+    weight: weight of the vehicle in mass/ton
+    return: speed [km/h], acc [m/s2], VSP [kW/t], float32 ndarrays
+    """
+    interval = np.ascontiguousarray(interval, dtype='float32')
+    dist = np.ascontiguousarray(dist, dtype='float32')
+
+    # speed [forward]
+    speed = dist / interval
+    speed *= 3600
+
+    # acceleration [forward]
+    acc = np.full_like(speed, np.nan)
+    np.subtract(speed[1:], speed[:-1], out=acc[:-1])
+    acc[:-1] /= interval[:-1]
+    acc /= 3.6
+
+    # VSP
+    if grade is not None:
+        grade = np.ascontiguousarray(grade, dtype='float32')
+    VSP = _VSP(speed, acc, grade, weight)
+
+    return speed, acc, VSP
 
 
 def calParamUnit(
@@ -222,6 +296,7 @@ def calParamUnit(
         gradeColName='grade[D]',
         VSPColName='VSP[kW/t]',
         calDirect='forward',
+        segCol=None,
 ):
     """
     Calculate basic parameter.
@@ -242,6 +317,7 @@ def calParamUnit(
     calDirect: calculate method
     'forward' means to calculate the interval with the later point,
     'backward' means to calculate the interval with the earlier point
+    segCol: column name of tripID, elevations are filled and smoothed per trip
     """
     # distance interval
     traj = calDistInterval(
@@ -259,35 +335,28 @@ def calParamUnit(
         calDirect=calDirect
     )
     
-    # speed
-    if speed:
-        traj = calSpeed(
-            traj,
-            intervalCol=intervalColName, distCol=distColName,
-            speedColName=speedColName
-        )
-    
-    # accelration
-    if acc:
-        traj = calAcc(
-            traj,
-            intervalCol=intervalColName, speedCol=speedColName,
-            accColName=accColName
-        )
-    
-    # VPS
+    # grade
     if VSP:
         traj = grade2traj(
             traj,
             dem, lonCol=lonCol, latCol=latCol, distCol=distColName,
-            gradeColName=gradeColName
+            gradeColName=gradeColName, segCol=segCol
         )
 
-        traj = calVSP(
-            traj,
-            weight=weight, speedCol=speedColName, accCol=accColName, gradeCol=gradeColName,
-            VSPColName=VSPColName
+    # speed, accelration and VSP in one pass
+    if speed or acc or VSP:
+        speed_, acc_, VSP_ = calKinematics(
+            traj[intervalColName].to_numpy(),
+            traj[distColName].to_numpy(),
+            traj[gradeColName].to_numpy() if VSP else None,
+            weight=weight
         )
+        if speed:
+            traj[speedColName] = speed_
+        if acc:
+            traj[accColName] = acc_
+        if VSP:
+            traj[VSPColName] = VSP_
     
     # delete nan
     traj.dropna(inplace=True, axis=0)    
@@ -310,20 +379,21 @@ def calParam(
     """
     Calculate basic parameter.
     traj: trajectory data
-    demPath: path of the DEM file
+    demPath: path of the DEM file, or of a .npy tile store built by NpyTileStore.build
     tripIDCol: column name of tripID
     sortBy: reference cols for sorting trajectory point.
     """
     # read dem
     if demPath:
         warnings.filterwarnings('ignore')
-        dem = gdal.Open(demPath)
+        dem = DEMSampler(demPath)
     else:
-        pass
+        dem = None
     # perform densification for each trip seperately
     print("Calculating...")
     if tripIDCol:  
 
+        kwargs['segCol'] = kwargs.get('segCol') or tripIDCol
         traj = calParamUnit(traj, dem=dem, **kwargs)
         
         # delete the last and the second last points in a trip 
@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from scipy.interpolate import interp1d
+import heapq
 from multiprocessing import Pool, cpu_count
 
 
@@ -31,49 +32,48 @@ def densifyUnit(
     - see scipy.interpolate.interp1d doc: <https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html#scipy.interpolate.interp1d>
     """
     # advoid duplication
-    traj.drop_duplicates(keep='first', inplace=True)
-    
-    # create cubic spline function
-    lon = traj[lonCol]
-    lat = traj[latCol]
-    time = traj[timeCol]
+    duplicated = traj.duplicated(keep='first').to_numpy()
+    if duplicated.any():
+        traj = traj[~duplicated]
+    time = traj[timeCol].to_numpy()
 
     if len(time) == 1:
-        return traj
-    elif len(time) > 3:
-        interpLon = interp1d(time, lon, interpFunc)
-        interpLat = interp1d(time, lat, interpFunc)
-    else:  # if only contain two points, use linear interpolation
-        interpLon = interp1d(time, lon, 'linear')
-        interpLat = interp1d(time, lat, 'linear')
-    
-    # number of points in the path
-    pathLen = int(traj.iloc[-1][timeCol] - traj.iloc[0][timeCol] + 1)
-    
-    # time sequence
-    time_ = np.array([traj.iloc[0][timeCol] + i for i in range(pathLen)])
-
-    # other columns
-    otherCol = traj.columns.to_list()
-    otherCol.remove(lonCol)
-    otherCol.remove(latCol)
-    otherCol.remove(timeCol)
+        return traj.copy()
 
-    # generate new traj
+    # time sequence
+    time_ = time[0] + np.arange(int(time[-1] - time[0] + 1))
+    
+    # other columns take the value of the first point
     trajDict = {
-        col: [traj.iloc[0][col]] * pathLen for col in otherCol
+        col: np.repeat(traj[col].to_numpy()[:1], len(time_))
+        for col in traj.columns if col not in (lonCol, latCol, timeCol)
     }
+
+    # generate new traj
+    lonlat = interpCoord(time, traj[[lonCol, latCol]].to_numpy(dtype='float64'), time_, interpFunc if len(time) > 3 else 'linear')
     trajDict[timeCol] = time_
-    trajDict[lonCol] = interpLon(time_)
-    trajDict[latCol] = interpLat(time_)
+    trajDict[lonCol] = lonlat[:, 0]
+    trajDict[latCol] = lonlat[:, 1]
 
     return pd.DataFrame(trajDict)
 
+def interpCoord(time, coord, time_, interpFunc='cubic'):
+    """
+    Interpolate coordinates at new time points in one call.
+    time: sorted time of the points, ndarray.
+    coord: coordinates of the points, (points x 2) ndarray.
+    time_: new time points within [time[0], time[-1]].
+    interpFunc: interpolation method of scipy.interpolate.interp1d.
+    """
+    return interp1d(time, coord, interpFunc, axis=0, assume_sorted=True)(time_)
+
 def densify(
         traj:pd.DataFrame,
         timeCol='time[s]',
         tripIDCol='tripID',
         sortBy=['vehID', 'tripID', 'time[s]'],
+        nWorkers=1,
+        chunksPerWorker=4,
         **kwargs
 ):
     """
@@ -81,22 +81,39 @@ def densify(
     timeCol: column name of time.
     tripIDCol: column name of tripID, if None, densify the traj as a whole trip.
     sortBy: reference cols for sorting trajectory point.
+    nWorkers: number of worker processes, 1 for densifying trips in this process, None for all CPUs.
+    chunksPerWorker: trips are split into nWorkers * chunksPerWorker chunks of balanced point counts.
     """
     length0 = traj.shape[0]
     # perform densification for each trip seperately
     if tripIDCol: 
 
-        trips = []
-        for id in tqdm(set(traj[tripIDCol].unique()), desc="Densifying"):
-            # select trip from traj.df
-            trip = traj[traj[tripIDCol] == id].copy()
-            trips.append(densifyUnit(trip, timeCol=timeCol, **kwargs))
-            
-        # concat
-        traj = pd.concat(trips)
+        # positions of each trip, without scanning the whole traj for every trip
+        trips = list(traj.groupby(tripIDCol, sort=False).indices.values())
+        nWorkers = nWorkers or cpu_count()
+
+        if nWorkers > 1 and len(trips) > 1:
+            chunks = [
+                traj.iloc[np.concatenate([trips[k] for k in chunk])]
+                for chunk in _balancedChunks([len(pos) for pos in trips], nWorkers * chunksPerWorker)
+            ]
+            parts = []
+            with Pool(nWorkers) as pool, tqdm(total=len(trips), desc="Densifying") as pbar:
+                for part, n in pool.imap(_densifyChunk, [(chunk, tripIDCol, dict(timeCol=timeCol, **kwargs)) for chunk in chunks]):
+                    parts.append(part)
+                    pbar.update(n)
+        else:
+            parts = [
+                densifyUnit(traj.iloc[pos], timeCol=timeCol, **kwargs)
+                for pos in tqdm(trips, desc="Densifying")
+            ]
+
+        # write trips into the preallocated output
+        traj = _concatParts(parts)
     
         # sort
-        traj = traj.sort_values(by=sortBy)
+        if sortBy:
+            traj = traj.sort_values(by=sortBy)
         traj.reset_index(inplace=True, drop=True)
     
     # perform densification for the whole traj.df
@@ -107,6 +124,46 @@ def densify(
     print("- densified length: %d;\n- densified ratio: %.2f%%." % (length1, length1/length0*100))
     return traj
 
+def _balancedChunks(sizes, nChunks):
+    """
+    Partition trips into chunks of balanced point counts, largest trips first.
+    sizes: number of points of each trip.
+    return: list of trip indices of each non-empty chunk.
+    """
+    heap = [(0, c) for c in range(min(nChunks, len(sizes)))]
+    chunks = [[] for _ in heap]
+    for k in np.argsort(sizes)[::-1]:
+        load, c = heapq.heappop(heap)
+        chunks[c].append(k)
+        heapq.heappush(heap, (load + sizes[k], c))
+    return [chunk for chunk in chunks if chunk]
+
+def _densifyChunk(args):
+    """
+    Densify the trips of a chunk in a worker process.
+    return: densified chunk and number of trips.
+    """
+    chunk, segCol, kwargs = args
+    trips = chunk.groupby(segCol, sort=False).indices.values()
+    return _concatParts([densifyUnit(chunk.iloc[pos], **kwargs) for pos in trips]), len(trips)
+
+def _concatParts(parts):
+    """
+    Concatenate densified trips column by column into preallocated arrays.
+    """
+    offsets = np.cumsum([0] + [len(part) for part in parts])
+    data = {}
+    for col in parts[0].columns:
+        if any(isinstance(part[col].dtype, pd.api.extensions.ExtensionDtype) for part in parts):
+            data[col] = pd.concat([part[col] for part in parts], ignore_index=True)
+            continue
+        values = [part[col].to_numpy() for part in parts]
+        out = np.empty(offsets[-1], dtype=np.result_type(*[v.dtype for v in values]))
+        for v, start, end in zip(values, offsets[:-1], offsets[1:]):
+            out[start:end] = v
+        data[col] = out
+    return pd.DataFrame(data)
+
 # def densify(
 #         traj:pd.DataFrame,
 #         timeCol='time[s]',
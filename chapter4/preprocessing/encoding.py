@@ -19,6 +19,7 @@ def encode(
         encodingCol=['vehID', 'orderID'],
         sortBy=['vehID', 'orderID', 'time[s]'],
         originCRS='GCJ02',
+        precise=False,
 ):
     """
     Encoding data.
@@ -27,6 +28,7 @@ def encode(
     encodingCol: columns need encoding
     sortBy: columns to sort by, list
     originCRS: coordinate reference system of raw data
+    precise: True to invert GCJ02 iteratively for sub-millimeter accuracy, the error is about 1e-5 degree otherwise.
     """
     print("Encoding...")
 
@@ -43,11 +45,9 @@ def encode(
     if originCRS == 'WGS84':
         pass
     elif originCRS == 'GCJ02':
-        df['lon'] = df.apply(lambda row: np.float64(gcj02_to_wgs84(row['lon'], row['lat'])[0]), axis=1)
-        df['lat'] = df.apply(lambda row: np.float64(gcj02_to_wgs84(row['lon'], row['lat'])[1]), axis=1)
+        df['lon'], df['lat'] = gcj02_to_wgs84(df['lon'].to_numpy(), df['lat'].to_numpy(), precise)
     elif originCRS == 'BD09':
-        df['lon'] = df.apply(lambda row: np.float64(bd09_to_wgs84(row['lon'], row['lat'])[0]), axis=1)
-        df['lat'] = df.apply(lambda row: np.float64(bd09_to_wgs84(row['lon'], row['lat'])[1]), axis=1)
+        df['lon'], df['lat'] = bd09_to_wgs84(df['lon'].to_numpy(), df['lat'].to_numpy(), precise)
     else:
         raise KeyError("Tranferring from %s to WGS84 is not available." % originCRS)
     
@@ -184,6 +184,7 @@ class Preprocess():
         """
         Densify the trajectory of trips by interpolation.
         traj: trajectory DataFrame.
+        Trips are densified in parallel if `nWorkers` > 1 in densifyParam, see densification.densify.
         """
         if self.__densified__:
             raise Warning("The trajectory had already been densified. Re-densification could raise potential error.")
@@ -13,77 +13,182 @@ This module includes three smoothing methods for trajectory and indices:
 
 
 import numpy as np
-from tqdm import tqdm
+import pandas as pd
+from scipy.signal import lfilter, ss2tf
 
 
-def KalmanSmooth(indices:list, Q=0.01, R=0.01):
+def KalmanSmooth(indices:list, Q=0.01, R=0.01, seg=None, tol=1e-12):
     """
     Smooth the indices using Kalman Filter 1D.
+    Q: process variance
+    R: measure variance
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
+    tol: relative tolerance for the gain to reach the steady state.
+    The gain does not depend on the data: it is the same for every segment and converges to the closed-form
+    steady-state gain, after which the filter is exponential smoothing.
     """
-    n = len(indices)
-    size = (n,)
+    z = np.asarray(indices, dtype='float64')
+    n = len(z)
+    if n == 0:
+        return z.copy()
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
 
     # parameters
-    Q = Q  # process variance
-    R = R  # measure variance
-    
-    # initialize arrays
-    xhat_ = np.zeros(size)  # a priori estimate of x
-    xhat = np.zeros(size)  # a posteriori estimate of x
-    P_ = np.zeros(size)  # a priori error estimate
-    P = np.zeros(size)  # a posteriori error estimate
-    K = np.zeros(size)  # gain factor
-
-    xhat[0] = indices[0]
-    P[0] = 1
-
-    for k in range(1, n):
-        # time update
-        xhat_[k] = xhat[k-1]
-        P_[k] = P[k-1] + Q
-
-        # measurement update
-        K[k] = P_[k] / (P_[k] + R)
-        xhat[k] = xhat_[k] + K[k] * (indices[k] - xhat_[k])
-        P[k] = (1 - K[k]) * P_[k]
+    # steady-state a priori error estimate and gain
+    P_ = (Q + np.sqrt(Q * Q + 4 * Q * R)) / 2
+    K_ = P_ / (P_ + R)
+
+    xhat = z.copy()  # a posteriori estimate of x, the first point of each segment is kept
+    P = 1  # a posteriori error estimate
+
+    # transient gains, one step for all segments at a time
+    m = 1
+    while m < lengths.max():
+        K = (P + Q) / (P + Q + R)
+        if abs(K - K_) <= tol * K_:
+            break
+        P = (1 - K) * (P + Q)
+        k = starts[lengths > m] + m
+        xhat[k] = xhat[k-1] + K * (z[k] - xhat[k-1])
+        m += 1
+
+    # steady state from position m-1 of each segment on
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    tail = np.flatnonzero((rel >= m - 1) & np.repeat(lengths > m, lengths))
+    if len(tail):
+        tailStarts = np.flatnonzero(rel[tail] == m - 1)
+        xhat[tail] = _expFilter(z[tail], 1 - K_, tailStarts, xhat[tail[tailStarts]])
 
     return xhat
 
-def expSmooth(indices:list, alpha=0.3):
+def expSmooth(indices:list, alpha=0.3, seg=None):
     """
     Smooth the indices using exponential smoothing.
     alpha: smoothing parameter
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
     """
-    result = [indices[0]]
-    n = len(indices)
-    index = list(range(1, n))
-    for i in set(index):
-        result.append(alpha * result[i-1] + (1 - alpha) * indices[i])
-    
-    return result
+    x = np.asarray(indices, dtype='float64')
+    if len(x) == 0:
+        return x.copy()
+    starts = _segStarts(len(x), seg)
+    return _expFilter(x, alpha, starts, x[starts])
 
-def doubleExpSmooth(indices:list, alpha=0.3, beta=0.1):
+def doubleExpSmooth(indices:list, alpha=0.3, beta=0.1, seg=None):
     """
     Smooth the indices using double exponential smoothing.
     alpha: level smoothing parameter
     beta: trend smoothing parameter
+    seg: segment labels of the indices, contiguous segments (trips) are smoothed separately. If None, smooth as one segment.
     """
-    # initialize the result
-    result = [indices[0]]
-    n = len(indices)
-    index = list(range(1, n))
-    for i in set(index):
-        if i == 1:
-            level, trend = indices[0], indices[1] - indices[0]
-            value = indices[0]
-        else:
-            value = indices[i]
-        level_, level = level, alpha * value + (1 - alpha) * (level + trend)
-        trend = beta * (level - level_) + (1 - beta) * trend
-        result.append(level + trend)
+    x = np.asarray(indices, dtype='float64')
+    result = x.copy()  # the first point of each segment is kept
+    n = len(x)
+    if n == 0:
+        return result
+    starts = _segStarts(n, seg)
+    lengths = np.diff(np.r_[starts, n])
+
+    # inputs from the second point of each segment, the first input is the first point
+    rel = np.arange(n) - np.repeat(starts, lengths)
+    idx = np.flatnonzero(rel >= 1)
+    if len(idx) == 0:
+        return result
+    value = x[idx]
+    valueStarts = np.flatnonzero(rel[idx] == 1)
+    first = starts[lengths >= 2]
+    value[valueStarts] = x[first]
+
+    # initial level and trend
+    state = np.column_stack([x[first], x[first + 1] - x[first]])
+    result[idx] = _holtFilter(value, alpha, beta, valueStarts, state)
     
     return result
 
+def _segStarts(n, seg=None):
+    """
+    Start positions of contiguous segments.
+    seg: segment labels, if None, one segment.
+    """
+    if seg is None:
+        return np.array([0])
+    seg = np.asarray(seg)
+    return np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+
+def _segOrder(seg):
+    """
+    Positions of rows grouped by segment in order of appearance, rows without a segment are left out.
+    seg: segment labels, e.g., tripID.
+    return: positions and segment codes of them.
+    """
+    codes, _ = pd.factorize(seg)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    return order, codes[order]
+
+def _expFilter(x, alpha, starts, init):
+    """
+    y[i] = alpha * y[i-1] + (1 - alpha) * x[i] with y = init at segment starts, one lfilter pass for all segments.
+    The state carried over a segment start decays as alpha ** (m + 1) at position m and is subtracted.
+    """
+    u = (1 - alpha) * x
+    u[starts] = init
+    if len(starts) > 1 and not np.isfinite(u).all():  # NaN would leak into later segments
+        return np.concatenate([lfilter([1.0], [1.0, -alpha], part) for part in np.split(u, starts[1:])])
+
+    y = lfilter([1.0], [1.0, -alpha], u)
+    if len(starts) > 1:
+        lengths = np.diff(np.r_[starts, len(x)])
+        carry = np.r_[0.0, y[starts[1:] - 1]]
+        m = np.arange(len(x)) - np.repeat(starts, lengths)
+        y -= np.repeat(carry, lengths) * alpha ** (m + 1)
+    return y
+
+def _holtFilter(value, alpha, beta, starts, state):
+    """
+    Level + trend of Holt's linear method, restarting from the (level, trend) state at segment starts.
+    The level and trend are linear filters of the inputs, the response to the difference between the
+    initial state and the state carried over a segment start is added.
+    """
+    if len(starts) > 1 and not np.isfinite(value).all():  # NaN would leak into later segments
+        return np.concatenate([
+            _holtFilter(part, alpha, beta, np.array([0]), state[k:k+1])
+            for k, part in enumerate(np.split(value, starts[1:]))
+        ])
+
+    # state transition s[k] = A s[k-1] + B value[k]
+    A = np.array([[1 - alpha, 1 - alpha], [-alpha * beta, 1 - alpha * beta]])
+    B = np.array([alpha, alpha * beta])
+    level, trend = [lfilter(*_transferFunc(A, B, row), value) for row in range(2)]
+
+    # response of level + trend to the state difference d at position m: [1, 1] A^(m+1) d
+    lengths = np.diff(np.r_[starts, len(value)])
+    carry = np.zeros_like(state)
+    carry[1:] = np.column_stack([level, trend])[starts[1:] - 1]
+    m = np.arange(len(value)) - np.repeat(starts, lengths)
+    response = _stateResponse(A, lengths.max())[m]
+    return level + trend + np.sum(np.repeat(state - carry, lengths, axis=0) * response, axis=1)
+
+def _transferFunc(A, B, row):
+    """
+    Transfer function of a state component of s[k] = A s[k-1] + B u[k].
+    """
+    num, den = ss2tf(A, B[:, np.newaxis], A[row:row+1], B[row:row+1, np.newaxis])
+    return num[0], den
+
+def _stateResponse(A, n):
+    """
+    [1, 1] A^(m+1) e_j for m in range(n), (n x 2) ndarray, by the characteristic recurrence of A.
+    """
+    first, second = np.ones(2) @ A, np.ones(2) @ A @ A
+    trace, det = np.trace(A), np.linalg.det(A)
+    impulse = np.zeros(n)
+    impulse[0] = 1
+    return np.column_stack([
+        lfilter([first[j], second[j] - trace * first[j]], [1, -trace, det], impulse)
+        for j in range(2)
+    ])
+
 
 SMOOTH_DICT = {
     'exp': expSmooth,
@@ -116,17 +221,17 @@ def smooth(
     _traj = traj.copy()
 
     if tripIDCol:
-        for id in tqdm(set(traj[tripIDCol].unique()), desc="Smoothing"):  
-            # select trip from traj.df
-            trip = traj[traj[tripIDCol] == id].copy()
-
-            for col in smoothCol:
-                _traj.loc[trip.index, col] = smooth_func(trip[col].to_list(), **params)
+        # all trips in one call, rows of a trip are made contiguous
+        order, seg = _segOrder(traj[tripIDCol])
+        for col in smoothCol:
+            values = traj[col].to_numpy(dtype='float64')
+            values[order] = smooth_func(values[order], seg=seg, **params)
+            _traj[col] = values
     
         return _traj
     
     else:
         for col in smoothCol:
-            _traj.loc[:, col] = smooth_func(traj[col].to_list(), **params)
+            _traj.loc[:, col] = smooth_func(traj[col].to_numpy(dtype='float64'), **params)
         
         return _traj
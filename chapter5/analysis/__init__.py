@@ -1,2 +1,3 @@
-from .calculation import getDecelBinCount, getOpModeCount, getBinCount
+from .calculation import getDecelBinCount, getOpModeCount, getBinCount, getGroupCode
+from .calculation import groupCount, groupEventNum, groupSum, groupMean, groupStd
 from .aggregation import Aggregator
\ No newline at end of file
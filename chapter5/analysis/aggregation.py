@@ -7,15 +7,15 @@
 @Desc    :   Spatio-temporal aggregation methods.
 '''
 
-import warnings
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
 import geopandas as gpd
-from shapely import Point
+from sklearn.neighbors import BallTree
 
-from analysis.calculation import getDecelBinCount, getBinCount, getOpModeCount
+from analysis.calculation import getDecelBinCount, getBinCount, getOpModeCount, getGroupCode
+from analysis.calculation import groupCount, groupEventNum, groupSum, groupMean, groupStd
+from analysis.calculation import getSegOffsets, searchsortedGrouped
 
 
 PI = 3.1415926535897932384626  # π
@@ -90,34 +90,25 @@ class Aggregator():
         """
         Multi-level spatio-temporal aggregation.
         traj: trajectory file to aggregate, DataFrame.
-        refCol: reference column for aggregation, 'hour', 'day', or 'weekday' etc. If None, aggregate all time periods.
+        refCol: reference column for aggregation, 'hour', 'day', or 'weekday' etc., or a list of columns for composite keys, e.g., ['date', 'hour'].
         OpModeCol: column name of OpMode, if None, don't aggregate for each OpMode.
         """
-        # generate index
-        ref_list = sorted(traj[refCol].dropna().unique())
-        
-        # define agg file
-        df_agg = pd.DataFrame(
-            columns=['trajCount', 'brakeCount', 'brakeEventNum', 'mileage', 'speedBinCount', 'accBinCount', 'brakeDecelBinCount', 'VSPBinCount', 'OpModeCount'],
-            index=ref_list
-        )
-        df_agg.loc[:,:] = 0
-
-        # start aggregating
-        for id in tqdm(set(ref_list), desc="Agg Pairs"):
-            df = traj[
-                (traj[refCol] == id)
-            ].copy()
-
-            df_agg.loc[id]['trajCount'] = df.shape[0]
-            df_agg.loc[id]['brakeCount'] = df[df[brakeCol]==True].shape[0]
-            df_agg.loc[id]['brakeEventNum'] = df[brakeCol].diff().value_counts(normalize=False)[True] // 2
-            df_agg.loc[id]['mileage'] = df[distCol].sum()
-            df_agg.loc[id]['speedBinCount'] = getBinCount(df, binCol=speedCol, bins=self.SPEED_BIN)
-            df_agg.loc[id]['accBinCount'] = getBinCount(df, binCol=accCol, bins=self.ACC_BIN)
-            df_agg.loc[id]['brakeDecelBinCount'] = getDecelBinCount(df[df[brakeCol]==True], accCol=accCol)
-            df_agg.loc[id]['VSPBinCount'] = getBinCount(df, binCol=VSPCol, bins=self.VSP_BIN)
-            df_agg.loc[id]['OpModeCount'] = getOpModeCount(df, OpModeCol)
+        group, ref_list = getGroupCode(traj, refCol)
+        nGroup = len(ref_list)
+        brake = traj[brakeCol].to_numpy() == True
+
+        # all groups are counted in one pass
+        df_agg = pd.DataFrame(index=ref_list)
+        df_agg['trajCount'] = groupCount(np.zeros(len(traj), dtype='int64'), 1, group, nGroup)[:, 0]
+        df_agg['brakeCount'] = groupCount(np.where(brake, 0, -1), 1, group, nGroup)[:, 0]
+        df_agg['brakeEventNum'] = groupEventNum(brake, group, nGroup)
+        df_agg['mileage'] = groupSum(traj[distCol], group, nGroup)
+        df_agg['speedBinCount'] = list(getBinCount(traj, speedCol, self.SPEED_BIN, group, nGroup))
+        df_agg['accBinCount'] = list(getBinCount(traj, accCol, self.ACC_BIN, group, nGroup))
+        df_agg['brakeDecelBinCount'] = list(getDecelBinCount(traj, accCol, np.where(brake, group, -1), nGroup))
+        df_agg['VSPBinCount'] = list(getBinCount(traj, VSPCol, self.VSP_BIN, group, nGroup))
+        if OpModeCol is not None:
+            df_agg['OpModeCount'] = list(getOpModeCount(traj, OpModeCol, group, nGroup))
 
         return df_agg
 
@@ -134,37 +125,25 @@ class Aggregator():
     ):
         """
         for simplify aggregation.
+        refCol: reference column for aggregation, or a list of columns for composite keys.
         """
-        # generate index
-        ref_list = sorted(traj[refCol].dropna().unique())
-        
-        # define agg file
-        df_agg = pd.DataFrame(
-            columns=['trajCount', 'brakeCount', 'brakeEventNum', 'mileage', 'speedMean', 'accMean', 'VSPMean', 'brakeDecelMean', 'OpModeCount'],
-            index=ref_list
-        )
-        df_agg.loc[:,:] = 0
-
-        # start aggregating
-        for id in tqdm(set(ref_list), desc="Agg Pairs"):
-            df = traj[
-                (traj[refCol] == id)
-            ].copy()
+        group, ref_list = getGroupCode(traj, refCol)
+        nGroup = len(ref_list)
+        brake = traj[brakeCol].to_numpy() == True
 
-            df_agg.loc[id]['trajCount'] = df.shape[0]
-            df_agg.loc[id]['brakeCount'] = df[df[brakeCol]==True].shape[0]
-            try:
-                df_agg.loc[id]['brakeEventNum'] = df[brakeCol].diff().value_counts(normalize=False)[True] // 2
-            except:
-                pass
-            df_agg.loc[id]['mileage'] = df[distCol].sum()
+        # all groups are counted in one pass
+        df_agg = pd.DataFrame(index=ref_list)
+        df_agg['trajCount'] = groupCount(np.zeros(len(traj), dtype='int64'), 1, group, nGroup)[:, 0]
+        df_agg['brakeCount'] = groupCount(np.where(brake, 0, -1), 1, group, nGroup)[:, 0]
+        df_agg['brakeEventNum'] = groupEventNum(brake, group, nGroup)
+        df_agg['mileage'] = groupSum(traj[distCol], group, nGroup)
 
-            df_agg.loc[id]['speedMean'] = df[speedCol].mean()
-            df_agg.loc[id]['accMean'] = df[accCol].mean()
-            df_agg.loc[id]['VSPMean'] = df[VSPCol].mean()
-            df_agg.loc[id]['brakeDecelMean'] = df[df[brakeCol]==True][accCol].mean()
+        df_agg['speedMean'] = groupMean(traj[speedCol], group, nGroup)
+        df_agg['accMean'] = groupMean(traj[accCol], group, nGroup)
+        df_agg['VSPMean'] = groupMean(traj[VSPCol], group, nGroup)
+        df_agg['brakeDecelMean'] = groupMean(traj[accCol], np.where(brake, group, -1), nGroup)
 
-            df_agg.loc[id]['OpModeCount'] = getOpModeCount(df, OpModeCol)
+        df_agg['OpModeCount'] = list(getOpModeCount(traj, OpModeCol, group, nGroup))
 
         return df_agg
 
@@ -188,112 +167,67 @@ class Aggregator():
         for trip-level aggregation.
         maxDuration: the maximum duration of a trip segment [s]
         maxMileage: the maximum mileage of a trip segment [km]
+        return: one row per trip segment, ordered by trip. Trips no longer than maxMileage are skipped, 
+            a segment ends at the first point reaching the next multiple of maxMileage (shared with the next segment).
         """
-        # generate index
-        ref_list = sorted(traj[tripIDCol].dropna().unique())
-        
-        # define agg dict
+        # sort once by trip, rows keep their order within each trip
+        trip, _ = getGroupCode(traj, tripIDCol)
+        order = np.argsort(trip, kind='stable')
+        order = order[trip[order] >= 0]
+        trip = trip[order]
+        dist = np.nan_to_num(traj[distCol].to_numpy(dtype='float64')[order])
+        start, end = getSegOffsets(trip)
+
+        # cumulative mileage within each trip
+        cumDist = pd.Series(dist).groupby(trip).cumsum().to_numpy()
+        total = cumDist[end - 1]
+        cut = np.flatnonzero(total > maxMileage)
+        segNum = (total[cut] // maxMileage).astype('int64')
+
+        # first point reaching each multiple of maxMileage, found with a merged searchsorted
+        segTrip = np.repeat(cut, segNum + 1)
+        threshold = maxMileage * (np.arange(len(segTrip)) - np.repeat(np.cumsum(segNum + 1) - segNum - 1, segNum + 1))
+        pos = searchsortedGrouped(trip, cumDist, segTrip, threshold)
+
+        # segments [pos_i, pos_i+1], expanded into contiguous row slices
+        last = np.cumsum(segNum + 1) - 1
+        segStart = np.delete(pos, last)
+        segEnd = np.delete(pos, last - segNum) + 1
+        nSeg = len(segStart)
+        length = segEnd - segStart
+        group = np.repeat(np.arange(nSeg), length)
+        rows = order[np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length) + np.repeat(segStart, length)]
+
+        brake = traj[brakeCol].to_numpy()[rows] == True
+        acc = traj[accCol].to_numpy(dtype='float64')[rows]
+        speed = traj[speedCol].to_numpy(dtype='float64')[rows]
+        status = np.r_[False, (brake[1:] != brake[:-1]) & (group[1:] == group[:-1])]  # braking status change
+        OpModeCount = getOpModeCount(traj[OpModeCol].array[rows], group=group, nGroup=nSeg)
+        first = order[segStart]
+
         dict_agg = {
-            'vehID':[],
-            'startHour':[],
-            'trajCount':[],
-            'brakeCount':[],
-            'idlingCount':[],
-            'brakeEventNum':[],
-            'mileage':[],
-            'speed_mean':[],
-            'speed_std':[],
-            'acc_mean':[],
-            'acc_std':[],
-            'decel_mean':[],
-            'decel_std':[],
-            'VSP_mean':[],
-            'VSP_std':[],
-            'initSpeed_mean':[],
-            'brakeDecel_mean':[],
-            'brakeDecel_std':[],
-            'grade_mean':[],
-            'grade_std':[],
-            'OpModeCount':[]
+            'vehID': traj[vehIDCol].to_numpy()[first],
+            'startHour': traj[hourCol].to_numpy()[first],
+            'trajCount': length,
+            'brakeCount': groupCount(np.where(brake, 0, -1), 1, group, nSeg)[:, 0],
+            'idlingCount': OpModeCount[:, self.OPMODEID_LIST.index(1)],
+            'brakeEventNum': groupCount(np.where(status, 0, -1), 1, group, nSeg)[:, 0] // 2,
+            'mileage': groupSum(traj[distCol].to_numpy(dtype='float64')[rows], group, nSeg),
+            'speed_mean': groupMean(speed, group, nSeg),
+            'speed_std': groupStd(speed, group, nSeg),
+            'acc_mean': groupMean(acc, group, nSeg),
+            'acc_std': groupStd(acc, group, nSeg),
+            'decel_mean': np.abs(groupMean(acc, np.where(acc < 0, group, -1), nSeg)),
+            'decel_std': groupStd(acc, np.where(acc < 0, group, -1), nSeg),
+            'VSP_mean': groupMean(traj[VSPCol].to_numpy(dtype='float64')[rows], group, nSeg),
+            'VSP_std': groupStd(traj[VSPCol].to_numpy(dtype='float64')[rows], group, nSeg),
+            'initSpeed_mean': groupMean(speed, np.where(brake & status, group, -1), nSeg),
+            'brakeDecel_mean': np.abs(groupMean(acc, np.where(brake, group, -1), nSeg)),
+            'brakeDecel_std': groupStd(acc, np.where(brake, group, -1), nSeg),
+            'grade_mean': groupMean(traj[gradeCol].to_numpy(dtype='float64')[rows], group, nSeg),
+            'grade_std': groupStd(traj[gradeCol].to_numpy(dtype='float64')[rows], group, nSeg),
+            'OpModeCount': list(OpModeCount),
         }
-        warnings.filterwarnings("ignore")
-
-        # start aggregating
-        for id in tqdm(set(ref_list), desc="Agg Pairs"):
-            df = traj[
-                (traj[tripIDCol] == id)
-            ].copy()
-
-            if df[distCol].sum() <= maxMileage:
-                pass
-                # dict_agg['vehID'].append(df.iloc[0][vehIDCol])
-                # dict_agg['startHour'].append(df.iloc[0][hourCol])
-                # dict_agg['trajCount'].append(df.shape[0])
-                # dict_agg['brakeCount'].append(df[df[brakeCol]==True].shape[0])
-                # dict_agg['idlingCount'].append(df[df[OpModeCol]==1].shape[0])
-                # dict_agg['brakeEventNum'].append(df[brakeCol].diff().value_counts(normalize=False)[True] // 2)
-                # dict_agg['mileage'].append(df[distCol].sum())
-
-                # dict_agg['speed_mean'].append(df[speedCol].mean())
-                # dict_agg['acc_mean'].append(df[accCol].mean())
-                # dict_agg['decel_mean'].append(df[df[accCol] < 0][accCol].mean())
-                # dict_agg['VSP_mean'].append(df[VSPCol].mean())
-                # dict_agg['brakeDecel_mean'].append(df[df[brakeCol]==True][accCol].mean())
-                # dict_agg['grade_mean'].append(df[gradeCol].mean())
-
-                # # calculate braking status change
-                # df['status'] = df[brakeCol].diff()
-                # dict_agg['initSpeed_mean'].append(df[(df[brakeCol]==True) & (df['status']==True)][speedCol].mean())
-                
-                # dict_agg['speed_std'].append(df[speedCol].std())
-                # dict_agg['acc_std'].append(df[accCol].std())
-                # dict_agg['decel_std'].append(df[df[accCol] < 0][accCol].std())
-                # dict_agg['VSP_std'].append(df[VSPCol].std())
-                # dict_agg['brakeDecel_std'].append(df[df[brakeCol]==True][accCol].std())
-                # dict_agg['grade_std'].append(df[gradeCol].std())
-
-                # dict_agg['OpModeCount'].append(getOpModeCount(df, OpModeCol))
-            else:
-                # calculate cummulative distance
-                df['dist_cum'] = df[distCol].cumsum()
-                cumMileage = df['dist_cum'].iloc[-1]
-                
-                # re-segment
-                segID = np.array([df[df['dist_cum'] >= maxM].index[0] for maxM in maxMileage * np.arange(0, cumMileage//maxMileage+1)])
-                # segID = np.append(segID, df.index[-1]+1)
-
-                for id0, id1 in zip(segID[:-1], segID[1:]):
-                    df_ = df.loc[id0:id1].copy()
-                    dict_agg['vehID'].append(df_.iloc[0][vehIDCol])
-                    dict_agg['startHour'].append(df_.iloc[0][hourCol])
-                    dict_agg['trajCount'].append(df_.shape[0])
-                    dict_agg['brakeCount'].append(df_[df_[brakeCol]==True].shape[0])
-                    dict_agg['idlingCount'].append(df_[df_[OpModeCol]==1].shape[0])
-                    try:
-                        dict_agg['brakeEventNum'].append(df_[brakeCol].diff().value_counts(normalize=False)[True] // 2)
-                    except:
-                        dict_agg['brakeEventNum'].append(0)
-                    dict_agg['mileage'].append(df_[distCol].sum())
-
-                    dict_agg['speed_mean'].append(df_[speedCol].mean())
-                    dict_agg['acc_mean'].append(df_[accCol].mean())
-                    dict_agg['decel_mean'].append(np.abs(df_[df_[accCol] < 0][accCol].mean()))
-                    dict_agg['VSP_mean'].append(df_[VSPCol].mean())
-                    dict_agg['brakeDecel_mean'].append(np.abs(df_[df_[brakeCol]==True][accCol].mean()))
-                    dict_agg['grade_mean'].append(df_[gradeCol].mean())
-
-                    # calculate braking status change
-                    df_['status'] = df_[brakeCol].diff()
-                    dict_agg['initSpeed_mean'].append(df_[(df_[brakeCol]==True) & (df_['status']==True)][speedCol].mean())
-                
-                    dict_agg['speed_std'].append(df_[speedCol].std())
-                    dict_agg['acc_std'].append(df_[accCol].std())
-                    dict_agg['decel_std'].append(np.abs(df_[df_[accCol] < 0][accCol].std()))
-                    dict_agg['VSP_std'].append(df_[VSPCol].std())
-                    dict_agg['brakeDecel_std'].append(np.abs(df_[df_[brakeCol]==True][accCol].std()))
-                    dict_agg['grade_std'].append(df_[gradeCol].std())
-
-                    dict_agg['OpModeCount'].append(getOpModeCount(df_, OpModeCol))
         
         df_agg = pd.DataFrame(dict_agg)
         df_agg.fillna(0, inplace=True)
@@ -320,46 +254,55 @@ class Aggregator():
         """
         traj: trajectory data, DataFrame
         nodes: nodes data of the roadnet, GeoDataFrame
-        dist: enlarge distance of the intersection area
+        dist: enlarge distance of the intersection area [m], a point within dist of several nodes is counted for each of them.
         """
-        warnings.filterwarnings("ignore")
-
-        # intial geodataframe for traj
-        traj['geometry'] = traj.apply(lambda x: Point(x[lon], x[lat]), axis=1)
-        traj_gdf = gpd.GeoDataFrame(traj, geometry='geometry')
-        
-        # define agg file
+        # node-point membership, all nodes are queried in one batch
         osmid = sorted(nodes['osmid'].dropna().unique())
-        agg_node = pd.DataFrame(
-            columns=['trajCount', 'brakeCount', 'brakeEventNum', 'mileage', 'speedMean', 'accMean', 'VSPMean', 'brakeDecelMean', 'OpModeCount'],
-            index=osmid
+        pointIdx, nodeIdx = getNodeMembership(
+            traj[lon].to_numpy(), traj[lat].to_numpy(),
+            nodes.geometry.x.to_numpy(), nodes.geometry.y.to_numpy(), dist
         )
-        agg_node.loc[:,:] = 0
-        
-        # clip
-        for i in tqdm(set(nodes.index), desc="Agg nodes"):
-
-            # filter points in buffer
-            df = traj_gdf.clip(mask=nodes.loc[i].geometry.buffer(dist / EARTH_RADIUS_M * 180 / PI)).copy()
-            id = nodes.loc[i, 'osmid']
-
-            if df.shape[0] == 0:
-                pass
-            else:
-                agg_node.loc[id]['trajCount'] = df.shape[0]
-                agg_node.loc[id]['brakeCount'] = df[df[brakeCol]==True].shape[0]
-                try:
-                    agg_node.loc[id]['brakeEventNum'] = df[brakeCol].diff().value_counts(normalize=False)[True] // 2
-                except:
-                    pass
-                agg_node.loc[id]['mileage'] = df[distCol].sum()
-
-                agg_node.loc[id]['speedMean'] = df[speedCol].mean()
-                agg_node.loc[id]['accMean'] = df[accCol].mean()
-                agg_node.loc[id]['VSPMean'] = df[VSPCol].mean()
-                agg_node.loc[id]['brakeDecelMean'] = df[df[brakeCol]==True][accCol].mean()
-
-                agg_node.loc[id]['OpModeCount'] = getOpModeCount(df, OpModeCol)
+        group = pd.Index(osmid).get_indexer(nodes['osmid'].to_numpy()[nodeIdx])
+        nGroup = len(osmid)
+
+        # pairs ordered by node, then by row
+        order = np.lexsort((pointIdx, group))
+        pointIdx, group = pointIdx[order], group[order]
+        brake = traj[brakeCol].to_numpy()[pointIdx] == True
+
+        agg_node = pd.DataFrame(index=osmid)
+        agg_node['trajCount'] = groupCount(np.zeros(len(group), dtype='int64'), 1, group, nGroup)[:, 0]
+        agg_node['brakeCount'] = groupCount(np.where(brake, 0, -1), 1, group, nGroup)[:, 0]
+        agg_node['brakeEventNum'] = groupEventNum(brake, group, nGroup)
+        agg_node['mileage'] = groupSum(traj[distCol].to_numpy()[pointIdx], group, nGroup)
+
+        agg_node['speedMean'] = groupMean(traj[speedCol].to_numpy()[pointIdx], group, nGroup)
+        agg_node['accMean'] = groupMean(traj[accCol].to_numpy()[pointIdx], group, nGroup)
+        agg_node['VSPMean'] = groupMean(traj[VSPCol].to_numpy()[pointIdx], group, nGroup)
+        agg_node['brakeDecelMean'] = groupMean(traj[accCol].to_numpy()[pointIdx], np.where(brake, group, -1), nGroup)
+
+        agg_node['OpModeCount'] = list(getOpModeCount(traj[OpModeCol].array[pointIdx], group=group, nGroup=nGroup))
 
         return agg_node
-            
\ No newline at end of file
+
+
+def getNodeMembership(lon, lat, nodeLon, nodeLat, dist):
+    """
+    Find all (point, node) pairs within dist, a point can belong to multiple nodes.
+    lon, lat: coordinates of points, ndarray.
+    nodeLon, nodeLat: coordinates of nodes, ndarray.
+    dist: search radius [m].
+    return: point indices and node indices of the pairs, ndarray.
+    """
+    points = np.deg2rad(np.column_stack([lat, lon]).astype('float64'))
+    valid = np.flatnonzero(~np.isnan(points).any(axis=1))
+    if len(valid) == 0 or len(nodeLon) == 0:
+        return np.array([], dtype='int64'), np.array([], dtype='int64')
+
+    # the tree is built on points once and queried with all nodes
+    ball = BallTree(points[valid], metric='haversine')
+    idxs = ball.query_radius(np.deg2rad(np.column_stack([nodeLat, nodeLon]).astype('float64')), dist / EARTH_RADIUS_M)
+
+    nodeIdx = np.repeat(np.arange(len(idxs)), [len(idx) for idx in idxs])
+    pointIdx = valid[np.concatenate(idxs).astype('int64')]
+    return pointIdx, nodeIdx
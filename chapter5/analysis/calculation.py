@@ -9,36 +9,247 @@
 
 
 import numpy as np
+import pandas as pd
 
 
-def getDecelBinCount(traj, accCol):
+OPMODEID_LIST = np.array([0,1,11,12,13,14,15,16,21,22,23,24,25,27,28,29,30,33,35,37,38,39,40])
+_OPMODE_CODE = np.full(OPMODEID_LIST.max() + 1, -1, dtype='int64')  # OpMode ID -> position in OPMODEID_LIST
+_OPMODE_CODE[OPMODEID_LIST] = np.arange(len(OPMODEID_LIST))
+DECEL_BIN_INTERVAL = 0.1
+DECEL_BIN = np.round(np.arange(DECEL_BIN_INTERVAL, 4.6, DECEL_BIN_INTERVAL), 10)  # rounded, edges do not overlap
+
+
+def getGroupCode(traj, refCol):
+    """
+    Encode (composite) keys into integer group codes.
+    traj: trajectory data, DataFrame
+    refCol: column name, or a list of column names for composite keys, e.g., ['date', 'hour', 'highway'].
+    return: group code of each row (-1 for rows with missing keys), and the sorted keys, Index or MultiIndex.
+    """
+    keys = [refCol] if isinstance(refCol, str) else list(refCol)
+    codes, levels = [], []
+    for key in keys:
+        code, uniques = pd.factorize(traj[key], sort=True)
+        codes.append(code)
+        levels.append(uniques)
+    valid = np.logical_and.reduce([code >= 0 for code in codes])
+
+    # keep the observed combinations only
+    flat = np.ravel_multi_index([code[valid] for code in codes], [max(len(level), 1) for level in levels])
+    observed, inverse = np.unique(flat, return_inverse=True)
+    group = np.full(len(traj), -1, dtype='int64')
+    group[valid] = inverse
+
+    levelCodes = np.unravel_index(observed, [max(len(level), 1) for level in levels])
+    if len(keys) == 1:
+        index = pd.Index(levels[0].take(levelCodes[0]), name=keys[0])
+    else:
+        index = pd.MultiIndex.from_arrays([level.take(code) for level, code in zip(levels, levelCodes)], names=keys)
+    return group, index
+
+
+def groupCount(code, nBin, group=None, nGroup=1, weights=None):
+    """
+    Scatter-add into a (groups, bins) matrix, rows with code or group < 0 are skipped.
+    code: bin code of each row.
+    nBin: number of bins.
+    group: group code of each row, if None, one group.
+    nGroup: number of groups.
+    weights: weight of each row, if None, count rows.
+    """
+    if group is None:
+        group = np.zeros(len(code), dtype='int64')
+    group = np.asarray(group)
+    valid = (code >= 0) & (group >= 0)
+    if weights is not None:
+        weights = np.asarray(weights, dtype='float64')[valid]
+    count = np.bincount(group[valid] * nBin + code[valid], weights=weights, minlength=nGroup * nBin)
+    return count.reshape(nGroup, nBin)
+
+
+def groupEventNum(brake, group, nGroup):
+    """
+    Number of braking events in each group, i.e., status changes of consecutive rows in the group // 2.
+    """
+    order = np.argsort(group, kind='stable')
+    brake, group = brake[order], group[order]
+    change = (brake[1:] != brake[:-1]) & (group[1:] == group[:-1]) & (group[1:] >= 0)
+    return groupCount(np.zeros(change.sum(), dtype='int64'), 1, group[1:][change], nGroup)[:, 0] // 2
+
+
+def groupSum(values, group, nGroup):
+    """
+    Sum of values in each group, NaN skipped.
+    """
+    values = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(values)
+    return groupCount(np.where(valid, 0, -1), 1, group, nGroup, weights=values)[:, 0]
+
+
+def groupMean(values, group, nGroup):
+    """
+    Mean of values in each group, NaN skipped.
+    """
+    values = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(values)
+    count = groupCount(np.where(valid, 0, -1), 1, group, nGroup)[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return groupSum(values, group, nGroup) / count
+
+
+def groupStd(values, group, nGroup):
+    """
+    Sample standard deviation (ddof=1) of values in each group, NaN skipped.
+    """
+    values = np.asarray(values, dtype='float64')
+    group = np.where(np.isnan(values), -1, group)
+    mean = groupMean(values, group, nGroup)
+    valid = group >= 0
+    count = groupCount(np.where(valid, 0, -1), 1, group, nGroup)[:, 0]
+    dev = np.where(valid, values - mean[np.where(valid, group, 0)], 0) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 1, groupSum(dev, group, nGroup) / (count - 1), np.nan) ** 0.5
+
+
+def _binCode(values, lower, upper, right=False):
+    """
+    Bin code of each value, -1 for values out of bins.
+    lower, upper: ascending lower and upper edges of bins.
+    right: if True, bins are (lower, upper], else [lower, upper).
+    """
+    values = np.asarray(values, dtype='float64')
+    code = np.searchsorted(lower, values, side='left' if right else 'right') - 1
+    inBin = code >= 0
+    code[~inBin] = 0
+    inBin &= (values <= upper[code]) if right else (values < upper[code])
+    return np.where(inBin, code, -1)
+
+
+def _decelBinCode(acc):
+    """
+    Deceleration bin code of each acc, i.e., -bin < acc <= -bin + interval for bins in DECEL_BIN.
+    """
+    lower = -DECEL_BIN[::-1]
+    code = _binCode(acc, lower, np.round(lower + DECEL_BIN_INTERVAL, 10), right=True)
+    return np.where(code >= 0, len(DECEL_BIN) - 1 - code, -1)
+
+
+def _OpModeCode(OpMode):
+    """
+    Position of each OpMode in OPMODEID_LIST, -1 for NA or unknown IDs.
+    """
+    if isinstance(OpMode, pd.Series):
+        OpMode = OpMode.array
+    if isinstance(OpMode, pd.api.extensions.ExtensionArray):
+        OpMode = OpMode.to_numpy(dtype='float64', na_value=np.nan)
+    OpMode = np.asarray(OpMode, dtype='float64')
+    valid = (OpMode >= 0) & (OpMode < len(_OPMODE_CODE))
+    code = np.full(len(OpMode), -1, dtype='int64')
+    code[valid] = _OPMODE_CODE[OpMode[valid].astype('int64')]
+    return code
+
+
+def _values(traj, col):
+    """
+    Values of a column if traj is a DataFrame, else traj itself.
+    """
+    return traj[col].to_numpy() if isinstance(traj, pd.DataFrame) else traj
+
+
+def _output(count, group):
+    """
+    (groups, bins) matrix if group codes are given, else counts of bins.
+    """
+    return count if group is not None else count[0]
+
+
+def getDecelBinCount(traj, accCol=None, group=None, nGroup=None):
     """
     Obtain counts for each brake deceleration bin.
+    traj: trajectory data, DataFrame, or acc values, ndarray.
+    accCol: column name of acc, required for DataFrame.
+    group: group code of each row (-1 to skip), if None, count all rows.
+    nGroup: number of groups, default max(group) + 1.
+    return: counts of bins, or (groups, bins) matrix if group is given.
     """
-    interval = 0.1
-    bins = np.arange(interval, 4.6, interval)
-    count_list = [traj[(traj[accCol] > -bin) & (traj[accCol] <= -bin+interval)].shape[0] for bin in bins]
-    return np.array(count_list)
+    if group is not None and nGroup is None:
+        nGroup = int(np.max(group, initial=-1)) + 1
+    count = groupCount(_decelBinCode(_values(traj, accCol)), len(DECEL_BIN), group, nGroup or 1)
+    return _output(count, group)
+
 
-def getBinCount(traj, binCol, bins):
+def getBinCount(traj, binCol=None, bins=None, group=None, nGroup=None):
     """
-    Get counts for each deceleration bin.
-    traj: trajectory data, DataFrame
-    min_decel: the minimum deceleration (abs).
-    max_decel: the maximum deceleration (abs).
-    interval: interval of bins
+    Get counts for each bin, [minV, maxV), bins can be ascending or descending.
+    traj: trajectory data, DataFrame, or values, ndarray.
+    binCol: column name of values, required for DataFrame.
+    bins: edges of bins.
+    group: group code of each row (-1 to skip), if None, count all rows.
+    nGroup: number of groups, default max(group) + 1.
+    return: counts of bins, or (groups, bins) matrix if group is given.
     """
+    if group is not None and nGroup is None:
+        nGroup = int(np.max(group, initial=-1)) + 1
+    bins = np.asarray(bins, dtype='float64')
+    descending = bins[0] > bins[-1]  # e.g., BRAKE_DECEL_BIN_MPH, counted between consecutive edges
+    edges = bins[::-1] if descending else bins
+    count = groupCount(_binCode(_values(traj, binCol), edges[:-1], edges[1:]), len(bins) - 1, group, nGroup or 1)
+    if descending:
+        count = count[:, ::-1]
+    return _output(count, group)
 
-    # count
-    count = [traj[(traj[binCol] >= minV) & (traj[binCol] < maxV)].shape[0] for minV, maxV in zip(bins[:-1], bins[1:])]
-    
-    return np.array(count)
 
-def getOpModeCount(traj, OpModeCol):
+def getOpModeCount(traj, OpModeCol=None, group=None, nGroup=None):
+    """
+    Get counts for each OpMode in OPMODEID_LIST.
+    traj: trajectory data, DataFrame, or OpMode IDs, ndarray.
+    OpModeCol: column name of OpMode, required for DataFrame.
+    group: group code of each row (-1 to skip), if None, count all rows.
+    nGroup: number of groups, default max(group) + 1.
+    return: counts of OpModes, or (groups, OpModes) matrix if group is given.
     """
-    
+    if group is not None and nGroup is None:
+        nGroup = int(np.max(group, initial=-1)) + 1
+    OpMode = traj[OpModeCol] if isinstance(traj, pd.DataFrame) else traj
+    count = groupCount(_OpModeCode(OpMode), len(OPMODEID_LIST), group, nGroup or 1)
+    return _output(count, group)
+
+
+def getSegOffsets(seg):
     """
-    OpModeID_list = [0,1,11,12,13,14,15,16,21,22,23,24,25,27,28,29,30,33,35,37,38,39,40]
-    value_counts = traj[OpModeCol].value_counts()
-    count_list = [value_counts.loc[i] if (i in value_counts.index) else 0 for i in OpModeID_list]
-    return np.array(count_list)
\ No newline at end of file
+    Row offsets of contiguous segments.
+    seg: segment code of each row, sorted.
+    return: start and end (exclusive) positions of each segment.
+    """
+    seg = np.asarray(seg)
+    start = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]]) if len(seg) else np.array([], dtype='int64')
+    end = np.r_[start[1:], len(seg)].astype('int64')
+    return start, end
+
+
+def searchsortedGrouped(seg, values, querySeg, queryValues):
+    """
+    np.searchsorted(side='left') within each segment, all queries in one pass.
+    seg: segment code of each row, sorted.
+    values: values of each row, ascending within each segment.
+    querySeg, queryValues: segment and value of each query.
+    return: position of the first row in the segment with value >= query value, len(seg) if none.
+    """
+    nRow = len(seg)
+    segs = np.r_[np.asarray(seg), np.asarray(querySeg)]
+    keys = np.r_[np.asarray(values, dtype='float64'), np.asarray(queryValues, dtype='float64')]
+    isRow = np.r_[np.ones(nRow, dtype='int8'), np.zeros(len(querySeg), dtype='int8')]
+
+    # queries are placed before rows with equal values
+    merged = np.lexsort((isRow, keys, segs))
+    rowsBefore = np.cumsum(isRow[merged]) - isRow[merged]
+    pos = np.empty(len(querySeg), dtype='int64')
+    pos[merged[~isRow[merged].astype(bool)] - nRow] = rowsBefore[~isRow[merged].astype(bool)]
+
+    # queries beyond the last row of their segment
+    _, end = getSegOffsets(seg)
+    segEnd = np.zeros(int(np.max(seg, initial=-1)) + 1, dtype='int64')
+    segEnd[np.asarray(seg)[end - 1]] = end
+    beyond = pos >= segEnd[np.asarray(querySeg)]
+    pos[beyond] = nRow
+    return pos
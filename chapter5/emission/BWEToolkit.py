@@ -27,7 +27,6 @@ class BWETool():
         }
         self.ER = ERCalculator()
         
-    #TODO: braking detect method for different vehicle types
     def brakingDetect(
             self, 
             traj:pd.DataFrame,
@@ -35,16 +34,19 @@ class BWETool():
             accCol="acc[m/s2]",
             brakeColName="braking",
             method="PERE",
-            # vehType=None
+            vehCol=None,
+            curves=None,
     ):
         """
         Determine whether braking event is happening according to braking detect models.
         f: trajectory DataFrame.
         speedCol: column name of speed.
         accCol: column name of acceleration.
+        vehCol: column name of vehicle class or weight (kg) to choose per-vehicle curves.
+        curves: registry of coast down curves {vehicle class or weight: (A, B, C)}, default COAST_DOWN_CURVES.
         """
         model = self.__BRAKE_DETECT_METHODS[method]
-        return model(traj, speedCol, accCol, brakeColName)
+        return model(traj, speedCol, accCol, brakeColName, vehCol, curves)
     
     def OpModeDetect(
             self,
@@ -53,7 +55,9 @@ class BWETool():
             speedCol='speed[km/h]',
             accCol='acc[m/s2]',
             VSPCol='VSP[kW/t]',
-            OpModeColName="OpModeID"
+            OpModeColName="OpModeID",
+            segCol=None,
+            prevTraj=None,
     ):
         """
         Detect Operating Mode for each traj point.
@@ -62,8 +66,10 @@ class BWETool():
         speedCol: column name of speed.
         accCol: column name of acc.
         VSPCol: column name of VSP.
+        segCol: column name of trip ID, the t-1/t-2 lags are not carried across trips.
+        prevTraj: the previous chunk, for chunked input.
         """
-        return OpModeDetect(traj, gradeCol, speedCol, accCol, VSPCol, OpModeColName)
+        return OpModeDetect(traj, gradeCol, speedCol, accCol, VSPCol, OpModeColName, segCol, prevTraj)
     
     # TODO: intergrate ER calcualtion
     # def ERCal(
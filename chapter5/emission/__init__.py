@@ -1,3 +1,3 @@
 from .BWEToolkit import BWETool
 from .emissionRate import ERCalculator
-from .braking import coastDownDec
\ No newline at end of file
+from .braking import coastDownDec, registerCoastDownCurve, COAST_DOWN_CURVES
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of chapter2 are imported from the chapter directory, e.g., `from trajtool.smoothing import expSmooth`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'chapter2'))
@@ -0,0 +1,84 @@
+'''
+Equivalence checks of the vectorized calculation functions against the row-wise implementations they replace.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for name in ['osgeo', 'matplotlib', 'contextily', 'transbigdata', 'shapely']:
+    pytest.importorskip(name)  # imported by trajtool
+
+from trajtool.calculation import getDistByCoord, getMileageByCoord, calDistInterval
+from trajtool.calculation import calSpeed, calAcc, calVSP, calKinematics
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 200
+    traj = pd.DataFrame({
+        'tripID': np.repeat([3, 1, 2, 5], n // 4),
+        'lon': 116.3 + np.cumsum(rng.normal(0, 1e-4, n)),
+        'lat': 39.9 + np.cumsum(rng.normal(0, 1e-4, n)),
+    })
+    traj.loc[17, 'lon'] = np.nan
+    return traj
+
+
+@pytest.mark.parametrize('calDirect, shift', [('forward', -1), ('backward', 1)])
+def test_calDistInterval(traj, calDirect, shift):
+    lon_, lat_ = traj['lon'].shift(shift), traj['lat'].shift(shift)
+    expected = [getDistByCoord(*row) for row in zip(traj['lon'], traj['lat'], lon_, lat_)]
+
+    result = calDistInterval(traj, calDirect=calDirect)['dist[m]']
+    np.testing.assert_allclose(result, np.float32(expected), rtol=1e-6, equal_nan=True)
+
+
+def test_getMileageByCoord(traj):
+    traj = traj.dropna()
+    lon, lat = traj['lon'].to_numpy(), traj['lat'].to_numpy()
+    expected = sum(getDistByCoord(lon[i], lat[i], lon[i+1], lat[i+1]) for i in range(len(traj) - 1))
+    assert getMileageByCoord(traj) == pytest.approx(expected, rel=1e-9)
+
+    mileage = getMileageByCoord(traj, segCol='tripID')
+    assert list(mileage) == [1, 2, 3, 5]
+    for id, m in mileage.items():
+        assert m == pytest.approx(getMileageByCoord(traj[traj['tripID'] == id]), rel=1e-9)
+
+
+def _rowVSP(traj, weight=1.497, gradeCol='grade[D]'):
+    A, B, C = 0.156461, 0.0020002, 0.000493
+    v = traj['speed[km/h]'] / 3.6
+    VSP = traj.apply(lambda x: A / weight * (x['speed[km/h]']/3.6)
+                     + B / weight * ((x['speed[km/h]']/3.6)**2)
+                     + C / weight * ((x['speed[km/h]']/3.6)**3)
+                     + (x['speed[km/h]']/3.6) * x['acc[m/s2]'], axis=1)
+    if gradeCol:
+        VSP = VSP + np.sin(traj[gradeCol]) * v * 9.8
+    return VSP.astype('float32')
+
+
+@pytest.fixture
+def kinematics():
+    rng = np.random.default_rng(1)
+    n = 100
+    return pd.DataFrame({
+        'interval[s]': rng.choice([1.0, 2.0, 3.0], n).astype('float32'),
+        'dist[m]': rng.uniform(0, 30, n).astype('float32'),
+        'grade[D]': rng.normal(0, 0.02, n),
+    })
+
+
+@pytest.mark.parametrize('gradeCol', ['grade[D]', None])
+def test_calVSP(kinematics, gradeCol):
+    traj = calAcc(calSpeed(kinematics))
+    np.testing.assert_allclose(calVSP(traj, gradeCol=gradeCol)['VSP[kW/t]'], _rowVSP(traj, gradeCol=gradeCol), rtol=1e-5, atol=1e-5)
+
+
+def test_calKinematics(kinematics):
+    traj = calVSP(calAcc(calSpeed(kinematics)))
+    speed, acc, VSP = calKinematics(kinematics['interval[s]'], kinematics['dist[m]'], kinematics['grade[D]'])
+    np.testing.assert_allclose(speed, traj['speed[km/h]'], rtol=1e-6)
+    np.testing.assert_allclose(acc, traj['acc[m/s2]'], rtol=1e-5, atol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(VSP, traj['VSP[kW/t]'], rtol=1e-5, atol=1e-5, equal_nan=True)
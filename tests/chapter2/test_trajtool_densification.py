@@ -0,0 +1,80 @@
+'''
+Checks of trip densification, i.e., parallel chunks against sequential trips.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.interpolate import interp1d
+
+for name in ['osgeo', 'matplotlib', 'contextily', 'transbigdata', 'shapely']:
+    pytest.importorskip(name)  # imported by trajtool
+
+from trajtool.densification import densify
+
+ARGS = ('lon', 'lat', 'time[s]', 'tripID', ['vehID', 'tripID', 'time[s]'])
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(1)
+    trips = []
+    for trip in range(40):
+        n = rng.integers(1, 60)
+        time = np.sort(rng.choice(np.arange(n * 5), n, replace=False)).astype(float)
+        trips.append(pd.DataFrame({
+            'vehID': trip % 7,
+            'tripID': trip,
+            'time[s]': time,
+            'lon': 116.3 + np.cumsum(rng.normal(0, 1e-4, n)),
+            'lat': 39.9 + np.cumsum(rng.normal(0, 1e-4, n)),
+            'speed[km/h]': rng.uniform(0, 60, n),
+        }))
+    traj = pd.concat(trips).sample(frac=1, random_state=0).reset_index(drop=True)  # trips interleaved
+    return pd.concat([traj, traj.iloc[:5]], ignore_index=True)  # duplicated points
+
+
+@pytest.mark.parametrize('nWorkers', [3, None])
+def test_densifyParallel(traj, nWorkers):
+    traj = traj.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True)
+    expected = densify(traj, *ARGS, nWorkers=1)
+    pd.testing.assert_frame_equal(densify(traj, *ARGS, nWorkers=nWorkers, chunksPerWorker=2), expected)
+
+
+def _densifyUnit(traj, lonCol, latCol, timeCol, interpFunc='cubic'):
+    """
+    the merge-and-interpolate densification replaced by the time arrays of densifyUnit.
+    """
+    traj = traj.drop_duplicates(keep='first')
+    lon, lat, time = traj[lonCol], traj[latCol], traj[timeCol]
+    if len(time) == 1:
+        return traj
+    interpFunc = interpFunc if len(time) > 3 else 'linear'
+    pathLen = int(traj.iloc[-1][timeCol] - traj.iloc[0][timeCol] + 1)
+    time_ = np.array([traj.iloc[0][timeCol] + i for i in range(pathLen)])
+    trajDict = {timeCol: time_, lonCol: interp1d(time, lon, interpFunc)(time_), latCol: interp1d(time, lat, interpFunc)(time_)}
+    traj = pd.merge(pd.DataFrame(trajDict), traj.drop(columns=[lonCol, latCol]), how='left', on=timeCol)
+    return traj.interpolate(method='linear')
+
+
+@pytest.mark.parametrize('interpFunc', ['cubic', 'linear'])
+def test_densifyUnit(traj, interpFunc):
+    traj = traj.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True)
+    traj.loc[traj['time[s]'] % 7 == 0, 'speed[km/h]'] = np.nan
+    result = densify(traj, *ARGS, interpFunc=interpFunc)
+
+    expected = pd.concat([_densifyUnit(trip, *ARGS[:3], interpFunc=interpFunc) for _, trip in traj.groupby('tripID')])
+    expected = expected.sort_values(ARGS[4], ignore_index=True)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+
+def test_densifyObject(traj):
+    traj = traj.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True).drop_duplicates(ignore_index=True)
+    traj['road'] = 'r' + traj.index.astype(str)
+    result = densify(traj, *ARGS)
+
+    # non-numeric columns take the value of the last original point
+    for id, trip in traj.groupby('tripID'):
+        part = result[result['tripID'] == id]
+        last = np.searchsorted(trip['time[s]'].to_numpy(), part['time[s]'].to_numpy(), side='right') - 1
+        assert (part['road'].to_numpy() == trip['road'].to_numpy()[last]).all()
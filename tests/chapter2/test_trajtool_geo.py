@@ -0,0 +1,101 @@
+'''
+Equivalence checks of the vectorized coordinate transforms against the scalar implementations they replace.
+'''
+
+import math
+
+import numpy as np
+import pytest
+
+for name in ['osgeo', 'matplotlib', 'contextily', 'transbigdata', 'shapely']:
+    pytest.importorskip(name)  # imported by trajtool
+
+from trajtool.geo import gcj02_to_bd09, bd09_to_gcj02, wgs84_to_gcj02, gcj02_to_wgs84, bd09_to_wgs84, wgs84_to_bd09, out_of_china, PI, x_PI, a, ee
+
+
+def _outOfChina(lng, lat):
+    return not (lng > 73.66 and lng < 135.05 and lat > 3.86 and lat < 53.55)
+
+
+def _transformlat(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + 0.1 * lng * lat + 0.2 * math.sqrt(math.fabs(lng))
+    ret += (20.0 * math.sin(6.0 * lng * PI) + 20.0 * math.sin(2.0 * lng * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(lat * PI) + 40.0 * math.sin(lat / 3.0 * PI)) * 2.0 / 3.0
+    ret += (160.0 * math.sin(lat / 12.0 * PI) + 320 * math.sin(lat * PI / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _transformlng(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + 0.1 * lng * lat + 0.1 * math.sqrt(math.fabs(lng))
+    ret += (20.0 * math.sin(6.0 * lng * PI) + 20.0 * math.sin(2.0 * lng * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(lng * PI) + 40.0 * math.sin(lng / 3.0 * PI)) * 2.0 / 3.0
+    ret += (150.0 * math.sin(lng / 12.0 * PI) + 300.0 * math.sin(lng / 30.0 * PI)) * 2.0 / 3.0
+    return ret
+
+
+def _offset(lng, lat):
+    if _outOfChina(lng, lat):
+        return 0.0, 0.0
+    dlat = _transformlat(lng - 105.0, lat - 35.0)
+    dlng = _transformlng(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * PI
+    magic = 1 - ee * math.sin(radlat) ** 2
+    sqrtmagic = math.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * PI)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * math.cos(radlat) * PI)
+    return dlng, dlat
+
+
+def _gcj02_to_bd09(lng, lat):
+    z = math.sqrt(lng * lng + lat * lat) + 0.00002 * math.sin(lat * x_PI)
+    theta = math.atan2(lat, lng) + 0.000003 * math.cos(lng * x_PI)
+    return [z * math.cos(theta) + 0.0065, z * math.sin(theta) + 0.006]
+
+
+def _bd09_to_gcj02(bd_lon, bd_lat):
+    x, y = bd_lon - 0.0065, bd_lat - 0.006
+    z = math.sqrt(x * x + y * y) - 0.00002 * math.sin(y * x_PI)
+    theta = math.atan2(y, x) - 0.000003 * math.cos(x * x_PI)
+    return [z * math.cos(theta), z * math.sin(theta)]
+
+
+def _awayFromBorder(lng, lat, margin=0.1):
+    corners = [out_of_china(lng + dx, lat + dy) for dx in (-margin, margin) for dy in (-margin, margin)]
+    return np.all(corners, axis=0) | ~np.any(corners, axis=0)
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    lng, lat = rng.uniform(60, 150, 50000), rng.uniform(-5, 60, 50000)  # inside and outside China, more than one block
+    lng[:3], lat[:3] = [73.66, 116.3, 135.05], [39.9, 3.86, 53.55]  # on the border
+    return lng, lat
+
+
+def test_outOfChina(points):
+    lng, lat = points
+    np.testing.assert_array_equal(out_of_china(lng, lat), [_outOfChina(*p) for p in zip(lng, lat)])
+    assert out_of_china(116.3, 39.9) == False and not out_of_china(116.3, 39.9)
+    assert out_of_china(0.0, 0.0) == True
+
+
+def test_wgs84_gcj02(points):
+    lng, lat = points
+    expected = np.array([_offset(*p) for p in zip(lng, lat)])
+
+    gcj = np.array(wgs84_to_gcj02(lng, lat)).T
+    np.testing.assert_allclose(gcj, np.column_stack([lng, lat]) + expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(gcj02_to_wgs84(lng, lat), (np.column_stack([lng, lat]) - expected).T, rtol=0, atol=1e-12)
+    assert wgs84_to_gcj02(116.3, 39.9) == pytest.approx([116.3 + _offset(116.3, 39.9)[0], 39.9 + _offset(116.3, 39.9)[1]], abs=1e-12)
+
+    # the iterative inverse returns to WGS84, except next to the border where the offset is switched on or off
+    away = _awayFromBorder(lng, lat)
+    np.testing.assert_allclose(np.array(gcj02_to_wgs84(*gcj.T, precise=True))[:, away], [lng[away], lat[away]], rtol=0, atol=1e-8)
+
+
+def test_bd09(points):
+    lng, lat = points
+    np.testing.assert_allclose(np.array(gcj02_to_bd09(lng, lat)).T, [_gcj02_to_bd09(*p) for p in zip(lng, lat)], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(np.array(bd09_to_gcj02(lng, lat)).T, [_bd09_to_gcj02(*p) for p in zip(lng, lat)], rtol=0, atol=1e-12)
+    away = _awayFromBorder(lng, lat)
+    np.testing.assert_allclose(np.array(bd09_to_wgs84(*wgs84_to_bd09(lng, lat), precise=True))[:, away], [lng[away], lat[away]], rtol=0, atol=1e-5)
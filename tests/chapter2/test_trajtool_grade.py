@@ -0,0 +1,196 @@
+'''
+Checks of the road grade against elevations filled and smoothed trip by trip,
+and of the tiled DEM sampling against the per-point lookup it replaces.
+'''
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for name in ['osgeo', 'matplotlib', 'contextily', 'transbigdata', 'shapely']:
+    pytest.importorskip(name)  # imported by trajtool
+
+from trajtool.grade import calGrade, DEMSampler, _fillNearest, TiledRaster, NpyTileStore
+import trajtool.grade as grade
+from trajtool.smoothing import expSmooth
+
+
+def _fillNearestLoop(values, seg):
+    # scan each trip for the closest valid value, the earlier one on ties
+    values, seg = list(values), list(seg)
+    result = list(values)
+    for i, v in enumerate(values):
+        if not np.isnan(v):
+            continue
+        for d in range(1, len(values)):
+            near = [j for j in (i - d, i + d) if 0 <= j < len(values) and seg[j] == seg[i] and not np.isnan(values[j])]
+            if near:
+                result[i] = values[near[0]]
+                break
+    return np.array(result)
+
+
+class _NaNSampler(DEMSampler):
+    # elevations with NaN gaps, standing in for points out of the raster
+    def __init__(self, ele):
+        self.ele = ele
+
+    def sample(self, lon, lat):
+        return self.ele.copy()
+
+
+def _traj():
+    rng = np.random.default_rng(7)
+    n = 60
+    ele = 50 + np.cumsum(rng.normal(0, 1, n))
+    ele[[0, 1, 7, 8, 9, 25, 30, 31, 59]] = np.nan
+    ele[40:50] = np.nan  # a trip out of the DEM
+    traj = pd.DataFrame({
+        'tripID': np.repeat([1, 2, 3, 4], [20, 20, 10, 10]),
+        'lon': np.linspace(116, 116.1, n),
+        'lat': np.linspace(39, 39.1, n),
+        'dist': rng.uniform(5, 20, n),
+    })
+    return traj, ele
+
+
+def test_fillNearest():
+    traj, ele = _traj()
+    expected = _fillNearestLoop(ele, traj['tripID'])
+    np.testing.assert_array_equal(_fillNearest(ele, traj['tripID'].to_numpy()), expected)
+    assert np.isnan(expected[40:50]).all() and not np.isnan(np.delete(expected, range(40, 50))).any()
+    np.testing.assert_array_equal(_fillNearest(ele), _fillNearestLoop(ele, np.zeros(len(ele))))
+    assert len(_fillNearest([])) == 0
+
+
+def test_calGrade():
+    traj, ele = _traj()
+    result = calGrade(traj, 'lon', 'lat', 'dist', fromDEM=True, dem=_NaNSampler(ele), segCol='tripID')
+
+    # elevations of each trip filled and smoothed on their own
+    smoothed = np.concatenate([
+        expSmooth(_fillNearestLoop(trip, np.zeros(len(trip))), alpha=0.7)
+        for trip in np.split(ele, [20, 40, 50])
+    ])
+    expected = np.arctan(pd.Series(smoothed).diff(-1) / traj['dist'])
+    np.testing.assert_allclose(result['grade[D]'], expected.astype('float32'), rtol=1e-6)
+    assert np.isfinite(result['grade[D]'].to_numpy()[:39]).all()  # the gaps do not spread along the trips
+
+    # altitude column takes the same path
+    traj['alt'] = ele
+    np.testing.assert_array_equal(calGrade(traj, 'lon', 'lat', 'dist', eleCol='alt', segCol='tripID')['grade[D]'], result['grade[D]'])
+
+
+class _Band():
+    # numpy stand-in of a gdal raster band, counting the window reads
+    def __init__(self, pixels, nodata=None):
+        self.pixels, self.nodata = pixels, nodata
+        self.YSize, self.XSize = pixels.shape
+        self.reads = 0
+
+    def GetNoDataValue(self):
+        return self.nodata
+
+    def ReadAsArray(self, xoff=0, yoff=0, w=None, h=None):
+        self.reads += 1
+        w = self.XSize if w is None else w
+        h = self.YSize if h is None else h
+        return self.pixels[yoff:yoff + h, xoff:xoff + w].copy()
+
+
+class _Dataset():
+    # north-up raster of 30 m pixels
+    def __init__(self, pixels, nodata=None):
+        self.band = _Band(pixels, nodata)
+
+    def GetRasterBand(self, i):
+        return self.band
+
+    def GetProjection(self):
+        return 'stand-in'
+
+    def GetGeoTransform(self):
+        return (0.0, 30.0, 0.0, self.band.YSize * 30.0, 0.0, -30.0)
+
+
+class _Transformation():
+    # stand-in projection of lat, lon to meters
+    def __init__(self, src, dst):
+        pass
+
+    def TransformPoint(self, lat, lon):
+        return (lon - 116) * 1e5, (lat - 39) * 1e5, 0.0
+
+    def TransformPoints(self, points):
+        return [self.TransformPoint(lat, lon) for lat, lon in points]
+
+
+class _SpatialReference():
+    def ImportFromWkt(self, wkt):
+        pass
+
+    def CloneGeogCS(self):
+        return self
+
+
+@pytest.fixture
+def dem(monkeypatch):
+    monkeypatch.setattr(grade, 'osr', SimpleNamespace(SpatialReference=_SpatialReference, CoordinateTransformation=_Transformation))
+    rng = np.random.default_rng(3)
+    pixels = rng.uniform(0, 500, (250, 310)).astype('float32')
+    pixels[100:110, 200:220] = -9999
+    return _Dataset(pixels, nodata=-9999.0)
+
+
+def test_tiledRaster(dem):
+    pixels, band = dem.band.pixels, dem.band
+    rng = np.random.default_rng(5)
+    row, col = rng.integers(0, 250, 1000), rng.integers(0, 310, 1000)
+    raster = TiledRaster(band, tileSize=64, maxTiles=4)
+    np.testing.assert_array_equal(raster.gather(row, col), pixels[row, col])
+    assert len(raster.tiles) == 4
+
+    # a cached tile is not read again
+    reads = band.reads
+    tileRow, tileCol = next(reversed(raster.tiles))
+    row, col = np.array([tileRow * 64 + 5]), np.array([tileCol * 64 + 7])
+    np.testing.assert_array_equal(raster.gather(row, col), pixels[row, col])
+    assert band.reads == reads
+    assert len(raster.gather(np.array([], dtype='int64'), np.array([], dtype='int64'))) == 0
+
+
+def test_npyTileStore(dem, tmp_path):
+    pixels = dem.band.pixels
+    rng = np.random.default_rng(5)
+    row, col = rng.integers(0, 250, 1000), rng.integers(0, 310, 1000)
+    path = str(tmp_path / 'dem.npy')
+    store = NpyTileStore.build(dem, path, tileSize=64)
+    assert store.shape == pixels.shape and store.nodata == -9999 and store.geoTransform == dem.GetGeoTransform()
+    np.testing.assert_array_equal(store.gather(row, col), pixels[row, col])
+    np.testing.assert_array_equal(NpyTileStore(path).gather(row, col), pixels[row, col])
+
+
+def test_sample(dem, tmp_path):
+    # the per-point lookup through a full ReadAsArray, replaced by DEMSampler
+    rng = np.random.default_rng(5)
+    traj = pd.DataFrame({'lon': rng.uniform(116, 116.093, 500), 'lat': rng.uniform(39, 39.075, 500)})
+    eleMap = grade.dem2ele(dem)
+    expected = traj.apply(lambda x: grade.eleMatch(x, dem, eleMap), axis=1).to_numpy().astype('float64')
+    expected[expected == -9999] = np.nan
+
+    store = NpyTileStore.build(dem, str(tmp_path / 'dem.npy'), tileSize=64)
+    for sampler in [DEMSampler(dem, tileSize=64, maxTiles=2), DEMSampler(str(tmp_path / 'dem.npy'))]:
+        np.testing.assert_array_equal(sampler.sample(traj['lon'], traj['lat']), expected)
+
+    # out of the raster
+    assert np.isnan(DEMSampler(dem).sample(np.array([115.9, 116.05]), np.array([39.05, 39.1]))).all()
+
+    # bilinear interpolation hits the pixel values at pixel centers
+    row, col = rng.integers(0, 250, 100), rng.integers(0, 310, 100)
+    lon, lat = 116 + (col + 0.5) * 30 / 1e5, 39 + (250 - row - 0.5) * 30 / 1e5
+    ele = DEMSampler(dem, bilinear=True).sample(lon, lat)
+    pixels = dem.band.pixels[row, col].astype('float64')
+    pixels[pixels == -9999] = np.nan
+    np.testing.assert_allclose(ele, pixels, rtol=1e-6)
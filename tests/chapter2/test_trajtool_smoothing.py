@@ -0,0 +1,247 @@
+'''
+Equivalence checks of the vectorized smoothing against the loops it replaces.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for name in ['osgeo', 'matplotlib', 'contextily', 'transbigdata', 'shapely']:
+    pytest.importorskip(name)  # imported by trajtool
+
+from trajtool.smoothing import expSmooth, doubleExpSmooth, KalmanSmooth_1D, KalmanSmooth_2D, moving_average, smooth1D, smooth2D, _holtFilter
+
+
+def _expSmooth(indices, alpha=0.3):
+    result = [indices[0]]
+    for i in range(1, len(indices)):
+        result.append(alpha * result[i-1] + (1 - alpha) * indices[i])
+    return result
+
+
+def _doubleExpSmooth(indices, alpha=0.3, beta=0.1):
+    result = [indices[0]]
+    for i in range(1, len(indices)):
+        if i == 1:
+            level, trend = indices[0], indices[1] - indices[0]
+            value = indices[0]
+        else:
+            value = indices[i]
+        level_, level = level, alpha * value + (1 - alpha) * (level + trend)
+        trend = beta * (level - level_) + (1 - beta) * trend
+        result.append(level + trend)
+    return result
+
+
+def _kalmanSmooth(indices, Q=0.01, R=0.01):
+    xhat, P = [indices[0]], 1
+    for k in range(1, len(indices)):
+        P_ = P + Q
+        K = P_ / (P_ + R)
+        xhat.append(xhat[-1] + K * (indices[k] - xhat[-1]))
+        P = (1 - K) * P_
+    return xhat
+
+
+def _perSegment(func, x, seg, **params):
+    # the old per-trip loop over contiguous segments
+    starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    return np.concatenate([func(list(part), **params) for part in np.split(x, starts[1:])])
+
+
+@pytest.fixture
+def series():
+    """
+    random walks of contiguous segments, short ones included.
+    return: values and segment labels
+    """
+    rng = np.random.default_rng(11)
+    lengths = [1, 2, 3, 17, 1, 400, 60]
+    x = np.cumsum(rng.normal(0, 1, sum(lengths))) + 30
+    seg = np.repeat(np.arange(len(lengths)) * 3 + 5, lengths)
+    return x, seg
+
+
+@pytest.mark.parametrize('alpha', [0.3, 0.7, 0.95])
+def test_expSmooth(series, alpha):
+    x, seg = series
+    np.testing.assert_allclose(expSmooth(x, alpha), _expSmooth(list(x), alpha), rtol=1e-12)
+    np.testing.assert_allclose(expSmooth(x, alpha, seg=seg), _perSegment(_expSmooth, x, seg, alpha=alpha), rtol=1e-12)
+
+    # NaN stays in its own segment
+    x = x.copy()
+    x[30] = np.nan
+    np.testing.assert_allclose(expSmooth(x, alpha, seg=seg), _perSegment(_expSmooth, x, seg, alpha=alpha), rtol=1e-12)
+
+
+@pytest.mark.parametrize('alpha, beta', [(0.3, 0.1), (0.7, 0.5), (0.1, 0.9), (0.9, 0.05)])
+def test_doubleExpSmooth(series, alpha, beta):
+    x, seg = series
+    np.testing.assert_allclose(doubleExpSmooth(x, alpha, beta), _doubleExpSmooth(list(x), alpha, beta), rtol=1e-9)
+    np.testing.assert_allclose(
+        doubleExpSmooth(x, alpha, beta, seg=seg), _perSegment(_doubleExpSmooth, x, seg, alpha=alpha, beta=beta), rtol=1e-9
+    )
+
+    x = x.copy()
+    x[30] = np.nan
+    np.testing.assert_allclose(
+        doubleExpSmooth(x, alpha, beta, seg=seg), _perSegment(_doubleExpSmooth, x, seg, alpha=alpha, beta=beta), rtol=1e-9
+    )
+
+
+@pytest.mark.parametrize('alpha, beta', [(0.3, 0.1), (0.7, 0.5), (0.1, 0.9)])
+def test_holtFilter(alpha, beta):
+    # level and trend recurrences restarted from a given state at each segment start
+    rng = np.random.default_rng(12)
+    value = rng.normal(0, 1, 300)
+    starts = np.array([0, 1, 40, 41, 200])
+    state = rng.normal(0, 1, (len(starts), 2))
+
+    expected = []
+    for k, part in enumerate(np.split(value, starts[1:])):
+        level, trend = state[k]
+        for v in part:
+            level_, level = level, alpha * v + (1 - alpha) * (level + trend)
+            trend = beta * (level - level_) + (1 - beta) * trend
+            expected.append(level + trend)
+    np.testing.assert_allclose(_holtFilter(value, alpha, beta, starts, state), expected, rtol=1e-9, atol=1e-10)
+
+
+def _movingAverage(indices, window_size=3):
+    half_window = window_size // 2
+    result = []
+    for i in range(len(indices)):
+        if i < half_window or i > len(indices) - half_window - 1:
+            result.append(indices[i])
+        else:
+            window = indices[i - half_window:i + half_window + 1]
+            result.append(sum(window) / window_size)
+    return result
+
+
+@pytest.mark.parametrize('Q, R', [(0.01, 0.01), (1e-4, 1), (1, 1e-3)])
+def test_KalmanSmooth_1D(series, Q, R):
+    x, seg = series
+    np.testing.assert_allclose(KalmanSmooth_1D(x, Q, R), _kalmanSmooth(list(x), Q, R), rtol=1e-9)
+    np.testing.assert_allclose(
+        KalmanSmooth_1D(x, Q, R, seg=seg), _perSegment(_kalmanSmooth, x, seg, Q=Q, R=R), rtol=1e-9
+    )
+
+
+@pytest.mark.parametrize('window_size', [1, 3, 7])
+def test_moving_average(series, window_size):
+    x, seg = series
+    np.testing.assert_allclose(moving_average(x, window_size), _movingAverage(list(x), window_size), rtol=1e-12)
+    np.testing.assert_allclose(
+        moving_average(x, window_size, seg=seg), _perSegment(_movingAverage, x, seg, window_size=window_size), rtol=1e-12
+    )
+    with pytest.raises(ValueError):
+        moving_average(x, 4)
+
+
+@pytest.mark.parametrize('smoothFunc, params', [
+    ('exp', {'alpha': 0.5}), ('dexp', {'alpha': 0.3, 'beta': 0.1}),
+    ('kal1D', {'process_var': 0.01, 'measure_var': 0.1}), ('moving', {'window_size': 5}),
+])
+def test_smooth1D(series, smoothFunc, params):
+    x, seg = series
+    traj = pd.DataFrame({'tripID': seg, 'speed': x, 'acc': np.gradient(x)})
+    traj = traj.sample(frac=1, random_state=0).reset_index(drop=True)  # trips interleaved
+    func = {
+        'exp': _expSmooth, 'dexp': _doubleExpSmooth, 'moving': _movingAverage,
+        'kal1D': lambda indices, process_var, measure_var: _kalmanSmooth(indices, process_var, measure_var),
+    }[smoothFunc]
+
+    # the old loop over trips
+    expected = traj.copy()
+    for id in traj['tripID'].unique():
+        trip = traj[traj['tripID'] == id]
+        for col in ['speed', 'acc']:
+            expected.loc[trip.index, col] = func(trip[col].to_list(), **params)
+
+    result = smooth1D(traj, ['speed', 'acc'], None, segCol='tripID', smoothFunc=smoothFunc, **params)
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
+
+    # the whole traj as one segment
+    result = smooth1D(traj, 'speed', 'speed_', smoothFunc=smoothFunc, **params)
+    np.testing.assert_allclose(result['speed_'], func(traj['speed'].to_list(), **params), rtol=1e-9)
+
+
+def _kalmanSmooth2D(observations, timestamps, process_var=0.01, measure_var=0.00002, rts=False):
+    # the 4-state constant-velocity filter in matrix form, as the old filter_update steps, plus an RTS pass
+    H = np.array([[1, 0, 0, 0], [0, 1, 0, 0]])
+    Q = np.diag(np.broadcast_to(np.asarray(process_var, dtype='float64')**2, (4,)))
+    R = np.diag(np.broadcast_to(np.asarray(measure_var, dtype='float64')**2, (2,)))
+    n = len(observations)
+
+    def transition(dt):
+        return np.array([[1, 0, dt, 0], [0, 1, 0, dt], [0, 0, 1, 0], [0, 0, 0, 1]])
+
+    states, covs = np.zeros((n, 4)), np.zeros((n, 4, 4))
+    states[0], covs[0] = [observations[0, 0], observations[0, 1], 0, 0], np.eye(4)
+    for i in range(1, n):
+        A = transition(timestamps[i] - timestamps[i-1])
+        state_, cov_ = A @ states[i-1], A @ covs[i-1] @ A.T + Q
+        K = cov_ @ H.T @ np.linalg.inv(H @ cov_ @ H.T + R)
+        states[i] = state_ + K @ (observations[i] - H @ state_)
+        covs[i] = cov_ - K @ H @ cov_
+
+    if rts:
+        for i in range(n - 2, -1, -1):
+            A = transition(timestamps[i+1] - timestamps[i])
+            G = covs[i] @ A.T @ np.linalg.inv(A @ covs[i] @ A.T + Q)
+            states[i] = states[i] + G @ (states[i+1] - A @ states[i])
+    return states
+
+
+@pytest.fixture
+def trips():
+    """
+    noisy constant-speed trips with irregular sampling, short ones included.
+    return: observations, timestamps and segment labels
+    """
+    rng = np.random.default_rng(13)
+    lengths = [1, 2, 5, 120, 1, 40]
+    time = np.concatenate([np.cumsum(rng.uniform(0.5, 3, n)) for n in lengths])
+    speed = np.repeat(rng.uniform(-1e-4, 1e-4, (len(lengths), 2)), lengths, axis=0)
+    observations = np.array([116.3, 39.9]) + speed * time[:, np.newaxis] + rng.normal(0, 2e-5, (len(time), 2))
+    seg = np.repeat(np.arange(len(lengths)), lengths)
+    return observations, time, seg
+
+
+@pytest.mark.parametrize('rts', [False, True])
+@pytest.mark.parametrize('process_var, measure_var', [(0.01, 0.00002), ([1e-5, 1e-5, 1e-6, 1e-6], [2e-5, 3e-5]), (1, 1)])
+def test_KalmanSmooth_2D(trips, process_var, measure_var, rts):
+    observations, time, seg = trips
+    params = {'process_var': process_var, 'measure_var': measure_var, 'rts': rts}
+
+    # one segment
+    k = seg == 3
+    np.testing.assert_allclose(
+        KalmanSmooth_2D(observations[k], time[k], **params), _kalmanSmooth2D(observations[k], time[k], **params),
+        rtol=1e-9, atol=1e-10
+    )
+
+    # segments of different lengths in one call
+    starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    expected = np.concatenate([
+        _kalmanSmooth2D(z, t, **params) for z, t in zip(np.split(observations, starts[1:]), np.split(time, starts[1:]))
+    ])
+    np.testing.assert_allclose(KalmanSmooth_2D(observations, time, seg=seg, **params), expected, rtol=1e-9, atol=1e-10)
+
+
+def test_smooth2D(trips):
+    observations, time, seg = trips
+    traj = pd.DataFrame({'tripID': seg, 'lon': observations[:, 0], 'lat': observations[:, 1], 'time': time})
+    traj = traj.sample(frac=1, random_state=0).sort_values('time', kind='stable').reset_index(drop=True)  # trips interleaved
+
+    # the old loop over trips
+    expected = traj.copy()
+    for id in traj['tripID'].unique():
+        trip = traj[traj['tripID'] == id]
+        new = _kalmanSmooth2D(trip[['lon', 'lat']].to_numpy(), trip['time'].to_numpy(), rts=True)
+        expected.loc[trip.index, 'lon_'] = new[:, 0]
+        expected.loc[trip.index, 'lat_'] = new[:, 1]
+
+    result = smooth2D(traj, 'lon', 'lat', 'time', 'lon_', 'lat_', segCol='tripID', rts=True)
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
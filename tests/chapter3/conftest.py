@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of chapter3 are imported from the chapter directory, e.g., `from calculator.opmode import getOpModeID`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'chapter3'))
@@ -0,0 +1,48 @@
+'''
+Equivalence checks of the vectorized coast-down braking detection against the row-wise implementation it replaces.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('matplotlib')  # imported by calculator
+
+from calculator.braking import coastDownDetect, coastDownDec, coastDownParam
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 1000
+    traj = pd.DataFrame({
+        'speed[km/h]': rng.uniform(0, 120, n),
+        'acc[m/s2]': rng.normal(-0.3, 0.3, n),
+        'veh': rng.choice(['LDV', 'bus'], n),
+        'weight': rng.choice([1400.0, 1497.0, 12000.0, np.nan], n),
+    })
+    traj.loc[::97, 'acc[m/s2]'] = np.nan
+    return traj
+
+
+def test_coastDownDetect(traj):
+    expected = traj.apply(lambda x: True if x['acc[m/s2]'] < coastDownDec(x['speed[km/h]']) else False, axis=1)
+    result = coastDownDetect(traj)['braking']
+    assert result.dtype == bool
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_perVehicleCurves(traj):
+    curves = {'LDV': coastDownParam(-0.0001454, 0.0000622, -0.1758), 'bus': coastDownParam(-0.0002, 0.0001, -0.3),
+              1497: coastDownParam(-0.0001454, 0.0000622, -0.1758), 10000: coastDownParam(-0.0002, 0.0001, -0.3)}
+
+    expected = traj.apply(lambda x: x['acc[m/s2]'] < coastDownDec(x['speed[km/h]'], *curves[x['veh']]), axis=1)
+    np.testing.assert_array_equal(coastDownDetect(traj, vehCol='veh', curves=curves)['braking'], expected)
+
+    # weights are matched to the closest registered weight, unknown weights are not braking
+    closest = [min([1497, 10000], key=lambda k: abs(k - w)) if w == w else None for w in traj['weight']]
+    expected = [
+        a < coastDownDec(v, *curves[k]) if k else False
+        for a, v, k in zip(traj['acc[m/s2]'], traj['speed[km/h]'], closest)
+    ]
+    np.testing.assert_array_equal(coastDownDetect(traj, vehCol='weight', curves=curves)['braking'], expected)
@@ -0,0 +1,79 @@
+'''
+Equivalence checks of the cached ER-decel curves against loading the params from disk on every call.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('matplotlib')  # imported by calculator
+
+from calculator import er
+from calculator.calculator import ERCalculator
+
+DECEL_BINS = np.arange(-4.5, 0.1, 0.1)
+PARAMS = dict(prop_NAO_f=0.6, prop_LM_f=0.3, prop_SM_f=0.1, prop_NAO_r=0.7, prop_LM_r=0.2, prop_SM_r=0.1,
+              prop_drum_f=0.1, prop_drum_r=0.3, r_f_ratio=0.6, drum_disc_ratio=0.4)
+
+
+def _calER(decel, prop_NAO_f, prop_LM_f, prop_SM_f, prop_NAO_r, prop_LM_r, prop_SM_r,
+           prop_drum_f, prop_drum_r, r_f_ratio, drum_disc_ratio):
+    """
+    calER loading the params on every call.
+    """
+    LM, NAO, SM = (np.load(er.PATH_POW_PARAM[m]) for m in ['LM', 'NAO', 'SM'])
+    ER_f_disc = er._pow(decel, *NAO) * prop_NAO_f + er._pow(decel, *LM) * prop_LM_f + er._pow(decel, *SM) * prop_SM_f
+    ER_r_disc = (er._pow(decel, *NAO) * prop_NAO_r + er._pow(decel, *LM) * prop_LM_r + er._pow(decel, *SM) * prop_SM_r) * r_f_ratio
+    return 2 * ((1 - prop_drum_f) * ER_f_disc + prop_drum_f * ER_f_disc * drum_disc_ratio
+                + (1 - prop_drum_r) * ER_r_disc + prop_drum_r * ER_r_disc * drum_disc_ratio)
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    er.resetERCurves()
+    yield
+    er.resetERCurves()
+
+
+@pytest.fixture
+def OpModesInfo():
+    rng = np.random.default_rng(0)
+    prop = rng.dirichlet(np.ones(len(DECEL_BINS) - 1), 5)
+    return pd.DataFrame({
+        'brakeFrac': rng.uniform(0, 1, 5),
+        'brakeCount': rng.integers(1, 100, 5),
+        'brakeDecelBinProp': list(prop[:4]) + [0],  # an OpMode without braking
+    })
+
+
+def test_calER():
+    decel = np.linspace(0.1, 4.5, 45)
+    np.testing.assert_allclose(er.calER(decel, **PARAMS), _calER(decel, **PARAMS))
+
+    matrix = np.array([list(PARAMS.values()), [0.8, 0.1, 0.1, 0.8, 0.1, 0.1, 0, 0.2, 0.5, 0.3]])
+    expected = [_calER(decel, *row) for row in matrix]
+    np.testing.assert_allclose(er.calERMatrix(decel, matrix), expected)
+
+
+def test_setERCurve():
+    decel = np.linspace(0.1, 4.5, 45)
+    er.setERCurve('LM', [1.0, 2.0])
+    assert np.allclose(er.getERCurves()['LM'], [1.0, 2.0])
+    er.resetERCurves()
+    np.testing.assert_allclose(er.calER(decel), _calER(decel, **dict(zip(er.ER_PARAM_NAMES, [
+        0.7974, 0.1775, 0.0251, 0.8186, 0.1755, 0.0058, 0, 0.2228, 0.5, 0.3]))))
+
+
+def test_calOpModeERs(OpModesInfo):
+    ER = _calER(-DECEL_BINS[:-1], **PARAMS)
+    expected = OpModesInfo.apply(lambda x: sum(ER * x['brakeDecelBinProp'] * x['brakeFrac']), axis=1)
+    result = ERCalculator().calOpModeERs(OpModesInfo, DECEL_BINS, **PARAMS)['ER[g/hr/veh]']
+    np.testing.assert_allclose(result, expected)
+
+
+def test_calMOVESERs(OpModesInfo):
+    ER = _calER(-DECEL_BINS[:-1], **PARAMS)
+    overall = sum(OpModesInfo['brakeDecelBinProp'] * OpModesInfo['brakeCount']) / sum(OpModesInfo['brakeCount'])
+    expected = OpModesInfo.apply(lambda x: sum(ER * overall * x['brakeFrac']), axis=1)
+    result = ERCalculator().calMOVESERs(OpModesInfo, DECEL_BINS, **PARAMS)['ER_MOVES[g/hr/veh]']
+    np.testing.assert_allclose(result, expected)
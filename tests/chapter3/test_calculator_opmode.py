@@ -0,0 +1,104 @@
+'''
+Equivalence checks of the lookup-table OpMode assignment against the MOVES rules applied point by point.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('matplotlib')  # imported by calculator and emission
+
+from calculator.opmode import OpModeDetect, OpModeAgg, getOpModeID, getDecelBinProp
+from emission.OpMode import OpModeDetect as emissionOpModeDetect
+
+INF = np.inf
+VSP_BINS = {
+    (1.609, 40.234): [(-INF, 0, 11), (0, 3, 12), (3, 6, 13), (6, 9, 14), (9, 12, 15), (12, INF, 16)],
+    (40.234, 80.467): [(-INF, 0, 21), (0, 3, 22), (3, 6, 23), (6, 9, 24), (9, 12, 25), (12, 18, 27), (18, 24, 28), (24, 30, 29), (30, INF, 30)],
+    (80.467, INF): [(-INF, 6, 33), (6, 12, 35), (12, 18, 37), (18, 24, 38), (24, 30, 39), (30, INF, 40)],
+}
+
+
+def _OpMode(accGrade, lag1, lag2, speed, VSP):
+    """
+    MOVES OpMode of a point, braking first.
+    """
+    if accGrade <= -0.894 or (accGrade < -0.447 and lag1 < -0.447 and lag2 < -0.447):
+        return 0
+    if not accGrade > -0.894:
+        return -1
+    if speed < 1.609:
+        return 1
+    for (low, high), bins in VSP_BINS.items():
+        if low <= speed < high:
+            return next((id for vLow, vHigh, id in bins if vLow <= VSP < vHigh), -1)
+    return -1
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 2000
+    traj = pd.DataFrame({
+        'tripID': np.repeat(np.arange(20), n // 20),
+        'grade[D]': rng.normal(0, 0.02, n),
+        'speed[km/h]': rng.uniform(0, 120, n),
+        'acc[m/s2]': rng.normal(-0.3, 0.5, n),
+        'VSP[kW/t]': rng.uniform(-10, 40, n),
+    })
+    traj.loc[rng.choice(n, 20), 'VSP[kW/t]'] = np.nan
+    traj.loc[rng.choice(n, 20), 'speed[km/h]'] = np.nan
+    return traj
+
+
+def _expected(traj, segCol=None):
+    accGrade = traj['acc[m/s2]'] + 9.8 * np.sin(np.arctan(traj['grade[D]']))
+    group = accGrade.groupby(traj[segCol]) if segCol else accGrade
+    lag1, lag2 = group.shift(1), group.shift(2)
+    return np.array([
+        _OpMode(*row) for row in zip(accGrade, lag1, lag2, traj['speed[km/h]'], traj['VSP[kW/t]'])
+    ])
+
+
+@pytest.mark.parametrize('detect', [OpModeDetect, emissionOpModeDetect])
+@pytest.mark.parametrize('segCol', [None, 'tripID'])
+def test_OpModeDetect(traj, detect, segCol):
+    OpMode = detect(traj, segCol=segCol)['OpModeID']
+    assert OpMode.dtype == 'Int8'
+    np.testing.assert_array_equal(OpMode.fillna(-1).to_numpy(), _expected(traj, segCol))
+
+
+def test_lagBraking():
+    # decelerating at -0.6 m/s2 for three seconds is braking whatever the speed-VSP bin
+    accGrade = np.array([0, -0.6, -0.6, -0.6, -0.6, 0])
+    OpMode = getOpModeID(accGrade, np.full(6, 30.0), np.full(6, 1.0))
+    np.testing.assert_array_equal(OpMode, [12, 12, 12, 0, 0, 12])
+
+
+@pytest.mark.parametrize('segCol', [None, 'tripID'])
+def test_chunks(traj, segCol):
+    full = OpModeDetect(traj, segCol=segCol)['OpModeID']
+    chunks = [traj.iloc[:777], traj.iloc[777:1501], traj.iloc[1501:]]
+    result = pd.concat([
+        OpModeDetect(chunk, segCol=segCol, prevTraj=chunks[i-1] if i else None)['OpModeID']
+        for i, chunk in enumerate(chunks)
+    ])
+    pd.testing.assert_series_equal(result, full)
+
+
+def test_OpModeAgg(traj):
+    rng = np.random.default_rng(1)
+    traj = OpModeDetect(traj)
+    traj['braking'] = rng.random(len(traj)) < 0.3
+    traj.loc[traj.index[:5], 'OpModeID'] = 99  # unknown OpMode
+    accBins = np.arange(-4.6, 0.1, 0.1)
+    result = OpModeAgg(traj, accBins=accBins)
+
+    assert list(result.index) == [0, 1, 11, 12, 13, 14, 15, 16, 21, 22, 23, 24, 25, 27, 28, 29, 30, 33, 35, 37, 38, 39, 40]
+    for id, row in result.iterrows():
+        df = traj[traj['OpModeID'] == id]
+        brake = df[df['braking'] == True]
+        assert row['trajCount'] == len(df)
+        assert row['brakeCount'] == len(brake)
+        assert row['brakeFrac'] == pytest.approx(len(brake) / len(df) if len(df) else 0)
+        np.testing.assert_allclose(row['brakeDecelBinProp'], getDecelBinProp(brake['acc[m/s2]'].values, accBins))
@@ -0,0 +1,59 @@
+'''
+Equivalence checks of the batched ER sweep against evaluating each parameter set on its own.
+'''
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('matplotlib')  # imported by emission
+pytest.importorskip('openpyxl')  # ER measurements are read from excel
+
+from emission.emissionRate import ERCalculator
+
+CHAPTER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'chapter3')
+
+
+@pytest.fixture
+def calculator(monkeypatch):
+    monkeypatch.chdir(CHAPTER_DIR)  # data paths are relative to the chapter
+    return ERCalculator()
+
+
+@pytest.fixture
+def opmode_info():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'brakeFrac': [0.2, 0.5, np.nan],
+        'brakeDecelBinFrac': list(rng.dirichlet(np.ones(45), 2)) + [0],
+    }, index=[11, 21, 33])
+
+
+def _ERs(calculator, opmode_info, decel, params):
+    ER = calculator.calER(decel, 'mix', **params)
+    return [np.nan_to_num(sum(ER * np.asarray(p) * f)) for p, f in zip(opmode_info['brakeDecelBinFrac'], opmode_info['brakeFrac'])]
+
+
+def test_sweepGrid(calculator, opmode_info):
+    decel = np.arange(0.1, 4.6, 0.1)
+    grid = {'r_f_ratio': [0.4, 0.5, 0.6], 'drum_disc_ratio': [0.2, 0.3], 'prop_drum_r': [0, 0.2228]}
+    params, ERs, summary = calculator.sweep(grid, opmode_info, decel)
+
+    combos = list(itertools.product(*grid.values()))
+    assert params.values.tolist() == [list(c) for c in combos]
+    expected = [_ERs(calculator, opmode_info, decel, dict(zip(grid, c))) for c in combos]
+    np.testing.assert_allclose(ERs.to_numpy(), expected)
+    assert list(ERs.columns) == [11, 21, 33]
+    np.testing.assert_allclose(summary['q50'], ERs.median())
+
+
+def test_sweepSamples(calculator, opmode_info):
+    decel = np.arange(0.1, 4.6, 0.1)
+    rng = np.random.default_rng(1)
+    samples = pd.DataFrame({'prop_NAO_f': rng.uniform(0.6, 0.9, 20), 'r_f_ratio': rng.uniform(0.4, 0.6, 20)})
+    _, ERs, _ = calculator.sweep(samples, opmode_info, decel)
+
+    expected = [_ERs(calculator, opmode_info, decel, row._asdict()) for row in samples.itertuples(index=False)]
+    np.testing.assert_allclose(ERs.to_numpy(), expected)
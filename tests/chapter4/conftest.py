@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# modules of chapter4 are imported from the chapter directory, e.g., `from preprocessing.geo import grade2traj`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'chapter4'))
+
+
+EARTH_RADIUS_M = 6371009
+
+
+@pytest.fixture
+def grid():
+    """
+    grid road network of 30 x 30 nodes every 20 m, streets are two-way and named by row/column, 
+    with one candidate point at the middle of each edge.
+    return: dict of the CandidateIndex and the origin/steps of the grid [degree]
+    """
+    import networkx as nx
+    from mapmatch.network import CandidateIndex
+
+    step, N = 20, 30
+    lat0, lon0 = 39.9, 116.3
+    dlat = np.rad2deg(step / EARTH_RADIUS_M)
+    dlon = dlat / np.cos(np.deg2rad(lat0))
+
+    G = nx.MultiDiGraph()
+    G.add_nodes_from((i, j) for i in range(N) for j in range(N))
+    nodes, edges, xy = [], [], []
+    for i in range(N):
+        for j in range(N):
+            for di, dj, osmid in [(0, 1, f"row{i}"), (1, 0, f"col{j}")]:
+                if i + di < N and j + dj < N:
+                    m = (i + di / 2, j + dj / 2)
+                    for a, b in [((i, j), m), (m, (i + di, j + dj))]:
+                        G.add_edge(a, b, length=step / 2)
+                        G.add_edge(b, a, length=step / 2)
+                    nodes.append(m)
+                    edges.append(osmid)
+                    xy.append((lat0 + m[0] * dlat, lon0 + m[1] * dlon))
+
+    node = np.empty(len(nodes), dtype=object)
+    node[:] = [None] * len(nodes)
+    for k, u in enumerate(nodes):
+        node[k] = u
+    index = CandidateIndex(G, node, np.array(edges, dtype=object), np.deg2rad(np.array(xy)))
+    return dict(index=index, lat0=lat0, lon0=lon0, dlat=dlat, dlon=dlon)
+
+
+@pytest.fixture
+def trip(grid):
+    """
+    noisy GPS points driving east along row 10, then south along column 20.
+    return: lon, lat and the street of each point
+    """
+    rng = np.random.default_rng(0)
+    path = [(10, j + 0.5) for j in range(2, 20)] + [(i + 0.5, 20) for i in range(10, 24)]
+    street = [f"row{i}" if i == 10 and j != 20 else f"col{j}" for i, j in path]
+    noise = np.rad2deg(4 / EARTH_RADIUS_M)
+    lat = np.array([grid['lat0'] + i * grid['dlat'] for i, _ in path]) + rng.normal(0, noise, len(path))
+    lon = np.array([grid['lon0'] + j * grid['dlon'] for _, j in path]) + rng.normal(0, noise, len(path)) / np.cos(np.deg2rad(grid['lat0']))
+    return lon, lat, street
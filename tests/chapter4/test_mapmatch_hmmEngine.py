@@ -0,0 +1,67 @@
+'''
+Checks of the HMM engine, i.e., the array-based viterbi against brute-force path scores and cached route distances.
+'''
+
+import itertools
+
+import networkx as nx
+import numpy as np
+import pytest
+
+pytest.importorskip('geopandas')  # imported by mapmatch
+pytest.importorskip('pytrack')
+
+from mapmatch.hmmEngine import hmmMatch, getCandidateArrays, viterbi, getRouteDist, _haversine, SIGMA, BETA
+
+
+def _pathScore(index, cand, dist, lon, lat, slots):
+    """
+    log-probability of a candidate path, the transition of each step from route distances of Dijkstra.
+    """
+    score = -np.log(np.sqrt(2 * np.pi) * SIGMA) * len(slots) - 0.5 * np.sum((dist[np.arange(len(slots)), slots] / SIGMA) ** 2)
+    for t in range(1, len(slots)):
+        u, v = index.node[cand[t-1, slots[t-1]]], index.node[cand[t, slots[t]]]
+        route = nx.shortest_path_length(index.graph, u, v, weight='length')
+        score += -np.log(BETA) - np.abs(route - _haversine(lon[t-1], lat[t-1], lon[t], lat[t])) / BETA
+    return score
+
+
+def test_viterbi(grid, trip):
+    index = grid['index']
+    lon, lat, _ = trip
+    lon, lat = lon[15:21], lat[15:21]  # around the turn
+    cand, dist = getCandidateArrays(index, np.column_stack([lat, lon]), radius=15)
+
+    best = viterbi(index, cand, dist, lon, lat)
+
+    valid = [np.flatnonzero(row >= 0) for row in cand]
+    scores = {slots: _pathScore(index, cand, dist, lon, lat, slots) for slots in itertools.product(*valid)}
+    assert _pathScore(index, cand, dist, lon, lat, tuple(best)) == pytest.approx(max(scores.values()))
+
+
+def test_getRouteDist(grid):
+    index = grid['index']
+    rng = np.random.default_rng(1)
+    source, target = rng.integers(-1, len(index.node), 8), rng.integers(-1, len(index.node), 6)
+
+    for _ in range(2):  # computed, then from the cache
+        routeDist = getRouteDist(index, source, target, cutoff=200)
+        for i, s in enumerate(source):
+            for j, t in enumerate(target):
+                route = nx.shortest_path_length(index.graph, index.node[s], index.node[t], weight='length') if s >= 0 and t >= 0 else np.inf
+                assert routeDist[i, j] == (route if route <= 200 else np.inf)
+    assert index.routes.hits > 0
+
+
+def test_hmmMatch(grid, trip):
+    index = grid['index']
+    lon, lat, street = trip
+    lon, lat = lon.copy(), lat.copy()
+    lat[5] = grid['lat0'] - 3 * grid['dlat']  # no candidates, 60 m south of the grid
+
+    info = hmmMatch(lon, lat, candidate_index=index, radius=15)
+
+    assert np.isnan(info['edge_osmid'][5]) and np.isnan(info['lon'][5])
+    matched = np.arange(len(lon)) != 5
+    assert np.mean(np.array(info['edge_osmid'], dtype=object)[matched] == np.array(street, dtype=object)[matched]) >= 0.9
+    assert (_haversine(lon, lat, info['lon'], info['lat'])[matched] <= 15).all()
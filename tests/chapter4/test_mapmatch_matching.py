@@ -0,0 +1,151 @@
+'''
+Checks of the map-matching framework with a stand-in engine, i.e., trips matched sequentially or in a process pool.
+'''
+
+import multiprocessing
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('geopandas')  # imported by mapmatch
+pytest.importorskip('pytrack')
+
+from mapmatch import matching
+
+
+def _fakeMatch(lon, lat, road_graph=None, node_gdf=None, edge_gdf=None, scale=1, **kwargs):
+    """
+    a deterministic engine, trips with negative longitudes fail.
+    """
+    if lon[0] < 0:
+        raise ValueError('bad trip')
+    return {'edge_osmid': list(np.round(np.asarray(lon) * scale) + road_graph)}
+
+
+@pytest.fixture
+def trips(monkeypatch):
+    monkeypatch.setitem(matching.ENGINE_DICT, 'fake', _fakeMatch)
+    rng = np.random.default_rng(0)
+    traj = pd.DataFrame({'tripID': rng.integers(0, 50, 1000), 'lon': rng.uniform(0, 100, 1000)})
+    traj.loc[traj['tripID'] == 5, 'lon'] = -1
+    return [
+        (id, traj.index[pos], traj['lon'].to_numpy()[pos], traj['lon'].to_numpy()[pos])
+        for id, pos in traj.groupby('tripID', sort=False).indices.items()
+    ]
+
+
+@pytest.mark.parametrize('nWorkers', [1, 3])
+def test_matchTrips(trips, nWorkers):
+    if nWorkers > 1 and multiprocessing.get_start_method() != 'fork':
+        pytest.skip('the stand-in engine is registered in this process only')
+    matcher = matching.Matcher('fake', cacheDir=None)
+    network = {'road_graph': 1000, 'node_gdf': None, 'edge_gdf': None}
+
+    results = list(matcher._matchTrips(trips, network, nWorkers, 4, {'scale': 2}))
+
+    assert [id for id, *_ in results] == [id for id, *_ in trips]
+    for (id, index, info_dict, error), (_, index_, lon, _) in zip(results, trips):
+        np.testing.assert_array_equal(index, index_)
+        if id == 5:
+            assert info_dict is None
+            assert error == {'tripID': 5, 'pointNum': len(lon), 'errorType': 'ValueError', 'errorMsg': 'bad trip'}
+        else:
+            assert error is None
+            assert info_dict['edge_osmid'] == list(np.round(lon * 2) + 1000)
+
+
+def _routeMatch(lon, lat, candidate_index=None, **kwargs):
+    """
+    a stand-in engine that caches a route distance for each new trip.
+    """
+    if candidate_index.routes.get((lon[0], lat[0])) is None:
+        candidate_index.routes.put((lon[0], lat[0]), 0.0)
+    return {'edge_osmid': [1] * len(lon)}
+
+
+@pytest.mark.parametrize('engine, saves', [('fake', 0), ('route', 1)])
+def test_saveRoutes(tmp_path, monkeypatch, grid, engine, saves):
+    monkeypatch.setitem(matching.ENGINE_DICT, 'fake', _fakeMatch)
+    monkeypatch.setitem(matching.ENGINE_DICT, 'route', _routeMatch)
+    monkeypatch.setattr(matching, 'ROUTE_ENGINES', ['route'])
+    matcher = matching.Matcher(engine, cacheDir=str(tmp_path))
+    monkeypatch.setattr(matcher.store, 'getNetwork', lambda *bbox: ('key', 0, None, None))
+    monkeypatch.setattr(matcher.store, 'getCandidateIndex', lambda *args: grid['index'])
+    calls = []
+    monkeypatch.setattr(matcher.store, 'saveRoutes', lambda key, index, interp_dist: calls.append(key) or setattr(index.routes, 'dirty', False))
+    traj = pd.DataFrame({'tripID': [1, 1, 2], 'lon': [116.3, 116.3001, 116.3002], 'lat': [39.9, 39.9, 39.9]})
+
+    matcher.match(traj)
+    matcher.match(traj)  # no new routes
+
+    assert len(calls) == saves
+
+
+def test_sharedIndex(monkeypatch, grid):
+    monkeypatch.setitem(matching.ENGINE_DICT, 'route', _routeMatch)
+    monkeypatch.setattr(matching.NetworkStore, 'extract', lambda self, *bbox: ('graph', None, None))
+    built = []
+    monkeypatch.setattr(matching.CandidateIndex, 'fromGraph', lambda road_graph, interp_dist: built.append(interp_dist) or grid['index'])
+    seen = []
+    monkeypatch.setitem(matching.ENGINE_DICT, 'route', lambda lon, lat, candidate_index=None, **kwargs: seen.append(candidate_index) or _routeMatch(lon, lat, candidate_index))
+    matcher = matching.Matcher('route')
+    traj = pd.DataFrame({'tripID': [1, 1, 2, 3], 'lon': [116.3, 116.3001, 116.3002, 116.3003], 'lat': [39.9, 39.9, 39.9, 39.9]})
+
+    matcher.match(traj, interp_dist=20)
+
+    # one index and route cache for all trips of the call, without a cache directory
+    assert built == [20]
+    assert len(seen) == 3 and all(index is grid['index'] for index in seen)
+    assert matcher.routes is grid['index'].routes and len(matcher.routes) == 3
+
+    matcher.match(traj, interp_dist=20)
+    assert built == [20, 20]
+
+
+def _infoMatch(lon, lat, edge_attr=None, **kwargs):
+    """
+    a stand-in engine with road information, edges are picked by the digits of the longitude.
+    """
+    if lon[0] < 0:
+        raise ValueError('bad trip')
+    edge_osmid = [int(x * 1e4) % 6 for x in lon]  # edge 5 is unknown
+    return dict(edge_osmid=edge_osmid, lon=np.asarray(lon) + 1, lat=np.asarray(lat) + 1, **edge_attr.lookup(edge_osmid))
+
+
+@pytest.mark.parametrize('dropCoord', [True, False])
+def test_roadInfo(monkeypatch, dropCoord):
+    monkeypatch.setitem(matching.ENGINE_DICT, 'info', _infoMatch)
+    edge_gdf = pd.DataFrame({
+        'osmid': [0, 1, 2, 3, 4],
+        'highway': ['primary', 'secondary', ['primary', 'trunk'], 'residential', 'primary'],
+        'bridge': [np.nan, 'yes', np.nan, 'no', 'viaduct'],
+        'tunnel': [np.nan, np.nan, 'yes', np.nan, np.nan],
+    })
+    monkeypatch.setattr(matching.NetworkStore, 'extract', lambda self, *bbox: (None, None, edge_gdf))
+    monkeypatch.setattr(matching.CandidateIndex, 'fromGraph', lambda road_graph, interp_dist: SimpleNamespace())
+    rng = np.random.default_rng(0)
+    traj = pd.DataFrame({'tripID': rng.integers(0, 20, 500), 'lon': 116.3 + rng.uniform(0, 0.01, 500), 'lat': 39.9 + rng.uniform(0, 0.01, 500)})
+    traj.index = traj.index * 2 + 7
+    traj.loc[traj['tripID'] == 3, 'lon'] *= -1
+
+    result = matching.Matcher('info').match(traj, road_info=True, dropCoord=dropCoord)
+
+    assert result['road_type'].dtype == 'category'
+    assert result['bridge'].dtype == result['tunnel'].dtype == 'boolean'
+    failed = traj['tripID'] == 3
+    assert result.loc[failed, ['road_type', 'bridge', 'tunnel']].isna().all().all()
+    assert result.loc[failed, 'osmid'].isna().all()
+    expected = {0: ('primary', False, False), 1: ('secondary', True, False), 2: ('primary;trunk', False, True), 3: ('residential', False, False), 4: ('primary', True, False)}
+    for (i, row), lon in zip(result[~failed].iterrows(), traj.loc[~failed, 'lon']):
+        edge = int(lon * 1e4) % 6
+        assert row['osmid'] == edge
+        if edge == 5:
+            assert pd.isna(row['road_type']) and pd.isna(row['bridge'])
+        else:
+            assert (row['road_type'], row['bridge'], row['tunnel']) == expected[edge]
+    if dropCoord:
+        assert 'mapLon' not in result
+    else:
+        np.testing.assert_allclose(result.loc[~failed, 'mapLon'].astype(float), traj.loc[~failed, 'lon'] + 1)
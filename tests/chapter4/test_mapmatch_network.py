@@ -0,0 +1,129 @@
+'''
+Checks of the network store, i.e., opt-in caching, memory-mapped candidate indexes and the way filter of OSM extracts.
+'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('geopandas')  # imported by mapmatch
+pytest.importorskip('pytrack')
+
+from mapmatch import Matcher, network
+from mapmatch.network import NetworkStore, CandidateIndex, RouteCache, CUSTOM_FILTER, parseFilter, matchFilter
+
+
+@pytest.fixture
+def points(monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 5000
+    edge_osmid = np.empty(n, dtype=object)
+    edge_osmid[:] = [[i, i + 1] if i % 7 == 0 else i for i in rng.integers(0, 400, n)]
+    points = {
+        'graph': None,
+        'node': rng.integers(0, 1000, n).astype(object),
+        'edge_osmid': edge_osmid,
+        'xy': np.deg2rad(np.column_stack([39.9 + rng.uniform(0, 0.02, n), 116.3 + rng.uniform(0, 0.02, n)])),
+    }
+    monkeypatch.setattr(network, 'interpolateNetwork', lambda road_graph, interp_dist: dict(points, ball=CandidateIndex(**points).ball))
+    return points
+
+
+def test_cacheOptIn():
+    assert Matcher('hmm').store is None
+
+
+def test_candidateIndexCache(tmp_path, points):
+    store = NetworkStore(str(tmp_path))
+    built = store.getCandidateIndex('key', None, 30)
+    loaded = store.getCandidateIndex('key', None, 30)
+
+    assert sorted(p.name for p in (tmp_path / 'key' / 'candidates-30').glob('*.pkl')) == ['ball.pkl', 'points.pkl']
+    assert isinstance(loaded.xy, np.ndarray) and not loaded.xy.flags.writeable  # memory-mapped
+    np.testing.assert_array_equal(loaded.xy, points['xy'])
+
+    rng = np.random.default_rng(1)
+    query = np.column_stack([39.9 + rng.uniform(0, 0.02, 300), 116.3 + rng.uniform(0, 0.02, 300)])
+    for closest in [True, False]:
+        for a, b in zip(built.query(query, 40, closest), loaded.query(query, 40, closest)):
+            np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('tags, passed', [
+    ({'highway': 'primary'}, True),
+    ({'highway': 'residential', 'service': 'driveway'}, True),
+    ({'highway': 'service', 'service': 'emergency_access'}, False),
+    ({'highway': 'footway'}, False),
+    ({'highway': 'primary', 'access': 'private'}, False),
+    ({'highway': 'primary', 'area': 'yes'}, False),
+    ({'building': 'yes'}, False),
+])
+def test_matchFilter(tags, passed):
+    assert matchFilter(tags, parseFilter(CUSTOM_FILTER)) == passed
+
+
+def test_matchFilterOps():
+    clauses = parseFilter('["highway"="primary"]["oneway"!="yes"]')
+    assert matchFilter({'highway': 'primary'}, clauses)
+    assert not matchFilter({'highway': 'primary_link'}, clauses)
+    assert not matchFilter({'highway': 'primary', 'oneway': 'yes'}, clauses)
+
+
+OSM_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="39.9000" lon="116.3000"/>
+  <node id="2" lat="39.9000" lon="116.3010"/>
+  <node id="3" lat="39.9000" lon="116.3020"/>
+  <node id="4" lat="39.9010" lon="116.3020"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><tag k="highway" v="footway"/></way>
+</osm>
+'''
+
+
+def test_graphFromFile(tmp_path, monkeypatch):
+    ox = pytest.importorskip('osmnx')
+    osmFile = tmp_path / 'roads.osm'
+    osmFile.write_text(OSM_XML)
+    calls = []
+    graph_from_xml = ox.graph_from_xml
+    monkeypatch.setattr(ox, 'graph_from_xml', lambda *args, **kwargs: calls.append(args) or graph_from_xml(*args, **kwargs))
+    monkeypatch.setattr(network, '_OSM_GRAPH', {})
+
+    G = network.graphFromFile(str(osmFile), 39.91, 39.89, 116.29, 116.31)
+    G_ = network.graphFromFile(str(osmFile), 39.91, 39.89, 116.29, 116.31, CUSTOM_FILTER)
+
+    assert len(calls) == 1  # parsed once
+    assert {data['highway'] for *_, data in G.edges(data=True)} == {'residential', 'footway'}
+    assert {data['osmid']: data['highway'] for *_, data in G.edges(data=True)} == {10: 'residential', 11: 'footway'}
+    assert 3 in G.nodes  # ways are not joined
+    assert {data['highway'] for *_, data in G_.edges(data=True)} == {'residential'}
+    assert 4 not in G_.nodes
+
+
+def test_routeCache():
+    cache = RouteCache(maxSize=2)
+    assert not cache.dirty
+    cache.put(('a', 'b'), 120.0)
+    cache.put(('a', 'c'), -100)  # not reached within 100 m
+    assert cache.dirty
+
+    assert cache.get(('a', 'b'), cutoff=50) == 120.0  # found routes are kept for any cutoff
+    assert cache.get(('a', 'c'), cutoff=80) == -100
+    assert cache.get(('a', 'c'), cutoff=200) is None  # searched with a smaller cutoff
+    assert cache.get(('a', 'd')) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    cache.put(('a', 'd'), 10.0)
+    assert list(cache.entries) == [('a', 'c'), ('a', 'd')] and cache.evictions == 1
+
+
+def test_saveRoutes(tmp_path, points):
+    store = NetworkStore(str(tmp_path))
+    index = store.getCandidateIndex('key', None, 30)
+    index.routes.put((1, 2), 30.0)
+    store.saveRoutes('key', index, 30)
+    assert not index.routes.dirty
+
+    loaded = store.getCandidateIndex('key', None, 30)
+    assert list(loaded.routes.items()) == [((1, 2), 30.0)]
+    assert not loaded.routes.dirty
@@ -0,0 +1,73 @@
+'''
+Checks of online map-matching against the batch HMM engine.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('geopandas')  # imported by mapmatch
+pytest.importorskip('pytrack')
+
+from mapmatch import OnlineMatcher, hmmMatch
+
+
+@pytest.fixture
+def points(grid, trip):
+    lon, lat, _ = trip
+    lon, lat = lon.copy(), lat.copy()
+    lat[5] = grid['lat0'] - 3 * grid['dlat']  # no candidates, 60 m south of the grid
+    return lon, lat
+
+
+def _stream(matcher, lon, lat, vehIDs=('v1', 'v2'), t=None):
+    """
+    push points of vehicles in turns, then flush.
+    return: DataFrame of emitted matches, and the largest window of a vehicle
+    """
+    t = np.arange(len(lon)) if t is None else t
+    emitted, window = [], 0
+    for k in range(len(lon)):
+        for vehID in vehIDs:
+            emitted += matcher.push(vehID, t[k], lon[k], lat[k])
+        window = max(window, *(len(matcher.vehicles[v]['window']) for v in vehIDs if v in matcher.vehicles))
+    return pd.DataFrame(emitted + matcher.flush()), window
+
+
+def test_online(grid, points):
+    lon, lat = points
+    batch = hmmMatch(lon, lat, candidate_index=grid['index'], radius=15)
+
+    emitted, window = _stream(OnlineMatcher(grid['index'], radius=15, maxWindow=100), lon, lat)
+
+    assert window < len(lon)  # points are emitted before the end
+    for vehID in ['v1', 'v2']:
+        df = emitted[emitted['vehID'] == vehID]
+        assert list(df['t']) == list(range(len(lon)))
+        assert list(df['edge_osmid'].fillna('')) == list(pd.Series(batch['edge_osmid']).fillna(''))
+        np.testing.assert_allclose(df['mapLon'], batch['lon'])
+        np.testing.assert_allclose(df['mapLat'], batch['lat'])
+
+
+def test_maxWindow(grid, points):
+    lon, lat = points
+
+    emitted, window = _stream(OnlineMatcher(grid['index'], radius=15, maxWindow=2), lon, lat)
+
+    assert window <= 2
+    for vehID in ['v1', 'v2']:
+        df = emitted[emitted['vehID'] == vehID]
+        assert list(df['t']) == list(range(len(lon)))
+        assert df['edge_osmid'].isna().tolist() == [k == 5 for k in range(len(lon))]
+
+
+def test_maxGap(grid, points):
+    lon, lat = points
+    lon, lat = lon[10:20], lat[10:20]
+    t = np.r_[np.arange(5), np.arange(5) + 100]  # a gap between two paths
+
+    emitted, _ = _stream(OnlineMatcher(grid['index'], radius=15, maxGap=5), lon, lat, vehIDs=['v'], t=t)
+
+    for part in [slice(0, 5), slice(5, 10)]:
+        batch = hmmMatch(lon[part], lat[part], candidate_index=grid['index'], radius=15)
+        assert list(emitted['edge_osmid'][part]) == batch['edge_osmid']
@@ -0,0 +1,67 @@
+'''
+Checks of the PyTrack engine with a shared candidate index, i.e., the viterbi search is bounded to the trip.
+'''
+
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip('geopandas')  # imported by mapmatch
+pytest.importorskip('pytrack')
+
+from mapmatch import pytrackEngine
+
+
+@pytest.fixture
+def viterbi(monkeypatch):
+    """
+    stand-in of the PyTrack trellis and viterbi search that picks the closest candidate, keeping the graph it is given.
+    """
+    calls = []
+
+    def viterbi_search(G, trellis, start, target):
+        calls.append(G)
+        return None, {f"{key}": f"{key}_{int(np.argmin(trellis[key]['dists']))}" for key in reversed(list(trellis))}
+
+    monkeypatch.setattr(pytrackEngine, 'mpmatching_utils', types.SimpleNamespace(create_trellis=lambda candidates: candidates))
+    monkeypatch.setattr(pytrackEngine, 'mpmatching', types.SimpleNamespace(viterbi_search=viterbi_search))
+    return calls
+
+
+def test_subgraph(grid):
+    index = grid['index']
+    north, south = grid['lat0'] + np.array([6, 2]) * grid['dlat']
+    west, east = grid['lon0'] + np.array([3, 11]) * grid['dlon']
+    lat, lon = np.rad2deg(index.xy).T
+    inside = (south <= lat) & (lat <= north) & (west <= lon) & (lon <= east)
+
+    G = index.subgraph(north, south, west, east)
+
+    assert set(G.nodes) == set(index.node[inside])
+    assert all(2 <= i <= 6 and 3 <= j <= 11 for i, j in G.nodes)
+
+
+def test_mapMatch(grid, trip, viterbi):
+    index = grid['index']
+    lon, lat, _ = trip
+    lon, lat = lon.copy(), lat.copy()
+    lat[5] = grid['lat0'] - 3 * grid['dlat']  # no candidates, 60 m south of the grid
+
+    info = pytrackEngine.pytrackMatch(lon, lat, candidate_index=index, enlarge_dist=40, radius=15)
+
+    G = viterbi[0]
+    assert len(G) < len(index.graph)  # bounded to the trip
+    assert all(i <= 26 and j <= 22 for i, j in G.nodes)
+    assert np.isnan(info['edge_osmid'][5])
+    pointIdx, candIdx, dist = index.query(np.column_stack([lat, lon]), radius=15)
+    closest = {}
+    for p, c, d in zip(pointIdx, candIdx, dist):
+        if d < closest.get(p, (None, np.inf))[1]:
+            closest[p] = (index.edge_osmid[c], d)
+    assert [s for k, s in enumerate(info['edge_osmid']) if k != 5] == [closest[k][0] for k in range(len(lon)) if k != 5]
+
+
+def test_queryEmpty(grid):
+    pointIdx, candIdx, dist = grid['index'].query(np.array([[0, 0], [1, 1]]), radius=15)
+    assert len(pointIdx) == len(candIdx) == len(dist) == 0
@@ -0,0 +1,51 @@
+'''
+Equivalence checks of the vectorized calculation functions against the row-wise implementations they replace.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('osgeo')  # imported by preprocessing.calculation
+
+from preprocessing.calculation import getDistByCoord, getMileageByCoord, calDistInterval
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 200
+    traj = pd.DataFrame({
+        'tripID': np.repeat([3, 1, 2, 5], n // 4),
+        'lon': 116.3 + np.cumsum(rng.normal(0, 1e-4, n)),
+        'lat': 39.9 + np.cumsum(rng.normal(0, 1e-4, n)),
+    })
+    traj.loc[17, 'lon'] = np.nan
+    return traj
+
+
+@pytest.mark.parametrize('calDirect, shift', [('forward', -1), ('backward', 1)])
+def test_calDistInterval(traj, calDirect, shift):
+    lon_, lat_ = traj['lon'].shift(shift), traj['lat'].shift(shift)
+    expected = [getDistByCoord(*row) for row in zip(traj['lon'], traj['lat'], lon_, lat_)]
+
+    result = calDistInterval(traj.copy(), calDirect=calDirect)['dist[km]']
+    np.testing.assert_allclose(result, np.float32(expected), rtol=1e-6, equal_nan=True)
+
+    # distances across trips are blanked
+    result = calDistInterval(traj.copy(), calDirect=calDirect, segCol='tripID')['dist[km]']
+    boundary = traj['tripID'] != traj['tripID'].shift(shift)
+    assert result[boundary].isna().all()
+    np.testing.assert_allclose(result[~boundary], np.float32(expected)[~boundary], rtol=1e-6, equal_nan=True)
+
+
+def test_getMileageByCoord(traj):
+    traj = traj.dropna()
+    lon, lat = traj['lon'].to_numpy(), traj['lat'].to_numpy()
+    expected = sum(getDistByCoord(lon[i], lat[i], lon[i+1], lat[i+1]) for i in range(len(traj) - 1))
+    assert getMileageByCoord(traj) == pytest.approx(expected, rel=1e-9)
+
+    mileage = getMileageByCoord(traj, segCol='tripID')
+    assert list(mileage) == [1, 2, 3, 5]
+    for id, m in mileage.items():
+        assert m == pytest.approx(getMileageByCoord(traj[traj['tripID'] == id]), rel=1e-9)
@@ -0,0 +1,74 @@
+'''
+Checks of trip densification, i.e., parallel chunks against sequential trips.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.interpolate import interp1d
+
+pytest.importorskip('osgeo')  # imported by preprocessing
+
+from preprocessing.densification import densify, _balancedChunks
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(1)
+    trips = []
+    for trip in range(40):
+        n = rng.integers(1, 60)
+        time = np.sort(rng.choice(np.arange(n * 5), n, replace=False)).astype(float)
+        trips.append(pd.DataFrame({
+            'vehID': trip % 7,
+            'tripID': trip,
+            'time[s]': time,
+            'lon': 116.3 + np.cumsum(rng.normal(0, 1e-4, n)),
+            'lat': 39.9 + np.cumsum(rng.normal(0, 1e-4, n)),
+            'speed[km/h]': rng.uniform(0, 60, n),
+        }))
+    traj = pd.concat(trips).sample(frac=1, random_state=0).reset_index(drop=True)  # trips interleaved
+    return pd.concat([traj, traj.iloc[:5]], ignore_index=True)  # duplicated points
+
+
+@pytest.mark.parametrize('nWorkers', [3, None])
+def test_densifyParallel(traj, nWorkers):
+    traj = traj.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True)
+    expected = densify(traj, nWorkers=1)
+    pd.testing.assert_frame_equal(densify(traj, nWorkers=nWorkers, chunksPerWorker=2), expected)
+
+
+def test_balancedChunks():
+    sizes = [50, 1, 30, 20, 20, 9, 8, 2]
+    chunks = _balancedChunks(sizes, 3)
+    assert sorted(k for chunk in chunks for k in chunk) == list(range(len(sizes)))
+    assert max(sum(sizes[k] for k in chunk) for chunk in chunks) == 50  # the largest trip alone
+    assert len(_balancedChunks(sizes[:2], 5)) == 2
+
+
+def _densifyUnit(traj, lonCol='lon', latCol='lat', timeCol='time[s]', interpFunc='cubic'):
+    """
+    the row-wise densification replaced by the time arrays of densifyUnit.
+    """
+    traj = traj.drop_duplicates(keep='first')
+    lon, lat, time = traj[lonCol], traj[latCol], traj[timeCol]
+    if len(time) == 1:
+        return traj
+    interpFunc = interpFunc if len(time) > 3 else 'linear'
+    pathLen = int(traj.iloc[-1][timeCol] - traj.iloc[0][timeCol] + 1)
+    time_ = np.array([traj.iloc[0][timeCol] + i for i in range(pathLen)])
+    trajDict = {col: [traj.iloc[0][col]] * pathLen for col in traj.columns if col not in (lonCol, latCol, timeCol)}
+    trajDict[timeCol] = time_
+    trajDict[lonCol] = interp1d(time, lon, interpFunc)(time_)
+    trajDict[latCol] = interp1d(time, lat, interpFunc)(time_)
+    return pd.DataFrame(trajDict)
+
+
+@pytest.mark.parametrize('interpFunc', ['cubic', 'linear'])
+def test_densifyUnit(traj, interpFunc):
+    traj = traj.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True)
+    result = densify(traj, interpFunc=interpFunc)
+
+    expected = pd.concat([_densifyUnit(trip, interpFunc=interpFunc) for _, trip in traj.groupby('tripID')])
+    expected = expected.sort_values(['vehID', 'tripID', 'time[s]'], ignore_index=True)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
@@ -0,0 +1,283 @@
+'''
+Equivalence checks of the vectorized coordinate transforms and the tiled DEM sampling
+against the scalar implementations they replace.
+'''
+
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('osgeo')  # imported by preprocessing
+
+from preprocessing.geo import gcj02_to_bd09, bd09_to_gcj02, wgs84_to_gcj02, gcj02_to_wgs84, bd09_to_wgs84, wgs84_to_bd09, out_of_china, PI, x_PI, a, ee
+from preprocessing.geo import grade2traj, DEMSampler, _fillNearest, TiledRaster, NpyTileStore
+import preprocessing.geo as geo
+from preprocessing.smoothing import expSmooth
+
+
+def _outOfChina(lng, lat):
+    return not (lng > 73.66 and lng < 135.05 and lat > 3.86 and lat < 53.55)
+
+
+def _transformlat(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + 0.1 * lng * lat + 0.2 * math.sqrt(math.fabs(lng))
+    ret += (20.0 * math.sin(6.0 * lng * PI) + 20.0 * math.sin(2.0 * lng * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(lat * PI) + 40.0 * math.sin(lat / 3.0 * PI)) * 2.0 / 3.0
+    ret += (160.0 * math.sin(lat / 12.0 * PI) + 320 * math.sin(lat * PI / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _transformlng(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + 0.1 * lng * lat + 0.1 * math.sqrt(math.fabs(lng))
+    ret += (20.0 * math.sin(6.0 * lng * PI) + 20.0 * math.sin(2.0 * lng * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(lng * PI) + 40.0 * math.sin(lng / 3.0 * PI)) * 2.0 / 3.0
+    ret += (150.0 * math.sin(lng / 12.0 * PI) + 300.0 * math.sin(lng / 30.0 * PI)) * 2.0 / 3.0
+    return ret
+
+
+def _offset(lng, lat):
+    if _outOfChina(lng, lat):
+        return 0.0, 0.0
+    dlat = _transformlat(lng - 105.0, lat - 35.0)
+    dlng = _transformlng(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * PI
+    magic = 1 - ee * math.sin(radlat) ** 2
+    sqrtmagic = math.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * PI)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * math.cos(radlat) * PI)
+    return dlng, dlat
+
+
+def _gcj02_to_bd09(lng, lat):
+    z = math.sqrt(lng * lng + lat * lat) + 0.00002 * math.sin(lat * x_PI)
+    theta = math.atan2(lat, lng) + 0.000003 * math.cos(lng * x_PI)
+    return [z * math.cos(theta) + 0.0065, z * math.sin(theta) + 0.006]
+
+
+def _bd09_to_gcj02(bd_lon, bd_lat):
+    x, y = bd_lon - 0.0065, bd_lat - 0.006
+    z = math.sqrt(x * x + y * y) - 0.00002 * math.sin(y * x_PI)
+    theta = math.atan2(y, x) - 0.000003 * math.cos(x * x_PI)
+    return [z * math.cos(theta), z * math.sin(theta)]
+
+
+def _awayFromBorder(lng, lat, margin=0.1):
+    corners = [out_of_china(lng + dx, lat + dy) for dx in (-margin, margin) for dy in (-margin, margin)]
+    return np.all(corners, axis=0) | ~np.any(corners, axis=0)
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    lng, lat = rng.uniform(60, 150, 50000), rng.uniform(-5, 60, 50000)  # inside and outside China, more than one block
+    lng[:3], lat[:3] = [73.66, 116.3, 135.05], [39.9, 3.86, 53.55]  # on the border
+    return lng, lat
+
+
+def test_outOfChina(points):
+    lng, lat = points
+    np.testing.assert_array_equal(out_of_china(lng, lat), [_outOfChina(*p) for p in zip(lng, lat)])
+    assert out_of_china(116.3, 39.9) == False and not out_of_china(116.3, 39.9)
+    assert out_of_china(0.0, 0.0) == True
+
+
+def test_wgs84_gcj02(points):
+    lng, lat = points
+    expected = np.array([_offset(*p) for p in zip(lng, lat)])
+
+    gcj = np.array(wgs84_to_gcj02(lng, lat)).T
+    np.testing.assert_allclose(gcj, np.column_stack([lng, lat]) + expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(gcj02_to_wgs84(lng, lat), (np.column_stack([lng, lat]) - expected).T, rtol=0, atol=1e-12)
+    assert wgs84_to_gcj02(116.3, 39.9) == pytest.approx([116.3 + _offset(116.3, 39.9)[0], 39.9 + _offset(116.3, 39.9)[1]], abs=1e-12)
+
+    # the iterative inverse returns to WGS84, except next to the border where the offset is switched on or off
+    away = _awayFromBorder(lng, lat)
+    np.testing.assert_allclose(np.array(gcj02_to_wgs84(*gcj.T, precise=True))[:, away], [lng[away], lat[away]], rtol=0, atol=1e-8)
+
+
+def test_bd09(points):
+    lng, lat = points
+    np.testing.assert_allclose(np.array(gcj02_to_bd09(lng, lat)).T, [_gcj02_to_bd09(*p) for p in zip(lng, lat)], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(np.array(bd09_to_gcj02(lng, lat)).T, [_bd09_to_gcj02(*p) for p in zip(lng, lat)], rtol=0, atol=1e-12)
+    away = _awayFromBorder(lng, lat)
+    np.testing.assert_allclose(np.array(bd09_to_wgs84(*wgs84_to_bd09(lng, lat), precise=True))[:, away], [lng[away], lat[away]], rtol=0, atol=1e-5)
+
+
+def _fillNearestLoop(values, seg):
+    # scan each trip for the closest valid value, the earlier one on ties
+    values, seg = list(values), list(seg)
+    result = list(values)
+    for i, v in enumerate(values):
+        if not np.isnan(v):
+            continue
+        for d in range(1, len(values)):
+            near = [j for j in (i - d, i + d) if 0 <= j < len(values) and seg[j] == seg[i] and not np.isnan(values[j])]
+            if near:
+                result[i] = values[near[0]]
+                break
+    return np.array(result)
+
+
+class _NaNSampler(DEMSampler):
+    # elevations with NaN gaps, standing in for points out of the raster
+    def __init__(self, ele):
+        self.ele = ele
+
+    def sample(self, lon, lat):
+        return self.ele.copy()
+
+
+def _traj():
+    rng = np.random.default_rng(7)
+    n = 60
+    ele = 50 + np.cumsum(rng.normal(0, 1, n))
+    ele[[0, 1, 7, 8, 9, 25, 30, 31, 59]] = np.nan
+    ele[40:50] = np.nan  # a trip out of the DEM
+    traj = pd.DataFrame({
+        'tripID': np.repeat([1, 2, 3, 4], [20, 20, 10, 10]),
+        'lon': np.linspace(116, 116.1, n),
+        'lat': np.linspace(39, 39.1, n),
+        'dist': rng.uniform(5, 20, n),
+    })
+    return traj, ele
+
+
+def test_fillNearest():
+    traj, ele = _traj()
+    expected = _fillNearestLoop(ele, traj['tripID'])
+    np.testing.assert_array_equal(_fillNearest(ele, traj['tripID'].to_numpy()), expected)
+    assert np.isnan(expected[40:50]).all() and not np.isnan(np.delete(expected, range(40, 50))).any()
+    np.testing.assert_array_equal(_fillNearest(ele), _fillNearestLoop(ele, np.zeros(len(ele))))
+    assert len(_fillNearest([])) == 0
+
+
+def test_grade2traj():
+    traj, ele = _traj()
+    traj['dist[km]'] = traj['dist'] / 1000
+    result = grade2traj(traj.copy(), _NaNSampler(ele), segCol='tripID')
+
+    # elevations of each trip filled and smoothed on their own
+    smoothed = np.concatenate([
+        expSmooth(_fillNearestLoop(trip, np.zeros(len(trip))), alpha=0.7)
+        for trip in np.split(ele, [20, 40, 50])
+    ])
+    np.testing.assert_allclose(result['ele[m]'], smoothed)
+    grade = np.arctan(pd.Series(smoothed).diff(-1) / traj['dist'])
+    np.testing.assert_allclose(result['grade[D]'], grade.astype('float32'), rtol=1e-6)
+    assert np.isfinite(result['grade[D]'].to_numpy()[:39]).all()  # the gaps do not spread along the trips
+
+
+class _Band():
+    # numpy stand-in of a gdal raster band, counting the window reads
+    def __init__(self, pixels, nodata=None):
+        self.pixels, self.nodata = pixels, nodata
+        self.YSize, self.XSize = pixels.shape
+        self.reads = 0
+
+    def GetNoDataValue(self):
+        return self.nodata
+
+    def ReadAsArray(self, xoff=0, yoff=0, w=None, h=None):
+        self.reads += 1
+        w = self.XSize if w is None else w
+        h = self.YSize if h is None else h
+        return self.pixels[yoff:yoff + h, xoff:xoff + w].copy()
+
+
+class _Dataset():
+    # north-up raster of 30 m pixels
+    def __init__(self, pixels, nodata=None):
+        self.band = _Band(pixels, nodata)
+
+    def GetRasterBand(self, i):
+        return self.band
+
+    def GetProjection(self):
+        return 'stand-in'
+
+    def GetGeoTransform(self):
+        return (0.0, 30.0, 0.0, self.band.YSize * 30.0, 0.0, -30.0)
+
+
+class _Transformation():
+    # stand-in projection of lat, lon to meters
+    def __init__(self, src, dst):
+        pass
+
+    def TransformPoint(self, lat, lon):
+        return (lon - 116) * 1e5, (lat - 39) * 1e5, 0.0
+
+    def TransformPoints(self, points):
+        return [self.TransformPoint(lat, lon) for lat, lon in points]
+
+
+class _SpatialReference():
+    def ImportFromWkt(self, wkt):
+        pass
+
+    def CloneGeogCS(self):
+        return self
+
+
+@pytest.fixture
+def dem(monkeypatch):
+    monkeypatch.setattr(geo, 'osr', SimpleNamespace(SpatialReference=_SpatialReference, CoordinateTransformation=_Transformation))
+    rng = np.random.default_rng(3)
+    pixels = rng.uniform(0, 500, (250, 310)).astype('float32')
+    pixels[100:110, 200:220] = -9999
+    return _Dataset(pixels, nodata=-9999.0)
+
+
+def test_tiledRaster(dem):
+    pixels, band = dem.band.pixels, dem.band
+    rng = np.random.default_rng(5)
+    row, col = rng.integers(0, 250, 1000), rng.integers(0, 310, 1000)
+    raster = TiledRaster(band, tileSize=64, maxTiles=4)
+    np.testing.assert_array_equal(raster.gather(row, col), pixels[row, col])
+    assert len(raster.tiles) == 4
+
+    # a cached tile is not read again
+    reads = band.reads
+    tileRow, tileCol = next(reversed(raster.tiles))
+    row, col = np.array([tileRow * 64 + 5]), np.array([tileCol * 64 + 7])
+    np.testing.assert_array_equal(raster.gather(row, col), pixels[row, col])
+    assert band.reads == reads
+    assert len(raster.gather(np.array([], dtype='int64'), np.array([], dtype='int64'))) == 0
+
+
+def test_npyTileStore(dem, tmp_path):
+    pixels = dem.band.pixels
+    rng = np.random.default_rng(5)
+    row, col = rng.integers(0, 250, 1000), rng.integers(0, 310, 1000)
+    path = str(tmp_path / 'dem.npy')
+    store = NpyTileStore.build(dem, path, tileSize=64)
+    assert store.shape == pixels.shape and store.nodata == -9999 and store.geoTransform == dem.GetGeoTransform()
+    np.testing.assert_array_equal(store.gather(row, col), pixels[row, col])
+    np.testing.assert_array_equal(NpyTileStore(path).gather(row, col), pixels[row, col])
+
+
+def test_sample(dem, tmp_path):
+    # the per-point lookup through a full ReadAsArray, replaced by DEMSampler
+    rng = np.random.default_rng(5)
+    traj = pd.DataFrame({'lon': rng.uniform(116, 116.093, 500), 'lat': rng.uniform(39, 39.075, 500)})
+    eleMap = geo.dem2ele(dem)
+    expected = traj.apply(lambda x: geo.eleMatch(x, dem, eleMap), axis=1).to_numpy().astype('float64')
+    expected[expected == -9999] = np.nan
+
+    store = NpyTileStore.build(dem, str(tmp_path / 'dem.npy'), tileSize=64)
+    for sampler in [DEMSampler(dem, tileSize=64, maxTiles=2), DEMSampler(str(tmp_path / 'dem.npy'))]:
+        np.testing.assert_array_equal(sampler.sample(traj['lon'], traj['lat']), expected)
+
+    # out of the raster
+    assert np.isnan(DEMSampler(dem).sample(np.array([115.9, 116.05]), np.array([39.05, 39.1]))).all()
+
+    # bilinear interpolation hits the pixel values at pixel centers
+    row, col = rng.integers(0, 250, 100), rng.integers(0, 310, 100)
+    lon, lat = 116 + (col + 0.5) * 30 / 1e5, 39 + (250 - row - 0.5) * 30 / 1e5
+    ele = DEMSampler(dem, bilinear=True).sample(lon, lat)
+    pixels = dem.band.pixels[row, col].astype('float64')
+    pixels[pixels == -9999] = np.nan
+    np.testing.assert_allclose(ele, pixels, rtol=1e-6)
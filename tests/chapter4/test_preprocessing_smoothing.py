@@ -0,0 +1,131 @@
+'''
+Equivalence checks of the vectorized smoothing against the loops it replaces.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('osgeo')  # imported by preprocessing
+
+from preprocessing.smoothing import expSmooth, doubleExpSmooth, KalmanSmooth, smooth, _holtFilter
+
+
+def _expSmooth(indices, alpha=0.3):
+    result = [indices[0]]
+    for i in range(1, len(indices)):
+        result.append(alpha * result[i-1] + (1 - alpha) * indices[i])
+    return result
+
+
+def _doubleExpSmooth(indices, alpha=0.3, beta=0.1):
+    result = [indices[0]]
+    for i in range(1, len(indices)):
+        if i == 1:
+            level, trend = indices[0], indices[1] - indices[0]
+            value = indices[0]
+        else:
+            value = indices[i]
+        level_, level = level, alpha * value + (1 - alpha) * (level + trend)
+        trend = beta * (level - level_) + (1 - beta) * trend
+        result.append(level + trend)
+    return result
+
+
+def _kalmanSmooth(indices, Q=0.01, R=0.01):
+    xhat, P = [indices[0]], 1
+    for k in range(1, len(indices)):
+        P_ = P + Q
+        K = P_ / (P_ + R)
+        xhat.append(xhat[-1] + K * (indices[k] - xhat[-1]))
+        P = (1 - K) * P_
+    return xhat
+
+
+def _perSegment(func, x, seg, **params):
+    # the old per-trip loop over contiguous segments
+    starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    return np.concatenate([func(list(part), **params) for part in np.split(x, starts[1:])])
+
+
+@pytest.fixture
+def series():
+    """
+    random walks of contiguous segments, short ones included.
+    return: values and segment labels
+    """
+    rng = np.random.default_rng(11)
+    lengths = [1, 2, 3, 17, 1, 400, 60]
+    x = np.cumsum(rng.normal(0, 1, sum(lengths))) + 30
+    seg = np.repeat(np.arange(len(lengths)) * 3 + 5, lengths)
+    return x, seg
+
+
+@pytest.mark.parametrize('alpha', [0.3, 0.7, 0.95])
+def test_expSmooth(series, alpha):
+    x, seg = series
+    np.testing.assert_allclose(expSmooth(x, alpha), _expSmooth(list(x), alpha), rtol=1e-12)
+    np.testing.assert_allclose(expSmooth(x, alpha, seg=seg), _perSegment(_expSmooth, x, seg, alpha=alpha), rtol=1e-12)
+
+    # NaN stays in its own segment
+    x = x.copy()
+    x[30] = np.nan
+    np.testing.assert_allclose(expSmooth(x, alpha, seg=seg), _perSegment(_expSmooth, x, seg, alpha=alpha), rtol=1e-12)
+
+
+@pytest.mark.parametrize('alpha, beta', [(0.3, 0.1), (0.7, 0.5), (0.1, 0.9), (0.9, 0.05)])
+def test_doubleExpSmooth(series, alpha, beta):
+    x, seg = series
+    np.testing.assert_allclose(doubleExpSmooth(x, alpha, beta), _doubleExpSmooth(list(x), alpha, beta), rtol=1e-9)
+    np.testing.assert_allclose(
+        doubleExpSmooth(x, alpha, beta, seg=seg), _perSegment(_doubleExpSmooth, x, seg, alpha=alpha, beta=beta), rtol=1e-9
+    )
+
+    x = x.copy()
+    x[30] = np.nan
+    np.testing.assert_allclose(
+        doubleExpSmooth(x, alpha, beta, seg=seg), _perSegment(_doubleExpSmooth, x, seg, alpha=alpha, beta=beta), rtol=1e-9
+    )
+
+
+@pytest.mark.parametrize('alpha, beta', [(0.3, 0.1), (0.7, 0.5), (0.1, 0.9)])
+def test_holtFilter(alpha, beta):
+    # level and trend recurrences restarted from a given state at each segment start
+    rng = np.random.default_rng(12)
+    value = rng.normal(0, 1, 300)
+    starts = np.array([0, 1, 40, 41, 200])
+    state = rng.normal(0, 1, (len(starts), 2))
+
+    expected = []
+    for k, part in enumerate(np.split(value, starts[1:])):
+        level, trend = state[k]
+        for v in part:
+            level_, level = level, alpha * v + (1 - alpha) * (level + trend)
+            trend = beta * (level - level_) + (1 - beta) * trend
+            expected.append(level + trend)
+    np.testing.assert_allclose(_holtFilter(value, alpha, beta, starts, state), expected, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('Q, R', [(0.01, 0.01), (1e-4, 1), (1, 1e-3)])
+def test_KalmanSmooth(series, Q, R):
+    x, seg = series
+    np.testing.assert_allclose(KalmanSmooth(x, Q, R), _kalmanSmooth(list(x), Q, R), rtol=1e-9)
+    np.testing.assert_allclose(KalmanSmooth(x, Q, R, seg=seg), _perSegment(_kalmanSmooth, x, seg, Q=Q, R=R), rtol=1e-9)
+
+
+@pytest.mark.parametrize('smoothFunc, params', [('exp', {'alpha': 0.5}), ('dexp', {'alpha': 0.3, 'beta': 0.1}), ('kal', {'Q': 0.01, 'R': 0.1})])
+def test_smooth(series, smoothFunc, params):
+    x, seg = series
+    traj = pd.DataFrame({'tripID': seg, 'speed[km/h]': x, 'acc[m/s2]': np.gradient(x)})
+    traj = traj.sample(frac=1, random_state=0).reset_index(drop=True)  # trips interleaved
+    func = {'exp': _expSmooth, 'dexp': _doubleExpSmooth, 'kal': _kalmanSmooth}[smoothFunc]
+
+    # the old loop over trips
+    expected = traj.copy()
+    for id in traj['tripID'].unique():
+        trip = traj[traj['tripID'] == id]
+        for col in ['speed[km/h]', 'acc[m/s2]']:
+            expected.loc[trip.index, col] = func(trip[col].to_list(), **params)
+
+    result = smooth(traj, smoothCol=['speed[km/h]', 'acc[m/s2]'], smoothFunc=smoothFunc, **params)
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
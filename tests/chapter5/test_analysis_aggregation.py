@@ -0,0 +1,186 @@
+'''
+Equivalence checks of the one-pass aggregations against filtering the trajectory once per group.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('geopandas')  # imported by analysis
+
+from analysis import Aggregator
+from analysis.calculation import groupSum, groupMean, groupStd
+
+OPMODEID_LIST = [0, 1, 11, 12, 13, 14, 15, 16, 21, 22, 23, 24, 25, 27, 28, 29, 30, 33, 35, 37, 38, 39, 40]
+
+
+def _binCount(df, col, bins):
+    return np.array([df[(df[col] >= minV) & (df[col] < maxV)].shape[0] for minV, maxV in zip(bins[:-1], bins[1:])])
+
+
+def _decelBinCount(df, col):
+    return np.array([df[(df[col] > -bin) & (df[col] <= -bin + 0.1)].shape[0] for bin in np.arange(0.1, 4.6, 0.1)])
+
+
+def _OpModeCount(df, col):
+    counts = df[col].value_counts()
+    return np.array([counts.get(id, 0) for id in OPMODEID_LIST])
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 3000
+    traj = pd.DataFrame({
+        'hour': rng.integers(0, 24, n),
+        'highway': rng.choice(['primary', 'secondary', 'trunk'], n),
+        'braking': rng.random(n) < 0.3,
+        'dist[km]': rng.uniform(0, 0.03, n),
+        'speed[km/h]': rng.uniform(0, 150, n),
+        'acc[m/s2]': rng.normal(0, 1.5, n),
+        'VSP[kW/t]': rng.normal(5, 15, n),
+        'OpModeID': rng.choice(OPMODEID_LIST, n),
+    })
+    traj.loc[::53, 'dist[km]'] = np.nan
+    traj.loc[::71, 'hour'] = np.nan
+    return traj
+
+
+def _groups(traj, refCol):
+    keys = [refCol] if isinstance(refCol, str) else refCol
+    return traj.dropna(subset=keys).groupby(keys, sort=True)
+
+
+@pytest.mark.parametrize('refCol', ['hour', ['hour', 'highway']])
+def test_binAgg(traj, refCol):
+    agg = Aggregator()
+    result = agg.binAgg(traj, refCol)
+
+    groups = _groups(traj, refCol)
+    assert list(result.index) == list(groups.groups)
+    for key, df in groups:
+        row = result.loc[key]
+        brake = df[df['braking'] == True]
+        assert row['trajCount'] == len(df)
+        assert row['brakeCount'] == len(brake)
+        assert row['brakeEventNum'] == (df['braking'].to_numpy()[1:] != df['braking'].to_numpy()[:-1]).sum() // 2
+        assert row['mileage'] == pytest.approx(df['dist[km]'].sum())
+        np.testing.assert_array_equal(row['speedBinCount'], _binCount(df, 'speed[km/h]', agg.SPEED_BIN))
+        np.testing.assert_array_equal(row['accBinCount'], _binCount(df, 'acc[m/s2]', agg.ACC_BIN))
+        np.testing.assert_array_equal(row['VSPBinCount'], _binCount(df, 'VSP[kW/t]', agg.VSP_BIN))
+        np.testing.assert_array_equal(row['brakeDecelBinCount'], _decelBinCount(brake, 'acc[m/s2]'))
+        np.testing.assert_array_equal(row['OpModeCount'], _OpModeCount(df, 'OpModeID'))
+
+
+def test_statAgg(traj):
+    result = Aggregator().statAgg(traj, 'hour')
+
+    for key, df in _groups(traj, 'hour'):
+        row = result.loc[key]
+        assert row['trajCount'] == len(df)
+        assert row['mileage'] == pytest.approx(df['dist[km]'].sum())
+        assert row['speedMean'] == pytest.approx(df['speed[km/h]'].mean())
+        assert row['accMean'] == pytest.approx(df['acc[m/s2]'].mean())
+        assert row['VSPMean'] == pytest.approx(df['VSP[kW/t]'].mean())
+        assert row['brakeDecelMean'] == pytest.approx(df[df['braking'] == True]['acc[m/s2]'].mean())
+        np.testing.assert_array_equal(row['OpModeCount'], _OpModeCount(df, 'OpModeID'))
+
+
+def test_groupStats(traj):
+    group = traj['hour'].fillna(-1).to_numpy(dtype='int64')
+    values = traj['dist[km]']
+    expected = values.groupby(traj['hour']).agg(['sum', 'mean', 'std']).reindex(range(24))
+    np.testing.assert_allclose(groupSum(values, group, 24), expected['sum'])
+    np.testing.assert_allclose(groupMean(values, group, 24), expected['mean'])
+    np.testing.assert_allclose(groupStd(values, group, 24), expected['std'])
+
+
+def _haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.deg2rad, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371009 * np.arcsin(np.sqrt(a))
+
+
+def test_nodeAgg(traj):
+    gpd = pytest.importorskip('geopandas')
+    rng = np.random.default_rng(1)
+    traj['lon'] = 116.3 + rng.uniform(0, 0.005, len(traj))
+    traj['lat'] = 39.9 + rng.uniform(0, 0.005, len(traj))
+    nodeLon, nodeLat = 116.3 + rng.uniform(0, 0.005, 30), 39.9 + rng.uniform(0, 0.005, 30)
+    nodes = gpd.GeoDataFrame({'osmid': np.arange(30) + 100}, geometry=gpd.points_from_xy(nodeLon, nodeLat))
+
+    result = Aggregator().nodeAgg(traj, nodes, dist=40)
+
+    assert list(result.index) == list(range(100, 130))
+    for id, x, y in zip(nodes['osmid'], nodeLon, nodeLat):
+        df = traj[_haversine(traj['lon'], traj['lat'], x, y) <= 40]  # rows within the node buffer, in row order
+        row = result.loc[id]
+        assert row['trajCount'] == len(df)
+        assert row['brakeCount'] == (df['braking'] == True).sum()
+        assert row['brakeEventNum'] == (df['braking'].to_numpy()[1:] != df['braking'].to_numpy()[:-1]).sum() // 2
+        assert row['mileage'] == pytest.approx(df['dist[km]'].sum())
+        assert row['speedMean'] == pytest.approx(df['speed[km/h]'].mean(), nan_ok=True)
+        assert row['brakeDecelMean'] == pytest.approx(df[df['braking'] == True]['acc[m/s2]'].mean(), nan_ok=True)
+        np.testing.assert_array_equal(row['OpModeCount'], _OpModeCount(df, 'OpModeID'))
+
+
+def _tripAgg(traj, maxMileage):
+    """
+    the per-trip loop replaced by Aggregator.tripAgg, trips in sorted order.
+    """
+    dict_agg = {}
+    for id in sorted(traj['tripID'].dropna().unique()):
+        df = traj[traj['tripID'] == id].copy()
+        if df['dist[km]'].sum() <= maxMileage:
+            continue
+        df['dist_cum'] = df['dist[km]'].cumsum()
+        cumMileage = df['dist_cum'].iloc[-1]
+        segID = np.array([df[df['dist_cum'] >= maxM].index[0] for maxM in maxMileage * np.arange(0, cumMileage//maxMileage+1)])
+        for id0, id1 in zip(segID[:-1], segID[1:]):
+            df_ = df.loc[id0:id1]
+            brake = df_['braking'] == True
+            decel = df_[df_['acc[m/s2]'] < 0]['acc[m/s2]']
+            status = np.r_[False, df_['braking'].to_numpy()[1:] != df_['braking'].to_numpy()[:-1]]
+            row = {
+                'vehID': df_.iloc[0]['vehID'],
+                'startHour': df_.iloc[0]['hour'],
+                'trajCount': len(df_),
+                'brakeCount': brake.sum(),
+                'idlingCount': (df_['OpModeID'] == 1).sum(),
+                'brakeEventNum': status.sum() // 2,
+                'mileage': df_['dist[km]'].sum(),
+                'speed_mean': df_['speed[km/h]'].mean(),
+                'speed_std': df_['speed[km/h]'].std(),
+                'acc_mean': df_['acc[m/s2]'].mean(),
+                'acc_std': df_['acc[m/s2]'].std(),
+                'decel_mean': np.abs(decel.mean()),
+                'decel_std': decel.std(),
+                'VSP_mean': df_['VSP[kW/t]'].mean(),
+                'VSP_std': df_['VSP[kW/t]'].std(),
+                'initSpeed_mean': df_[brake.to_numpy() & status]['speed[km/h]'].mean(),
+                'brakeDecel_mean': np.abs(df_[brake]['acc[m/s2]'].mean()),
+                'brakeDecel_std': df_[brake]['acc[m/s2]'].std(),
+                'grade_mean': df_['grade[D]'].mean(),
+                'grade_std': df_['grade[D]'].std(),
+                'OpModeCount': _OpModeCount(df_, 'OpModeID'),
+            }
+            for key, value in row.items():
+                dict_agg.setdefault(key, []).append(value)
+    return pd.DataFrame(dict_agg).fillna(0)
+
+
+@pytest.mark.parametrize('maxMileage', [0.5, 0.2])
+def test_tripAgg(traj, maxMileage):
+    rng = np.random.default_rng(2)
+    traj['tripID'] = rng.integers(0, 12, len(traj)).astype(float)  # interleaved trips
+    traj.loc[::97, 'tripID'] = np.nan
+    traj['vehID'] = traj['tripID'] // 3
+    traj['grade[D]'] = rng.normal(0, 2, len(traj))
+
+    result = Aggregator().tripAgg(traj, maxMileage=maxMileage)
+    expected = _tripAgg(traj, maxMileage)
+
+    assert len(result) == len(expected) > 0
+    for col in expected.columns.drop('OpModeCount'):
+        np.testing.assert_allclose(result[col].to_numpy(dtype='float64'), expected[col].to_numpy(dtype='float64'), err_msg=col)
+    np.testing.assert_array_equal(np.stack(result['OpModeCount']), np.stack(expected['OpModeCount']))
@@ -0,0 +1,65 @@
+'''
+Equivalence checks of the vectorized bin counts against filtering the trajectory once per bin.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('geopandas')  # imported by analysis
+
+from analysis.calculation import getBinCount, getDecelBinCount, getOpModeCount, getGroupCode
+
+OPMODEID_LIST = [0, 1, 11, 12, 13, 14, 15, 16, 21, 22, 23, 24, 25, 27, 28, 29, 30, 33, 35, 37, 38, 39, 40]
+
+
+@pytest.fixture
+def traj():
+    rng = np.random.default_rng(0)
+    n = 2000
+    traj = pd.DataFrame({
+        'hour': rng.integers(0, 5, n),
+        'speed[km/h]': np.round(rng.uniform(-5, 160, n), 1),  # values on the edges
+        'acc[m/s2]': np.round(rng.normal(-1, 1.5, n), 1),
+        'OpModeID': pd.array(rng.choice(OPMODEID_LIST + [99], n), dtype='Int8'),
+    })
+    traj.loc[::37, 'speed[km/h]'] = np.nan
+    traj.loc[::41, 'OpModeID'] = pd.NA
+    return traj
+
+
+def test_getBinCount(traj):
+    bins = np.arange(0, 155, 5)
+    expected = [traj[(traj['speed[km/h]'] >= minV) & (traj['speed[km/h]'] < maxV)].shape[0] for minV, maxV in zip(bins[:-1], bins[1:])]
+    np.testing.assert_array_equal(getBinCount(traj, 'speed[km/h]', bins), expected)
+
+    # descending bins are counted between consecutive edges
+    bins = np.arange(-1, -15, -1) / 2.236936
+    expected = [traj[(traj['acc[m/s2]'] >= minV) & (traj['acc[m/s2]'] < maxV)].shape[0] for minV, maxV in zip(bins[1:], bins[:-1])]
+    np.testing.assert_array_equal(getBinCount(traj, 'acc[m/s2]', bins), expected)
+
+
+def test_getDecelBinCount(traj):
+    # edges are rounded so that values on an edge fall in exactly one bin
+    bins = np.round(np.arange(0.1, 4.6, 0.1), 10)
+    expected = [traj[(traj['acc[m/s2]'] > -bin) & (traj['acc[m/s2]'] <= np.round(-bin + 0.1, 10))].shape[0] for bin in bins]
+    np.testing.assert_array_equal(getDecelBinCount(traj, 'acc[m/s2]'), expected)
+
+
+def test_getOpModeCount(traj):
+    counts = traj['OpModeID'].value_counts()
+    expected = [counts.loc[id] if id in counts.index else 0 for id in OPMODEID_LIST]
+    np.testing.assert_array_equal(getOpModeCount(traj, 'OpModeID'), expected)
+
+
+def test_groupedCounts(traj):
+    group, index = getGroupCode(traj, 'hour')
+    bins = np.arange(0, 155, 5)
+    speed = getBinCount(traj, 'speed[km/h]', bins, group)
+    decel = getDecelBinCount(traj, 'acc[m/s2]', group)
+    OpMode = getOpModeCount(traj, 'OpModeID', group)
+    for i, key in enumerate(index):
+        df = traj[traj['hour'] == key]
+        np.testing.assert_array_equal(speed[i], getBinCount(df, 'speed[km/h]', bins))
+        np.testing.assert_array_equal(decel[i], getDecelBinCount(df, 'acc[m/s2]'))
+        np.testing.assert_array_equal(OpMode[i], getOpModeCount(df, 'OpModeID'))